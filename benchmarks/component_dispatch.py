@@ -0,0 +1,31 @@
+"""Measure the cost of looking up and constructing components through a writer,
+compared with calling the component type directly.
+
+Usage: python benchmarks/component_dispatch.py [repeat]
+"""
+import sys
+import timeit
+
+from io import BytesIO
+
+from psims.mzml import MzMLWriter
+
+
+def main(repeat=200000):
+    writer = MzMLWriter(BytesIO())
+    writer.begin()
+    scan_list_type = writer.ScanList.type
+    context = writer.context
+
+    cases = [
+        ("attribute lookup", lambda: writer.ScanList),
+        ("construct through writer", lambda: writer.ScanList([])),
+        ("construct directly", lambda: scan_list_type([], context=context)),
+    ]
+    for name, case in cases:
+        best = min(timeit.repeat(case, number=repeat, repeat=5))
+        print("%-26s %8.1f ns" % (name, best / repeat * 1e9))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,50 @@
+"""Measure prefix, substring and approximate term search over the vendored
+BRENDA Tissue Ontology, the largest vocabulary shipped with psims.
+
+Selective queries, and broad queries with a ``limit``, should each take well
+under a millisecond. Without a limit, a broad query costs time in proportion
+to the number of matches it returns.
+
+Usage: python benchmarks/term_search.py [repeat]
+"""
+import sys
+import timeit
+
+from psims.controlled_vocabulary.controlled_vocabulary import (
+    ControlledVocabulary, _use_vendored_bto_obo)
+
+
+CASES = [
+    ("prefix", "liv", None),
+    ("substring", "liver", None),
+    ("substring", "epithel", None),
+    ("substring", "cell", 20),
+    ("substring", "ce", 20),
+    ("substring", "c", 20),
+    ("substring", "cell", None),
+    ("approximate", "ear", None),
+    ("approximate", "livr", None),
+    ("approximate", "brian", None),
+    ("approximate", "hepatocite", None),
+]
+
+
+def main(repeat=200):
+    cv = ControlledVocabulary.from_obo(_use_vendored_bto_obo(), lazy=True)
+    index = cv.search_index
+    # build the indices used by short queries before timing them
+    index.substring("c")
+    index.approximate("ear")
+    for mode, query, limit in CASES:
+        search = getattr(index, mode)
+
+        def case():
+            return search(query, limit=limit)
+
+        best = min(timeit.repeat(case, number=repeat, repeat=5))
+        print("%-12s %-12r limit=%-5s %8.3f ms %6d matches" % (
+            mode, query, limit, best / repeat * 1e3, len(case())))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
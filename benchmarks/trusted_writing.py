@@ -0,0 +1,60 @@
+"""Measure building and writing MS2 spectra with and without trusted mode.
+
+Trusted mode saves the work of checking each spectrum's params when it is
+built. The components are still constructed and serialized the same way,
+so the params resolved for that check are reused when the spectrum is
+written, and the end-to-end cost of writing is much the same either way.
+
+Usage: python benchmarks/trusted_writing.py [repeat]
+"""
+import itertools
+import sys
+import timeit
+
+from io import BytesIO
+
+import numpy as np
+
+from psims.mzml import MzMLWriter
+
+
+MZ_ARRAY = np.linspace(100, 2000, 200)
+INTENSITY_ARRAY = np.random.random(200) * 1e4
+
+
+def open_writer(trusted):
+    writer = MzMLWriter(BytesIO(), trusted=trusted)
+    writer.begin()
+    writer.controlled_vocabularies()
+    writer.file_description(["MSn spectrum"])
+    writer.software_list([writer.Software(version="0.0.0", id='psims', params=['python-psims'])])
+    writer.instrument_configuration_list([writer.InstrumentConfiguration(id=1, component_list=[])])
+    writer.data_processing_list([writer.DataProcessing(processing_methods=[
+        dict(order=0, software_reference='psims', params=['Conversion to mzML'])], id=1)])
+    writer.run(id='benchmark').__enter__()
+    writer.spectrum_list().__enter__()
+    return writer
+
+
+def main(repeat=500):
+    params = [{"name": "ms level", "value": 2}, "MSn spectrum"]
+    precursor = {"mz": 500.0, "intensity": 10.0, "charge": 2}
+    for trusted in (False, True):
+        writer = open_writer(trusted)
+        scan_ids = itertools.count()
+
+        def build():
+            return writer.spectrum(
+                MZ_ARRAY, INTENSITY_ARRAY, id='scan=%d' % next(scan_ids), scan_start_time=0.1, params=params,
+                scan_window_list=[(100, 2000)], precursor_information=precursor)
+
+        def write():
+            build().write(writer.writer)
+
+        for name, case in (("build", build), ("build and write", write)):
+            best = min(timeit.repeat(case, number=repeat, repeat=5))
+            print("trusted=%-5s %-16s %8.1f us" % (trusted, name, best / repeat * 1e6))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,222 @@
+"""asyncio front-ends for the document writers.
+
+Every call made on an asynchronous writer is run on a thread dedicated to that
+writer, one at a time and in the order the calls were made, so encoding arrays
+and writing to disk do not block the event loop while documents are still
+written exactly as they would be synchronously.
+
+.. code-block:: python
+
+    async with AsyncMzMLWriter(open("out.mzML", 'wb'), close=True) as writer:
+        await writer.controlled_vocabularies()
+        ...
+        async with writer.run(id="run"):
+            async with writer.spectrum_list(count=len(scans)):
+                for scan in scans:
+                    await writer.write_spectrum(**scan)
+
+.. note::
+    Requires Python 3.7 or newer.
+"""
+import asyncio
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+
+from psims.mzml.writer import MzMLWriter
+from psims.mzid.writer import MzIdentMLWriter
+
+
+class WriteQueue(object):
+    """Runs calls on a single worker thread in the order they were submitted,
+    admitting at most :attr:`max_pending` calls that have not yet finished.
+
+    The first call to fail is re-raised by every later :meth:`submit` and :meth:`drain`.
+
+    Attributes
+    ----------
+    executor : :class:`concurrent.futures.ThreadPoolExecutor`
+        The single-threaded executor the calls are run on
+    max_pending : int
+        The number of unfinished calls after which :meth:`submit` waits
+    pending : set
+        The futures of the unfinished calls
+    error : Exception
+        The error raised by the first call to fail, if any
+    """
+
+    def __init__(self, max_pending=64):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.max_pending = max_pending
+        self.pending = set()
+        self.error = None
+        # created on first use, so it belongs to the loop the writer is used from
+        self._slots = None
+
+    async def submit(self, fn, *args, **kwargs):
+        """Wait for room in the queue, then schedule ``fn(*args, **kwargs)``.
+
+        Returns
+        -------
+        :class:`asyncio.Future`
+            Resolves to the result of the call
+        """
+        if self.error is not None:
+            raise self.error
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        await self._slots.acquire()
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(fn, *args, **kwargs))
+        self.pending.add(future)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        self.pending.discard(future)
+        self._slots.release()
+        if not future.cancelled():
+            error = future.exception()
+            if error is not None and self.error is None:
+                self.error = error
+
+    async def drain(self):
+        """Wait for every submitted call to finish."""
+        if self.pending:
+            await asyncio.wait(list(self.pending))
+        if self.error is not None:
+            raise self.error
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class AsyncSection(object):
+    """Enters and exits a document section through a :class:`WriteQueue`,
+    for use with ``async with``.
+    """
+
+    def __init__(self, queue, factory, *args, **kwargs):
+        self.queue = queue
+        self.factory = functools.partial(factory, *args, **kwargs)
+        self.section = None
+
+    def _enter(self):
+        self.section = self.factory()
+        self.section.__enter__()
+
+    def _exit(self, exc_type, exc_value, traceback):
+        self.section.__exit__(exc_type, exc_value, traceback)
+
+    async def __aenter__(self):
+        await self.queue.submit(self._enter)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.queue.submit(self._exit, exc_type, exc_value, traceback)
+
+
+class AsyncProxy(object):
+    """Presents the methods of an object as coroutines which run them through a
+    :class:`WriteQueue`.
+
+    Methods whose names start with ``write`` return as soon as the call is queued,
+    with a future for its result, so that many can be in flight at once. The arguments
+    passed to them must not be modified until they have been written. Other methods
+    wait for their result. Section methods return an :class:`AsyncSection`. Component
+    types and other attributes are returned as they are.
+    """
+
+    _section_methods = frozenset()
+    _proxied_results = {}
+
+    def __init__(self, queue, target):
+        self._queue = queue
+        self._target = target
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name in self._section_methods:
+            return functools.partial(AsyncSection, self._queue, attr)
+        if not callable(attr) or name[:1].isupper():
+            return attr
+        queue = self._queue
+        if name.startswith("write"):
+            async def enqueue(*args, **kwargs):
+                return await queue.submit(attr, *args, **kwargs)
+            return enqueue
+        wrapper = self._proxied_results.get(name)
+
+        async def call(*args, **kwargs):
+            result = await (await queue.submit(attr, *args, **kwargs))
+            if wrapper is not None:
+                result = wrapper(queue, result)
+            return result
+        return call
+
+
+class AsyncWriterBase(AsyncProxy):
+    """The base class for asynchronous document writers, which wrap an instance of
+    :attr:`writer_type` constructed with the same arguments.
+
+    Attributes
+    ----------
+    writer : :class:`~.XMLDocumentWriter`
+        The wrapped writer
+    """
+
+    writer_type = None
+
+    def __init__(self, outfile, *args, max_pending=64, **kwargs):
+        super(AsyncWriterBase, self).__init__(
+            WriteQueue(max_pending), self.writer_type(outfile, *args, **kwargs))
+
+    @property
+    def writer(self):
+        return self._target
+
+    async def flush(self):
+        """Wait for every queued call to finish, and flush the output."""
+        await self._queue.drain()
+        await (await self._queue.submit(self._target.flush))
+
+    async def __aenter__(self):
+        await (await self._queue.submit(self._target.begin))
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        try:
+            await self._queue.drain()
+        finally:
+            # the document is closed even if a queued call failed
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(
+                    self._queue.executor, self._target.__exit__, exc_type, exc_value, traceback)
+            finally:
+                self._queue.shutdown()
+
+
+class AsyncMzMLWriter(AsyncWriterBase):
+    """An asynchronous front-end for :class:`~.MzMLWriter`, taking the same arguments
+    and an optional ``max_pending`` limit on the number of queued calls.
+
+    :meth:`~.PlainMzMLWriter.spectrum_template` returns a template whose
+    :meth:`~.SpectrumTemplate.write` is queued as well.
+    """
+
+    writer_type = MzMLWriter
+    _section_methods = frozenset(["run", "spectrum_list", "chromatogram_list"])
+    _proxied_results = {"spectrum_template": AsyncProxy}
+
+
+class AsyncMzIdentMLWriter(AsyncWriterBase):
+    """An asynchronous front-end for :class:`~.MzIdentMLWriter`, taking the same arguments
+    and an optional ``max_pending`` limit on the number of queued calls.
+    """
+
+    writer_type = MzIdentMLWriter
+    _section_methods = frozenset([
+        "analysis_protocol_collection", "sequence_collection", "analysis_collection",
+        "data_collection", "analysis_sample_collection", "analysis_data",
+        "spectrum_identification_list", "protein_detection_list"])
@@ -0,0 +1,110 @@
+from array import array
+from bisect import bisect_left
+
+
+class IsAClosure(object):
+    """The transitive closure of the ``is_a`` relation over a set of terms.
+
+    Each term is assigned an integer index, and the ancestors of each term are
+    stored as a sorted :class:`array.array` of indices, so checking whether one
+    term is a sub-type of another is a binary search over a handful of integers.
+    The inverse mapping, from a term to all of its descendants, is built the first
+    time it is requested.
+
+    Attributes
+    ----------
+    keys : list
+        The term ids, in index order
+    index : dict
+        Maps term id to its integer index
+    ancestors : list of :class:`array.array`
+        The sorted indices of all transitive ``is_a`` parents of each term
+    """
+
+    def __init__(self, keys, parent_keys):
+        self.keys = list(keys)
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        self.ancestors = self._build_ancestors(parent_keys)
+        self._descendants = None
+
+    @classmethod
+    def from_vocabulary(cls, vocabulary):
+        return cls(vocabulary.keys(), vocabulary.parent_keys)
+
+    def _build_ancestors(self, parent_keys):
+        index = self.index
+        parents = []
+        for key in self.keys:
+            parents.append([index[p] for p in parent_keys(key) if p in index])
+        n = len(self.keys)
+        closure = [None] * n
+        visiting = [False] * n
+        for root in range(n):
+            if closure[root] is not None:
+                continue
+            # iterative post-order traversal so that deep hierarchies do not
+            # exhaust the interpreter's recursion limit
+            stack = [(root, False)]
+            while stack:
+                i, expanded = stack.pop()
+                if closure[i] is not None:
+                    continue
+                if expanded:
+                    acc = set(parents[i])
+                    for p in parents[i]:
+                        if closure[p] is not None:
+                            acc.update(closure[p])
+                    closure[i] = acc
+                elif not visiting[i]:
+                    # mark as in-progress to tolerate cycles
+                    visiting[i] = True
+                    stack.append((i, True))
+                    for p in parents[i]:
+                        if closure[p] is None:
+                            stack.append((p, False))
+        return [array('i', sorted(acc)) for acc in closure]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def is_a(self, key, ancestor):
+        """Test whether ``key`` is ``ancestor`` or one of its transitive descendants.
+
+        Parameters
+        ----------
+        key : str
+            The id of the term to test
+        ancestor : str
+            The id of the putative ancestor term
+
+        Returns
+        -------
+        bool
+        """
+        try:
+            i = self.index[key]
+            j = self.index[ancestor]
+        except KeyError:
+            return False
+        if i == j:
+            return True
+        ancestors = self.ancestors[i]
+        k = bisect_left(ancestors, j)
+        return k < len(ancestors) and ancestors[k] == j
+
+    def ancestor_keys(self, key):
+        keys = self.keys
+        return [keys[i] for i in self.ancestors[self.index[key]]]
+
+    def _build_descendants(self):
+        descendants = [[] for i in range(len(self.keys))]
+        for i, ancestors in enumerate(self.ancestors):
+            for j in ancestors:
+                descendants[j].append(i)
+        self._descendants = [array('i', d) for d in descendants]
+
+    def descendant_keys(self, key):
+        if self._descendants is None:
+            self._build_descendants()
+        keys = self.keys
+        return [keys[i] for i in self._descendants[self.index[key]]]
@@ -1,10 +1,22 @@
+import io
 import os
+import json
+import threading
+import warnings
 import pkg_resources
+from contextlib import closing
+from multiprocessing.pool import ThreadPool
 try:
-    from urllib2 import urlopen, URLError, Request
+    from urllib2 import urlopen, URLError, Request, HTTPError
 except ImportError:
     from urllib.request import urlopen, URLError, Request
-from .obo import OBOParser
+    from urllib.error import HTTPError
+from six import string_types as basestring
+
+from .entity import Entity
+from .obo import OBOParser, LazyTermStore, CompactTermStore, synonym_parser
+from .closure import IsAClosure
+from .search import TermSearchIndex
 from . import unimod
 
 
@@ -28,6 +40,10 @@ def _use_vendored_unimod_xml():
     return pkg_resources.resource_stream(__name__, "vendor/unimod_tables.xml")
 
 
+def _vendored_unimod_snapshot_path():
+    return pkg_resources.resource_filename(__name__, "vendor/unimod_tables.sqlite")
+
+
 def _use_vendored_xlmod_obo():
     return pkg_resources.resource_stream(__name__, "vendor/XLMOD.obo")
 
@@ -72,11 +88,54 @@ class ControlledVocabulary(object):
         Unique identifier for this collection
     """
     @classmethod
-    def from_obo(cls, handle):
-        parser = OBOParser(handle)
+    def from_obo(cls, handle, lazy=False, compact=False, roots=None, loader=None):
+        """Parse an OBO file stream into a :class:`ControlledVocabulary`.
+
+        Parameters
+        ----------
+        handle : file-like
+            The binary stream to read the OBO file from
+        lazy : bool, optional
+            Whether to defer building each :class:`~.Entity` until it is first
+            accessed. Lazily built entities hold their ``children`` in a lazily
+            resolved sequence rather than a :class:`list`. Defaults to :const:`False`,
+            though the ``load_*`` functions of this module parse lazily.
+        compact : bool, optional
+            Whether to keep terms in a :class:`~.CompactTermStore`, which interns
+            strings and stores ``is_a`` and ``relationship`` edges as indices, trading
+            some access time for a much smaller resident size. Implies ``lazy``.
+            Defaults to :const:`False`.
+        roots : list, optional
+            The ids or names of terms to restrict the vocabulary to. Only these terms,
+            the terms beneath them and their ancestors are kept. A query for any other
+            term reloads the full vocabulary using ``loader``.
+        loader : Callable, optional
+            A function returning a new handle to the full vocabulary when a query
+            falls outside of ``roots``, which is closed once read. If omitted, and
+            ``handle`` is seekable, a copy of its contents is kept to read instead.
+
+        Returns
+        -------
+        :class:`ControlledVocabulary`
+        """
+        if roots is not None and loader is None:
+            # the caller owns ``handle`` and may close it, so keep a copy to reload from
+            try:
+                start = handle.tell()
+                content = handle.read()
+                handle.seek(start)
+
+                def loader():
+                    return io.BytesIO(content)
+            except (AttributeError, IOError, OSError):
+                loader = None
+        parser = OBOParser(handle, lazy=lazy, compact=compact, roots=roots)
         inst = cls(parser.terms, metadata=parser.header, version=parser.version, name=parser.name)
         if len(parser.terms) == 0:
             raise ValueError("Empty Vocabulary")
+        if roots is not None:
+            inst.roots = list(roots)
+            inst._loader = loader
         return inst
 
     def __init__(self, terms, id=None, metadata=None, version=None, name=None):
@@ -87,6 +146,11 @@ class ControlledVocabulary(object):
         self.version = version
         self.name = name
         self._terms = dict()
+        self._synonyms = None
+        self._closure = None
+        self._search_index = None
+        self.roots = None
+        self._loader = None
         self.terms = terms
         self.id = id
         self.metadata = metadata
@@ -94,25 +158,66 @@ class ControlledVocabulary(object):
     def __getitem__(self, key):
         return self.query(key)
 
+    def is_restricted(self):
+        """Whether only the terms beneath :attr:`roots` have been loaded"""
+        return self.roots is not None
+
+    def load_full(self):
+        """Replace a vocabulary restricted to :attr:`roots` with the complete
+        vocabulary, read from the loader given to :meth:`from_obo`.
+
+        Raises
+        ------
+        KeyError
+            If the vocabulary is restricted but there is no way to read it again
+        """
+        if not self.is_restricted():
+            return
+        if self._loader is None:
+            raise KeyError("The full vocabulary cannot be reloaded")
+        with closing(self._loader()) as handle:
+            parser = OBOParser(
+                handle, lazy=self.is_lazy(),
+                compact=isinstance(self._terms, CompactTermStore))
+        self.roots = None
+        self._loader = None
+        self.terms = parser.terms
+
     def query(self, key):
         try:
-            return self.terms[key]
+            return self._query(key)
+        except KeyError as err:
+            if not self.is_restricted() or self._loader is None:
+                raise
+            error = err
+        try:
+            self.load_full()
+        except (IOError, OSError, ValueError):
+            # the full vocabulary could not be read, so stop trying to
+            self._loader = None
+            raise error
+        return self._query(key)
+
+    def _query(self, key):
+        terms = self.terms
+        try:
+            return terms[key]
         except KeyError as e:
             try:
-                return self._names[key]
+                return terms[self._names[key]]
             except KeyError:
                 try:
-                    return self._names[self.normalize_name(key)]
+                    return terms[self._names[self.normalize_name(key)]]
                 except KeyError as e2:
                     lower_key = key.lower()
                     try:
-                        return self._synonyms[lower_key]
+                        return terms[self.synonyms[lower_key]]
                     except KeyError:
                         try:
-                            return self.terms[lower_key]
+                            return terms[lower_key]
                         except KeyError:
                             try:
-                                return self._obsolete_names[lower_key]
+                                return terms[self._obsolete_names[lower_key]]
                             except KeyError:
                                 err = KeyError("%s and %s were not found." % (e, e2))
                                 # suppress intense Py3 exception chain without using raise-from syntax
@@ -133,41 +238,265 @@ class ControlledVocabulary(object):
 
     @terms.setter
     def terms(self, value):
-        self._terms = dict(value or {})
+        if isinstance(value, (LazyTermStore, dict)):
+            self._terms = value
+        else:
+            self._terms = dict(value or {})
         self._reindex()
 
+    def is_lazy(self):
+        return isinstance(self._terms, LazyTermStore)
+
+    def _peek(self, key, field, default=None):
+        """Read a field of a term without forcing a lazily parsed term
+        to be materialized.
+        """
+        if self.is_lazy():
+            return self._terms.peek(key, field, default)
+        return self._terms[key].get(field, default)
+
     def _reindex(self):
         self._bind_terms()
         self._build_names()
-        self._build_case_normalized()
-        self._build_synonyms()
+        self._synonyms = None
+        self._closure = None
+        self._search_index = None
 
     def _build_names(self):
-        self._names = {
-            v['name']: v for v in self.terms.values()
-            if not v.get("is_obsolete", False)
-        }
-        self._obsolete_names = {
-            v['name'].lower(): v for v in self.terms.values()
-            if v.get("is_obsolete", False)
-        }
+        names = self._names = {}
+        obsolete_names = self._obsolete_names = {}
+        normalized = self._normalized = {}
+        if self.is_lazy():
+            peek = self._terms.peek
+            fields = [(key, peek(key, 'name'), peek(key, 'is_obsolete', False))
+                      for key in self._terms.keys()]
+        else:
+            fields = [(key, term.data.get('name'), term.data.get('is_obsolete', False))
+                      for key, term in self._terms.items()]
+        for key, name, is_obsolete in fields:
+            if name is None:
+                continue
+            lower_name = name.lower()
+            normalized[lower_name] = name
+            if is_obsolete:
+                obsolete_names[lower_name] = key
+            else:
+                names[name] = key
 
     def _bind_terms(self):
+        if self.is_lazy():
+            self.terms.vocabulary = self
+            return
         for term in self.terms.values():
             term.vocabulary = self
 
+    @property
+    def synonyms(self):
+        """A mapping from case-folded synonym to term id, built on first use.
+
+        Returns
+        -------
+        dict
+        """
+        if self._synonyms is None:
+            self._build_synonyms()
+        return self._synonyms
+
     def _build_synonyms(self):
         self._synonyms = {}
-        for term in self.terms.values():
-            if term.get('synonym'):
-                for synonym in term.get('synonym'):
-                    self._synonyms[synonym.lower()] = term
+        for key in self.terms.keys():
+            synonyms = self._peek(key, 'synonym')
+            if not synonyms:
+                continue
+            if isinstance(synonyms, basestring):
+                synonyms = [synonyms]
+            for synonym in synonyms:
+                if self.is_lazy():
+                    synonym = synonym_parser(synonym)
+                self._synonyms[synonym.lower()] = key
+
+    def parent_keys(self, key):
+        """The ids of the direct ``is_a`` parents of a term.
+
+        Parameters
+        ----------
+        key : str
+            The term id
+
+        Returns
+        -------
+        list
+        """
+        if self.is_lazy():
+            return self._terms.parent_keys(key)
+        is_a = self._terms[key].get('is_a')
+        if is_a is None:
+            return []
+        if isinstance(is_a, (list, tuple)):
+            return [getattr(r, 'accession', r) for r in is_a]
+        return [getattr(is_a, 'accession', is_a)]
 
-    def _build_case_normalized(self):
-        self._normalized = {
-            v['name'].lower(): v['name']
-            for v in self.terms.values()
-        }
+    @property
+    def closure(self):
+        """The transitive ``is_a`` closure of this vocabulary, built on first use.
+
+        Returns
+        -------
+        :class:`~.IsAClosure`
+        """
+        if self._closure is None:
+            self._closure = IsAClosure.from_vocabulary(self)
+        return self._closure
+
+    def _resolve_key(self, key):
+        if key in self._terms:
+            return key
+        try:
+            key = key.accession
+            if key in self._terms:
+                return key
+        except AttributeError:
+            pass
+        return self.query(key)['id']
+
+    def is_of_type(self, key, tp):
+        """Test whether the term ``key`` is ``tp`` or one of its transitive ``is_a``
+        descendants.
+
+        Parameters
+        ----------
+        key : str or :class:`~.Entity`
+            The term, or its id, name or synonym
+        tp : str or :class:`~.Entity`
+            The parent term, or its id, name or synonym
+
+        Returns
+        -------
+        bool
+        """
+        if isinstance(key, Entity):
+            key = key.id
+        if isinstance(tp, Entity):
+            tp = tp.id
+        index = self.closure.index
+        if key not in index or tp not in index:
+            try:
+                key = self._resolve_key(key)
+                tp = self._resolve_key(tp)
+            except KeyError:
+                return False
+        # resolving may have replaced a restricted vocabulary with the full one
+        return self.closure.is_a(key, tp)
+
+    def ancestors(self, key):
+        """All transitive ``is_a`` parents of a term
+
+        Parameters
+        ----------
+        key : str
+            The term id, name or synonym
+
+        Returns
+        -------
+        list of :class:`~.Entity`
+        """
+        return [self.terms[k] for k in self.closure.ancestor_keys(self._resolve_key(key))]
+
+    def descendants(self, key):
+        """All terms which are transitively ``is_a`` the given term
+
+        Parameters
+        ----------
+        key : str
+            The term id, name or synonym
+
+        Returns
+        -------
+        list of :class:`~.Entity`
+        """
+        return [self.terms[k] for k in self.closure.descendant_keys(self._resolve_key(key))]
+
+    @property
+    def search_index(self):
+        """The name and synonym :class:`~.TermSearchIndex` of this vocabulary,
+        built on first use.
+
+        Returns
+        -------
+        :class:`~.TermSearchIndex`
+        """
+        if self._search_index is None:
+            self._search_index = TermSearchIndex.from_vocabulary(self)
+        return self._search_index
+
+    def search(self, query, mode='prefix', limit=None, max_distance=2):
+        """Search term names and synonyms, ignoring case.
+
+        Parameters
+        ----------
+        query : str
+            The text to search for
+        mode : str, optional
+            One of "prefix", "substring" or "approximate". Defaults to "prefix".
+        limit : int, optional
+            The maximum number of terms to return
+        max_distance : int, optional
+            The largest edit distance accepted in "approximate" mode. Defaults to 2.
+
+        Returns
+        -------
+        list of :class:`~.Entity`
+            Each matching term once, in order of its best match
+        """
+        index = self.search_index
+        if mode == 'prefix':
+            matches = index.prefix(query)
+        elif mode == 'substring':
+            matches = index.substring(query)
+        elif mode == 'approximate':
+            matches = index.approximate(query, max_distance=max_distance)
+        else:
+            raise ValueError("Unknown search mode %r" % (mode,))
+        seen = set()
+        result = []
+        for match in matches:
+            if match.key in seen:
+                continue
+            seen.add(match.key)
+            result.append(self.terms[match.key])
+            if limit is not None and len(result) >= limit:
+                break
+        return result
+
+    def lookup_tables(self):
+        """Build the tables which resolve any query this vocabulary accepts
+        to a term id, mirroring the precedence of :meth:`query`.
+
+        A query ``key`` resolves to ``exact[key]`` if present, otherwise
+        ``folded[key.lower()]``.
+
+        Returns
+        -------
+        exact : dict
+            Maps accessions and names to term ids
+        folded : dict
+            Maps case-folded names, synonyms, lower-case accessions and obsolete names
+            to term ids
+        """
+        exact = dict(self._names)
+        for key in self.terms.keys():
+            exact[key] = key
+        folded = dict(self._obsolete_names)
+        for key in self.terms.keys():
+            if key.lower() == key:
+                folded[key] = key
+        folded.update(self.synonyms)
+        for lower_name, name in self._normalized.items():
+            try:
+                folded[lower_name] = self._names[name]
+            except KeyError:
+                continue
+        return exact, folded
 
     def keys(self):
         return self.terms.keys()
@@ -182,6 +511,15 @@ class ControlledVocabulary(object):
         return self._normalized[name.lower()]
 
 
+def _replace(source, destination):
+    try:
+        os.replace(source, destination)
+    except AttributeError:
+        if os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+
+
 DEFAULT_USER_AGENT = (
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like'
     ' Gecko) Chrome/68.0.3440.106 Safari/537.36')
@@ -203,14 +541,25 @@ class OBOCache(object):
         which will be called instead of opening the
         URL to retrieve the :class:`ControlledVocabulary`
         object.
+    timeout : float
+        The number of seconds to wait on a connection before giving up
+    chunk_size : int
+        The number of bytes to read from a connection at a time when
+        writing a download to the cache
     """
 
-    def __init__(self, cache_path='.obo_cache', enabled=True, resolvers=None, user_agent_emulation=True):
+    manifest_name = "manifest.json"
+
+    def __init__(self, cache_path='.obo_cache', enabled=True, resolvers=None, user_agent_emulation=True,
+                 timeout=60.0, chunk_size=2 ** 16):
         self._cache_path = None
         self.cache_path = cache_path
         self.enabled = enabled
         self.resolvers = resolvers or {}
         self.user_agent_emulation = user_agent_emulation
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self._manifest_lock = threading.RLock()
 
     @property
     def cache_path(self):
@@ -230,13 +579,18 @@ class OBOCache(object):
             name += '.obo'
         return os.path.join(self.cache_path, name)
 
+    def _request(self, uri, headers=None):
+        headers = dict(headers or {})
+        if self.user_agent_emulation:
+            headers['User-Agent'] = DEFAULT_USER_AGENT
+        req = Request(uri, headers=headers)
+        if self.timeout is None:
+            return urlopen(req)
+        return urlopen(req, timeout=self.timeout)
+
     def _open_url(self, uri):
         try:
-            headers = {}
-            if self.user_agent_emulation:
-                headers['User-Agent'] = DEFAULT_USER_AGENT
-            req = Request(uri, headers=headers)
-            f = urlopen(req)
+            f = self._request(uri)
             code = None
             # The keepalive library monkey patches urllib2's urlopen and returns
             # an object with a different API. First handle the normal case, then
@@ -266,6 +620,157 @@ class OBOCache(object):
     def has_custom_resolver(self, uri):
         return uri in self.resolvers
 
+    @property
+    def manifest_path(self):
+        return os.path.join(self.cache_path, self.manifest_name)
+
+    def read_manifest(self):
+        """Read the record of where and when each cached URI was fetched from.
+
+        Returns
+        -------
+        dict
+            Maps URI to a dict with the keys "path", "etag" and "last_modified"
+        """
+        with self._manifest_lock:
+            try:
+                with open(self.manifest_path, 'r') as fh:
+                    return json.load(fh)
+            except (IOError, OSError, ValueError):
+                return {}
+
+    def _update_manifest(self, uri, entry):
+        with self._manifest_lock:
+            manifest = self.read_manifest()
+            manifest[uri] = entry
+            tmp = self.manifest_path + '.tmp'
+            with open(tmp, 'w') as fh:
+                json.dump(manifest, fh, indent=2, sort_keys=True)
+            _replace(tmp, self.manifest_path)
+
+    def _write_stream(self, f, name):
+        tmp = name + '.part'
+        n_chars = 0
+        try:
+            with open(tmp, 'wb') as cache_f:
+                while True:
+                    chunk = f.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    n_chars += len(chunk)
+                    cache_f.write(chunk)
+            if n_chars < 5:
+                raise ValueError("No bytes written")
+            _replace(tmp, name)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return n_chars
+
+    def fetch(self, uri, revalidate=True):
+        """Download ``uri`` into the cache, streaming it to disk in chunks.
+
+        If ``uri`` is already cached and ``revalidate`` is :const:`True`, a conditional
+        request is made with the ETag and Last-Modified values recorded in the manifest,
+        and the cached copy is kept if the server reports it has not changed.
+
+        Parameters
+        ----------
+        uri : str
+            The URI to fetch
+        revalidate : bool, optional
+            Whether to check an existing cached copy for changes. If :const:`False`,
+            an existing copy is used as-is.
+
+        Returns
+        -------
+        str
+            The path to the cached file
+        """
+        name = self.path_for(uri)
+        cached = os.path.exists(name) and os.path.getsize(name) > 0
+        if cached and not revalidate:
+            return name
+        headers = {}
+        entry = self.read_manifest().get(uri, {}) if cached else {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            f = self._request(uri, headers)
+        except HTTPError as err:
+            if err.code == 304 and cached:
+                return name
+            raise ValueError("%s did not resolve: %s" % (uri, err))
+        except (URLError, IOError) as err:
+            raise ValueError("%s did not resolve: %s" % (uri, err))
+        try:
+            code = f.getcode()
+            if code == 304 and cached:
+                return name
+            if code != 200:
+                raise ValueError("%s did not resolve" % uri)
+            self._write_stream(f, name)
+            info = f.info()
+        finally:
+            f.close()
+        self._update_manifest(uri, {
+            "path": os.path.basename(name),
+            "etag": info.get("ETag"),
+            "last_modified": info.get("Last-Modified"),
+        })
+        return name
+
+    def prefetch(self, uris, revalidate=True, n_workers=4):
+        """Download or refresh several vocabularies concurrently.
+
+        URIs with a custom resolver are skipped. A URI which cannot be fetched
+        raises a warning instead of an error, leaving any existing cached copy
+        in place.
+
+        Parameters
+        ----------
+        uris : Iterable of str
+            The URIs to fetch
+        revalidate : bool, optional
+            Whether to check existing cached copies for changes. Defaults to :const:`True`.
+        n_workers : int, optional
+            The number of downloads to run at once. Defaults to 4.
+
+        Returns
+        -------
+        dict
+            Maps each URI successfully fetched to the path of its cached file
+        """
+        if not self.enabled:
+            raise ValueError("Cannot prefetch when the cache is disabled")
+        uris = [uri for uri in uris if uri not in self.resolvers]
+        if not uris:
+            return {}
+        # create the cache directory before the workers race to
+        self.path_for(uris[0])
+
+        def task(uri):
+            try:
+                return uri, self.fetch(uri, revalidate=revalidate), None
+            except Exception as err:
+                return uri, None, err
+
+        pool = ThreadPool(max(1, min(n_workers, len(uris))))
+        try:
+            results = pool.map(task, uris)
+        finally:
+            pool.close()
+            pool.join()
+        paths = {}
+        for uri, path, err in results:
+            if err is not None:
+                warnings.warn("Could not prefetch %s: %s" % (uri, err))
+            else:
+                paths[uri] = path
+        return paths
+
     def resolve(self, uri):
         if uri in self.resolvers:
             return self.resolvers[uri](self)
@@ -276,13 +781,10 @@ class OBOCache(object):
                     return open(name, 'rb')
                 else:
                     f = self._open_url(uri)
-                    with open(name, 'wb') as cache_f:
-                        n_chars = 0
-                        for i, line in enumerate(f.readlines()):
-                            n_chars += len(line)
-                            cache_f.write(line)
-                        if n_chars < 5:
-                            raise ValueError("No bytes written")
+                    try:
+                        self._write_stream(f, name)
+                    finally:
+                        f.close()
                     if os.path.getsize(name) > 0:
                         return open(name, 'rb')
                     else:
@@ -316,10 +818,14 @@ def resolve_unimod(cache):
         except IOError:
             return unimod.Unimod(path, _use_vendored_unimod_xml())
     else:
-        try:
-            return unimod.Unimod()
-        except IOError:
-            return unimod.Unimod(None, _use_vendored_unimod_xml())
+        # the vendored snapshot opens far faster than any XML can be parsed, so it is
+        # used whenever it was built from the vendored XML under the current schema
+        with closing(_use_vendored_unimod_xml()) as snapshot_source:
+            try:
+                return unimod.Unimod(
+                    snapshot_path=_vendored_unimod_snapshot_path(), snapshot_source=snapshot_source)
+            except IOError:
+                return unimod.Unimod(None, _use_vendored_unimod_xml())
 
 
 obo_cache = OBOCache(enabled=False)
@@ -341,25 +847,25 @@ def register_resolver(name, fn):
 def load_psims():
     try:
         cv = obo_cache.resolve(("https://raw.githubusercontent.com/HUPO-PSI/psi-ms-CV/master/psi-ms.obo"))
-        return ControlledVocabulary.from_obo(cv)
+        return ControlledVocabulary.from_obo(cv, lazy=True)
     except TypeError:
         cv = _use_vendored_psims_obo()
-        return ControlledVocabulary.from_obo(cv)
+        return ControlledVocabulary.from_obo(cv, lazy=True)
 
 
 def load_uo():
     cv = obo_cache.resolve("http://ontologies.berkeleybop.org/uo.obo")
-    return ControlledVocabulary.from_obo(cv)
+    return ControlledVocabulary.from_obo(cv, lazy=True)
 
 
 def load_pato():
     cv = obo_cache.resolve("http://ontologies.berkeleybop.org/pato.obo")
-    return ControlledVocabulary.from_obo(cv)
+    return ControlledVocabulary.from_obo(cv, lazy=True)
 
 
 def load_xlmod():
     cv = obo_cache.resolve("https://raw.githubusercontent.com/HUPO-PSI/mzIdentML/master/cv/XLMOD.obo")
-    return ControlledVocabulary.from_obo(cv)
+    return ControlledVocabulary.from_obo(cv, lazy=True)
 
 
 def load_unimod():
@@ -368,14 +874,14 @@ def load_unimod():
 
 def load_bto():
     cv = obo_cache.resolve("http://www.brenda-enzymes.info/ontology/tissue/tree/update/update_files/BrendaTissueOBO")
-    return ControlledVocabulary.from_obo(cv)
+    return ControlledVocabulary.from_obo(cv, lazy=True)
 
 
 def load_go():
     cv = obo_cache.resolve("http://purl.obolibrary.org/obo/go.obo")
-    return ControlledVocabulary.from_obo(cv)
+    return ControlledVocabulary.from_obo(cv, lazy=True)
 
 
 def load_psimod():
     cv = obo_cache.resolve("https://raw.githubusercontent.com/HUPO-PSI/psi-mod-CV/master/PSI-MOD.obo")
-    return ControlledVocabulary.from_obo(cv)
+    return ControlledVocabulary.from_obo(cv, lazy=True)
@@ -71,6 +71,16 @@ class Entity(Mapping):
         return template.format(self=self)
 
     def is_of_type(self, tp):
+        if isinstance(tp, Entity):
+            tp = tp.id
+        try:
+            # use the vocabulary's precomputed is_a closure when it has one
+            is_of_type = self.vocabulary.is_of_type
+        except AttributeError:
+            return self._walk_is_of_type(tp)
+        return is_of_type(self.id, tp)
+
+    def _walk_is_of_type(self, tp):
         try:
             tp = self.vocabulary[tp]
         except KeyError:
@@ -82,3 +92,36 @@ class Entity(Mapping):
                 return True
             stack.extend(ensure_iterable(ref.parent()))
         return False
+
+
+class TermView(Entity):
+    """An :class:`Entity` built on demand from a compact term store, which
+    records any values assigned to it back into that store so they survive
+    the view being discarded.
+
+    Attributes
+    ----------
+    store : object
+        The term store this view was built from
+    key : str
+        The id of the term this view presents
+    """
+
+    def __init__(self, store, key, vocabulary=None, **attributes):
+        Entity.__init__(self, vocabulary, **attributes)
+        object.__setattr__(self, "store", store)
+        object.__setattr__(self, "key", key)
+
+    def __setattr__(self, key, value):
+        if key in ("store", "key"):
+            object.__setattr__(self, key, value)
+        else:
+            Entity.__setattr__(self, key, value)
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.store.overrides.setdefault(self.key, {})[key] = value
+
+    def setdefault(self, key, value):
+        if key not in self.data:
+            self[key] = value
@@ -1,10 +1,19 @@
+import io
 import warnings
+import weakref
 
+from array import array
 from collections import defaultdict
 
+try:
+    from collections import Mapping, Sequence
+except ImportError:
+    from collections.abc import Mapping, Sequence
+
 from six import string_types as basestring
+from six.moves import intern
 
-from .entity import Entity
+from .entity import Entity, TermView
 from .relationship import Relationship, Reference
 from .type_definition import parse_xsdtype
 
@@ -64,9 +73,482 @@ def synonym_parser(text):
     return synonym
 
 
+def _reference_accession(text):
+    """Extract the accession from an ``is_a`` reference string without building
+    a :class:`~.Reference`.
+    """
+    return text.split("!", 1)[0].strip()
+
+
+def subtree_keys(roots, keys, parent_keys, child_keys, name_of=None):
+    """Find the terms reachable beneath a set of root terms through ``is_a``
+    edges, together with every ancestor of those terms.
+
+    Parameters
+    ----------
+    roots : Iterable of str
+        The ids, or names if ``name_of`` is given, of the root terms
+    keys : Iterable of str
+        The ids of all terms
+    parent_keys : Callable
+        Maps a term id to the ids of its ``is_a`` parents
+    child_keys : Callable
+        Maps a term id to the ids of its ``is_a`` children
+    name_of : Callable, optional
+        Maps a term id to its name, used to resolve roots given by name
+
+    Returns
+    -------
+    set
+    """
+    keys = set(keys)
+    roots = list(roots)
+    if name_of is not None and any(root not in keys for root in roots):
+        names = {}
+        for key in keys:
+            name = name_of(key)
+            if name is not None:
+                names[name] = key
+        roots = [root if root in keys else names.get(root, root) for root in roots]
+    missing = [root for root in roots if root not in keys]
+    if missing:
+        raise KeyError("Root terms %r were not found" % (missing,))
+    keep = set()
+    stack = list(roots)
+    while stack:
+        key = stack.pop()
+        if key in keep:
+            continue
+        keep.add(key)
+        stack.extend(child_keys(key))
+    stack = list(keep)
+    while stack:
+        for parent in parent_keys(stack.pop()):
+            if parent in keys and parent not in keep:
+                keep.add(parent)
+                stack.append(parent)
+    return keep
+
+
+class LazyEntityList(Sequence):
+    """A sequence of term ids from a :class:`LazyTermStore` which are only
+    materialized as :class:`~.Entity` objects when they are accessed.
+
+    Attributes
+    ----------
+    store : :class:`LazyTermStore`
+        The term store to resolve ids against
+    keys : list
+        The term ids in this sequence
+    """
+
+    def __init__(self, store, keys):
+        self.store = store
+        self.keys = keys
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.store[k] for k in self.keys[i]]
+        return self.store[self.keys[i]]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.keys)
+
+
+class LazyTermStore(Mapping):
+    """A mapping from term id to :class:`~.Entity` which holds each term's raw
+    stanza and only builds the full :class:`~.Entity`, including parsing its
+    :class:`~.Reference`, :class:`~.Relationship` and synonym values, the first
+    time that term is accessed.
+
+    Attributes
+    ----------
+    parser : :class:`OBOParser`
+        The parser used to pack stanzas into :class:`~.Entity` objects
+    stanzas : dict
+        Maps term id to the raw key-value lists of that term's stanza
+    entities : dict
+        Maps term id to the :class:`~.Entity` objects materialized so far
+    child_map : defaultdict(list)
+        Maps term id to the ids of the terms which declare it as their ``is_a`` parent
+    vocabulary : object
+        The vocabulary that materialized :class:`~.Entity` objects are bound to
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.stanzas = dict()
+        self.entities = dict()
+        self.child_map = defaultdict(list)
+        self._vocabulary = parser
+
+    @property
+    def vocabulary(self):
+        return self._vocabulary
+
+    @vocabulary.setter
+    def vocabulary(self, value):
+        self._vocabulary = value
+        for entity in self.entities.values():
+            entity.vocabulary = value
+
+    def add(self, stanza):
+        """Record a raw term stanza, indexing its ``is_a`` references
+        so that children can be found without materializing any terms.
+
+        Parameters
+        ----------
+        stanza : dict
+            Maps each key to the list of values it was given in the stanza
+        """
+        stanza = dict(stanza)
+        key = stanza['id'][0]
+        self.stanzas[key] = stanza
+        for is_a in stanza.get('is_a', ()):
+            self.child_map[_reference_accession(is_a)].append(key)
+
+    def peek(self, key, field, default=None):
+        """Read a field of a term's raw stanza without materializing it.
+
+        Parameters
+        ----------
+        key : str
+            The term id
+        field : str
+            The stanza key to read
+        default : object, optional
+            The value to return if the stanza does not have ``field``
+
+        Returns
+        -------
+        object
+            The value of ``field``, unwrapped if there was only one.
+        """
+        values = self.stanzas[key].get(field)
+        if not values:
+            return default
+        if len(values) == 1:
+            return values[0]
+        return values
+
+    def parent_keys(self, key):
+        """The ids of the ``is_a`` parents of a term, without materializing it.
+
+        Parameters
+        ----------
+        key : str
+            The term id
+
+        Returns
+        -------
+        list
+        """
+        return [_reference_accession(is_a) for is_a in self.stanzas[key].get('is_a', ())]
+
+    def connect(self):
+        """Called once all stanzas have been added. The ``is_a`` index is
+        maintained by :meth:`add`, so there is nothing left to do.
+        """
+        pass
+
+    def restrict(self, roots):
+        """Discard every term which is not beneath one of ``roots``, or an ancestor
+        of such a term.
+
+        Parameters
+        ----------
+        roots : Iterable of str
+            The ids or names of the root terms
+        """
+        keep = subtree_keys(
+            roots, self.stanzas, self.parent_keys,
+            lambda key: self.child_map.get(key, ()),
+            lambda key: self.peek(key, 'name'))
+        self.stanzas = {k: v for k, v in self.stanzas.items() if k in keep}
+        child_map = defaultdict(list)
+        for parent, children in self.child_map.items():
+            if parent in keep:
+                child_map[parent] = [c for c in children if c in keep]
+        self.child_map = child_map
+        self.entities = {k: v for k, v in self.entities.items() if k in keep}
+
+    def is_materialized(self, key):
+        return key in self.entities
+
+    def __getitem__(self, key):
+        try:
+            return self.entities[key]
+        except KeyError:
+            stanza = self.stanzas[key]
+        entity = self.parser._pack_stanza(stanza)
+        entity.vocabulary = self._vocabulary
+        entity.children = LazyEntityList(self, self.child_map.get(key, []))
+        self.entities[key] = entity
+        return entity
+
+    def __contains__(self, key):
+        return key in self.stanzas
+
+    def __iter__(self):
+        return iter(self.stanzas)
+
+    def __len__(self):
+        return len(self.stanzas)
+
+    def keys(self):
+        return self.stanzas.keys()
+
+
+class TermRecord(object):
+    """The compact storage of a single term in a :class:`CompactTermStore`.
+
+    Attributes
+    ----------
+    fields : tuple
+        Pairs of interned field name and value, or tuple of values, excluding
+        ``is_a`` and ``relationship``
+    parents : :class:`array.array`
+        The term table indices of the ``is_a`` parents of this term
+    foreign_parents : tuple
+        The raw ``is_a`` values naming parents outside the term table
+    parent_text : tuple
+        ``(index, text)`` pairs for the parents in :attr:`parents` whose raw ``is_a``
+        value is not simply ``"<accession> ! <name>"``
+    relationships : tuple
+        ``(predicate, target)`` pairs, where ``target`` is a term table index, or the
+        raw target text if it is outside the term table or is not simply
+        ``"<accession> ! <name>"``
+    """
+    __slots__ = ("fields", "parents", "foreign_parents", "parent_text", "relationships")
+
+    def __init__(self, fields, parents, foreign_parents, parent_text, relationships):
+        self.fields = fields
+        self.parents = parents
+        self.foreign_parents = foreign_parents
+        self.parent_text = parent_text
+        self.relationships = relationships
+
+
+class CompactTermStore(LazyTermStore):
+    """A :class:`LazyTermStore` which keeps each term in a :class:`TermRecord`
+    with interned strings, and stores ``is_a`` and ``relationship`` edges as
+    indices into a shared term table instead of repeating the target's accession
+    and name.
+
+    :class:`~.Entity` objects are presented as :class:`~.TermView` instances which
+    are only kept alive while something else references them. Values assigned to
+    a view are recorded in :attr:`overrides` and re-applied the next time it is built.
+
+    Attributes
+    ----------
+    keys_table : list
+        The term ids, in index order
+    index : dict
+        Maps term id to its index in :attr:`keys_table`
+    records : list
+        The :class:`TermRecord` of each term, in index order
+    child_offsets : :class:`array.array`
+        The bounds of each term's slice of :attr:`child_indices`
+    child_indices : :class:`array.array`
+        The indices of the ``is_a`` children of each term, concatenated
+    overrides : dict
+        Maps term id to the values assigned to its views
+    """
+
+    def __init__(self, parser):
+        super(CompactTermStore, self).__init__(parser)
+        self.stanzas = None
+        self.child_map = None
+        self.entities = weakref.WeakValueDictionary()
+        self.keys_table = []
+        self.index = dict()
+        self.records = []
+        self.child_offsets = array('i', [0])
+        self.child_indices = array('i')
+        self.overrides = dict()
+        self._pending = []
+
+    def add(self, stanza):
+        key = intern(stanza['id'][0])
+        fields = []
+        for field, values in stanza.items():
+            if field in ('is_a', 'relationship'):
+                continue
+            values = tuple(intern(v) for v in values)
+            fields.append((intern(field), values[0] if len(values) == 1 else values))
+        self.index[key] = len(self.keys_table)
+        self.keys_table.append(key)
+        self.records.append(None)
+        self._pending.append((
+            tuple(fields),
+            stanza.get('is_a', ()),
+            [v.partition(' ')[::2] for v in stanza.get('relationship', ())]))
+
+    def restrict(self, roots):
+        """Discard every term which is not beneath one of ``roots``, or an ancestor
+        of such a term. Must be called before :meth:`connect`.
+
+        Parameters
+        ----------
+        roots : Iterable of str
+            The ids or names of the root terms
+        """
+        index = self.index
+        pending = self._pending
+        child_map = defaultdict(list)
+        for key, (fields, is_as, relationships) in zip(self.keys_table, pending):
+            for text in is_as:
+                child_map[_reference_accession(text)].append(key)
+        keep = subtree_keys(
+            roots, self.keys_table,
+            lambda key: [_reference_accession(text) for text in pending[index[key]][1]],
+            lambda key: child_map.get(key, ()),
+            lambda key: dict(pending[index[key]][0]).get('name'))
+        kept = [(key, item) for key, item in zip(self.keys_table, pending) if key in keep]
+        self.keys_table = [key for key, item in kept]
+        self._pending = [item for key, item in kept]
+        self.records = [None] * len(kept)
+        self.index = {key: i for i, key in enumerate(self.keys_table)}
+
+    def connect(self):
+        """Resolve the ``is_a`` and ``relationship`` targets collected by :meth:`add`
+        into term table indices, and build the child table.
+        """
+        index = self.index
+        keys = self.keys_table
+        names = [dict(fields).get('name') for fields, is_as, relationships in self._pending]
+        children = [[] for i in range(len(keys))]
+        for i, (fields, is_as, relationships) in enumerate(self._pending):
+            parents = array('i')
+            foreign = []
+            parent_text = []
+            for text in is_as:
+                j = index.get(_reference_accession(text))
+                if j is None:
+                    foreign.append(intern(text))
+                    continue
+                parents.append(j)
+                children[j].append(i)
+                if text != "%s ! %s" % (keys[j], names[j]):
+                    parent_text.append((j, text))
+            edges = []
+            for predicate, target in relationships:
+                j = index.get(_reference_accession(target))
+                if j is None or target != "%s ! %s" % (keys[j], names[j]):
+                    edges.append((intern(predicate), intern(target)))
+                else:
+                    edges.append((intern(predicate), j))
+            self.records[i] = TermRecord(
+                fields, parents, tuple(foreign), tuple(parent_text), tuple(edges))
+        self._pending = []
+        offsets = self.child_offsets
+        for c in children:
+            self.child_indices.extend(c)
+            offsets.append(len(self.child_indices))
+
+    def _name_of(self, i):
+        for field, value in self.records[i].fields:
+            if field == 'name':
+                return value
+        return None
+
+    def _reference_strings(self, record):
+        keys = self.keys_table
+        parent_text = dict(record.parent_text)
+        result = []
+        for j in record.parents:
+            try:
+                result.append(parent_text[j])
+            except KeyError:
+                result.append("%s ! %s" % (keys[j], self._name_of(j)))
+        result.extend(record.foreign_parents)
+        return result
+
+    def _relationship_strings(self, record):
+        keys = self.keys_table
+        result = []
+        for predicate, target in record.relationships:
+            if isinstance(target, int):
+                target = "%s ! %s" % (keys[target], self._name_of(target))
+            result.append("%s %s" % (predicate, target))
+        return result
+
+    def _stanza(self, key):
+        record = self.records[self.index[key]]
+        stanza = {field: list(value) if isinstance(value, tuple) else [value]
+                  for field, value in record.fields}
+        is_a = self._reference_strings(record)
+        if is_a:
+            stanza['is_a'] = is_a
+        relationships = self._relationship_strings(record)
+        if relationships:
+            stanza['relationship'] = relationships
+        return stanza
+
+    def peek(self, key, field, default=None):
+        record = self.records[self.index[key]]
+        if field == 'is_a':
+            values = self._reference_strings(record)
+        elif field == 'relationship':
+            values = self._relationship_strings(record)
+        else:
+            for name, value in record.fields:
+                if name == field:
+                    return list(value) if isinstance(value, tuple) else value
+            return default
+        if not values:
+            return default
+        if len(values) == 1:
+            return values[0]
+        return values
+
+    def parent_keys(self, key):
+        record = self.records[self.index[key]]
+        keys = self.keys_table
+        return [keys[j] for j in record.parents] + [
+            _reference_accession(text) for text in record.foreign_parents]
+
+    def child_keys(self, key):
+        i = self.index[key]
+        keys = self.keys_table
+        return [keys[j] for j in self.child_indices[self.child_offsets[i]:self.child_offsets[i + 1]]]
+
+    def __getitem__(self, key):
+        try:
+            return self.entities[key]
+        except KeyError:
+            pass
+        key = self.keys_table[self.index[key]]
+        entity = self.parser._pack_stanza(self._stanza(key))
+        view = TermView(self, key, self._vocabulary, **entity.data)
+        view.data.update(self.overrides.get(key, {}))
+        view.children = LazyEntityList(self, self.child_keys(key))
+        self.entities[key] = view
+        return view
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.keys_table)
+
+    def __len__(self):
+        return len(self.keys_table)
+
+    def keys(self):
+        return self.index.keys()
+
+
 class OBOParser(object):
     """Parser for an :title-reference:`OBO` [OBO]_ file that constructs a semantic graph.
 
+    The file is read incrementally, line by line. When ``lazy`` is :const:`True`,
+    only the raw stanza of each term is kept while parsing, and :attr:`terms` is a
+    :class:`LazyTermStore` which builds each :class:`~.Entity` on first access.
+
     Attributes
     ----------
     current_term : dict
@@ -75,7 +557,14 @@ class OBOParser(object):
         The file stream to read from
     header : defaultdict(list)
         Store the header information from the OBO file
-    terms : dict
+    lazy : bool
+        Whether to defer building :class:`~.Entity` objects until they are accessed
+    compact : bool
+        Whether to store terms in a :class:`CompactTermStore`. Implies ``lazy``.
+    roots : list
+        If not :const:`None`, only the terms beneath these term ids or names, and
+        their ancestors, are kept. Implies ``lazy``.
+    terms : dict or :class:`LazyTermStore`
         Maps term id to :class:`~.Entity` objects
 
     References
@@ -84,9 +573,16 @@ class OBOParser(object):
         http://owlcollab.github.io/oboformat/doc/GO.format.obo-1_2.html
     """
 
-    def __init__(self, handle):
+    def __init__(self, handle, lazy=False, compact=False, roots=None):
         self.handle = handle
-        self.terms = {}
+        self.roots = roots
+        self.lazy = lazy or compact or roots is not None
+        if compact:
+            self.terms = CompactTermStore(self)
+        elif self.lazy:
+            self.terms = LazyTermStore(self)
+        else:
+            self.terms = {}
         self.current_term = None
         self.header = defaultdict(list)
         self.parse()
@@ -108,16 +604,19 @@ class OBOParser(object):
     def _get_value_type(self, xref_string):
         return parse_xsdtype(xref_string)
 
-    def pack(self):
-        """Pack the currently collected OBO entry into an :class:`~.Entity`.
+    def _pack_stanza(self, stanza):
+        """Build an :class:`~.Entity` from the raw key-value lists of a term stanza.
+
+        Parameters
+        ----------
+        stanza : dict
+            Maps each key to the list of values it was given in the stanza
 
         Returns
         -------
         :class:`~.Entity`
         """
-        if self.current_term is None:
-            return
-        entity = Entity(self, **{k: v[0] if len(v) == 1 else v for k, v in self.current_term.items()})
+        entity = Entity(self, **{k: v[0] if len(v) == 1 else v for k, v in stanza.items()})
         try:
             is_as = entity['is_a']
             if isinstance(is_as, basestring):
@@ -156,13 +655,37 @@ class OBOParser(object):
                         entity.value_type = value_type
         except KeyError:
             pass
+        return entity
+
+    def pack(self):
+        """Pack the currently collected OBO entry into an :class:`~.Entity`,
+        or record its stanza if parsing lazily.
+
+        Returns
+        -------
+        :class:`~.Entity`
+        """
+        if self.current_term is None:
+            return
+        if self.lazy:
+            self.terms.add(self.current_term)
+            self.current_term = None
+            return
+        entity = self._pack_stanza(self.current_term)
         self.terms[entity['id']] = entity
         self.current_term = None
+        return entity
 
     def _connect_parents(self):
         """Walk the semantic graph up the parent hierarchy, binding child
         to parent through ``is_a`` :class:`~.Reference` connections.
+
+        When parsing lazily, children are resolved by the :class:`LazyTermStore`
+        instead.
         """
+        if self.lazy:
+            self.terms.connect()
+            return
         for term in self.terms.values():
             try:
                 if isinstance(term.is_a, Reference):
@@ -182,13 +705,35 @@ class OBOParser(object):
             k: v if len(v) > 1 else v[0] for k, v in self.header.items()
         }
 
+    def _iterlines(self):
+        for line in self.handle:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            yield line
+
     def parse(self):
-        """Iteratively parse a binary file stream for an OBO file into a
+        """Incrementally parse a binary file stream for an OBO file into a
         semantic graph.
         """
+        if isinstance(self.handle, io.BufferedIOBase):
+            # decode in bulk rather than line by line, and hand the stream back
+            # to its owner afterwards instead of letting the wrapper close it
+            lines = io.TextIOWrapper(self.handle, encoding='utf-8')
+            try:
+                self._parse_lines(lines)
+            finally:
+                lines.detach()
+        else:
+            self._parse_lines(self._iterlines())
+        self.pack()
+        if self.roots is not None:
+            self.terms.restrict(self.roots)
+        self._connect_parents()
+        self._simplify_header_information()
+
+    def _parse_lines(self, lines):
         in_header = True
-        for line in self.handle.readlines():
-            line = line.decode('utf-8')
+        for line in lines:
             line = line.strip()
             if not line:
                 in_header = False
@@ -207,9 +752,6 @@ class OBOParser(object):
                     continue
                 key, sep, val = line.partition(":")
                 self.current_term[key].append(val.strip())
-        self.pack()
-        self._connect_parents()
-        self._simplify_header_information()
 
     def __getitem__(self, key):
         return self.terms[key]
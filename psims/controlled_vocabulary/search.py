@@ -0,0 +1,302 @@
+from array import array
+from bisect import bisect_left
+from collections import defaultdict, namedtuple, Counter
+from itertools import chain, islice
+
+
+TermMatch = namedtuple("TermMatch", ("text", "key", "distance"))
+
+
+def _ngrams(text, n=3):
+    padded = " %s " % (text,)
+    return set(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+
+def _numbered_chars(text):
+    """The characters of ``text``, each paired with the number of times it occurred
+    before, so that the characters two texts share, counted with multiplicity, are
+    the intersection of their numbered characters.
+    """
+    seen = defaultdict(int)
+    result = []
+    for c in text:
+        result.append((c, seen[c]))
+        seen[c] += 1
+    return result
+
+
+def edit_distance(a, b, max_distance=None):
+    """Compute the Levenshtein distance between two strings.
+
+    Parameters
+    ----------
+    a : str
+    b : str
+    max_distance : int, optional
+        If given, only the diagonal band of the table that can hold a distance
+        within this bound is filled, and ``max_distance + 1`` is returned as
+        soon as the distance is known to exceed it.
+
+    Returns
+    -------
+    int
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    n, m = len(a), len(b)
+    if max_distance is None:
+        max_distance = n
+    elif n - m > max_distance:
+        return max_distance + 1
+    limit = max_distance + 1
+    previous = list(range(m + 1))
+    for i in range(1, n + 1):
+        ca = a[i - 1]
+        lo = max(1, i - max_distance)
+        hi = min(m, i + max_distance)
+        current = [limit] * (m + 1)
+        if lo == 1:
+            current[0] = i
+        best = current[0]
+        for j in range(lo, hi + 1):
+            cost = previous[j - 1] + (ca != b[j - 1])
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost
+            if cost < best:
+                best = cost
+        if best > max_distance:
+            return limit
+        previous = current
+    return min(previous[m], limit)
+
+
+class TermSearchIndex(object):
+    """A prefix, substring and approximate match index over the names and
+    synonyms of a set of terms.
+
+    Texts are case-folded and kept in a sorted array, so prefix queries are a
+    pair of binary searches. An inverted index of character trigrams supplies
+    candidates for substring and approximate queries, which are then verified
+    directly. Queries too short to be pruned by trigrams use indices of single
+    characters and character pairs instead, which are built on first use.
+
+    Attributes
+    ----------
+    texts : list
+        The case-folded searchable texts, sorted
+    labels : list
+        The original spelling of each entry in :attr:`texts`
+    keys : list
+        The term id of each entry in :attr:`texts`
+    ngrams : dict
+        Maps each trigram to the sorted indices of the texts containing it
+    lengths : dict
+        Maps each text length to the indices of the texts of that length
+    """
+
+    def __init__(self, entries):
+        entries = sorted(set((text.lower(), text, key) for text, key in entries))
+        self.texts = [e[0] for e in entries]
+        self.labels = [e[1] for e in entries]
+        self.keys = [e[2] for e in entries]
+        self.ngrams = self._build_ngrams()
+        self.lengths = self._build_lengths()
+        self._short_ngrams = None
+        self._length_chars = {}
+
+    @classmethod
+    def from_vocabulary(cls, vocabulary):
+        def entries():
+            for key in vocabulary.keys():
+                name = vocabulary._peek(key, 'name')
+                if name is not None:
+                    yield name, key
+            for synonym, key in vocabulary.synonyms.items():
+                yield synonym, key
+        return cls(entries())
+
+    def _build_ngrams(self):
+        postings = defaultdict(list)
+        for i, text in enumerate(self.texts):
+            for gram in _ngrams(text):
+                postings[gram].append(i)
+        return {gram: array('i', indices) for gram, indices in postings.items()}
+
+    def _build_lengths(self):
+        lengths = defaultdict(list)
+        for i, text in enumerate(self.texts):
+            lengths[len(text)].append(i)
+        return {n: array('i', indices) for n, indices in lengths.items()}
+
+    @property
+    def short_ngrams(self):
+        """Maps each single character and character pair to the sorted indices of
+        the texts containing it, built on first use.
+
+        Returns
+        -------
+        dict
+        """
+        if self._short_ngrams is None:
+            postings = defaultdict(list)
+            for i, text in enumerate(self.texts):
+                grams = set(text)
+                grams.update(text[j:j + 2] for j in range(len(text) - 1))
+                for gram in grams:
+                    postings[gram].append(i)
+            self._short_ngrams = {gram: array('i', indices) for gram, indices in postings.items()}
+        return self._short_ngrams
+
+    def _chars_of_length(self, length):
+        """Maps each numbered character to the indices of the texts of ``length``
+        containing it, built on first use.
+        """
+        try:
+            return self._length_chars[length]
+        except KeyError:
+            pass
+        postings = defaultdict(list)
+        texts = self.texts
+        for i in self.lengths.get(length, ()):
+            for c in _numbered_chars(texts[i]):
+                postings[c].append(i)
+        self._length_chars[length] = postings = dict(postings)
+        return postings
+
+    def __len__(self):
+        return len(self.texts)
+
+    def _match(self, i, distance=0):
+        return TermMatch(self.labels[i], self.keys[i], distance)
+
+    def _matches(self, indices):
+        labels = self.labels
+        keys = self.keys
+        return [TermMatch(labels[i], keys[i], 0) for i in indices]
+
+    def prefix(self, query, limit=None):
+        """Find all entries which start with ``query``, ignoring case.
+
+        Parameters
+        ----------
+        query : str
+        limit : int, optional
+            The maximum number of matches to return
+
+        Returns
+        -------
+        list of :class:`TermMatch`
+        """
+        query = query.lower()
+        start = bisect_left(self.texts, query)
+        end = bisect_left(self.texts, query + u'\uffff', start)
+        if limit is not None:
+            end = min(end, start + limit)
+        return [self._match(i) for i in range(start, end)]
+
+    def substring(self, query, limit=None):
+        """Find all entries which contain ``query``, ignoring case.
+
+        Parameters
+        ----------
+        query : str
+        limit : int, optional
+            The maximum number of matches to return
+
+        Returns
+        -------
+        list of :class:`TermMatch`
+        """
+        query = query.lower()
+        texts = self.texts
+        if len(query) < 3:
+            # the texts containing a query this short are exactly its postings
+            if query:
+                matches = self.short_ngrams.get(query, ())
+            else:
+                matches = range(len(texts))
+            if limit is not None:
+                matches = matches[:limit]
+            return self._matches(matches)
+        grams = set(query[i:i + 3] for i in range(len(query) - 2))
+        candidates = min((self.ngrams.get(gram, ()) for gram in grams), key=len)
+        # testing a candidate for the whole query is cheaper than intersecting
+        # the postings of the query's other trigrams to rule it out
+        matches = (i for i in candidates if query in texts[i])
+        if limit is not None:
+            matches = islice(matches, limit)
+        return self._matches(matches)
+
+    def _short_candidates(self, query, max_distance):
+        """Find the candidates for a query with too few trigrams to prune anything.
+
+        A text within ``max_distance`` edits of ``query`` shares at least
+        ``max(len(query), len(text)) - max_distance`` characters with it, counted
+        with multiplicity.
+        """
+        n = len(query)
+        chars = _numbered_chars(query)
+        candidates = []
+        for length in range(max(n - max_distance, 0), n + max_distance + 1):
+            indices = self.lengths.get(length)
+            if not indices:
+                continue
+            bound = max(n, length) - max_distance
+            if bound <= 0:
+                candidates.extend(indices)
+                continue
+            postings = self._chars_of_length(length)
+            counts = Counter(chain.from_iterable(postings.get(c, ()) for c in chars))
+            candidates.extend(i for i, count in counts.items() if count >= bound)
+        return candidates
+
+    def approximate(self, query, max_distance=2, limit=None):
+        """Find all entries within ``max_distance`` edits of ``query``, ignoring case.
+
+        Parameters
+        ----------
+        query : str
+        max_distance : int, optional
+            The largest Levenshtein distance to accept. Defaults to 2.
+        limit : int, optional
+            The maximum number of matches to return
+
+        Returns
+        -------
+        list of :class:`TermMatch`
+            Ordered by increasing distance
+        """
+        query = query.lower()
+        grams = _ngrams(query)
+        # each edit destroys at most three trigrams, so a text within the bound
+        # must share at least `threshold` of them with the query, and therefore
+        # at least one of the rarest `len(grams) - threshold + 1`
+        threshold = len(grams) - 3 * max_distance
+        n = len(query)
+        if threshold > 0:
+            postings = sorted((self.ngrams.get(gram, ()) for gram in grams), key=len)
+            rarest = postings[:len(grams) - threshold + 1]
+            if sum(map(len, postings)) < 16 * sum(map(len, rarest)):
+                # counting every shared trigram is cheap enough to prune harder
+                counts = Counter(chain.from_iterable(postings))
+                candidates = [i for i, c in counts.items() if c >= threshold]
+            else:
+                candidates = set(chain.from_iterable(rarest))
+        else:
+            candidates = self._short_candidates(query, max_distance)
+        texts = self.texts
+        scored = []
+        for i in candidates:
+            text = texts[i]
+            if abs(len(text) - n) > max_distance:
+                continue
+            distance = edit_distance(query, text, max_distance)
+            if distance <= max_distance:
+                scored.append((distance, i))
+        scored.sort()
+        if limit is not None:
+            scored = scored[:limit]
+        return [self._match(i, distance) for distance, i in scored]
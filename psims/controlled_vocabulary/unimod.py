@@ -1,24 +1,35 @@
 import warnings
 import re
+import os
+import hashlib
+import itertools
+import sqlite3
+import threading
 
 from collections import Counter
 
+import numpy as np
+
 from lxml import etree
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, backref, object_session
+from sqlalchemy.orm import (
+    relationship, backref, object_session, subqueryload, selectinload, joinedload)
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy import (Numeric, Unicode,
                         Column, Integer, ForeignKey,
                         UnicodeText, Boolean, event)
 from sqlalchemy import exc as sa_exc
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import StaticPool, QueuePool
 
 from six import string_types as basestring
 
 from psims.utils import KeyToAttrProxy
 from .entity import Entity
+from .search import TermSearchIndex
 
 
 try:
@@ -99,13 +110,51 @@ def preprocess_xml(doc_path):
     return tree
 
 
+_formula_token_pattern = re.compile(r"(?P<isotope>\d+)?(?P<elemet>[^\(]+)(?:\((?P<count>-?\d+)\))?")
+
+
+def _copy_composition(composition):
+    # Composition's constructor re-parses its keys, which rejects some of the
+    # non-element tokens that appear in Unimod formulae, so copy item-wise
+    copy = CompositionType()
+    for key, value in composition.items():
+        copy[key] = value
+    return copy
+
+
+def _brick_compositions(session):
+    '''
+    Get the composition of every :class:`Brick` in the database, loading them
+    all at once the first time this is called for ``session``.
+
+    Parameters
+    ----------
+    session: Session
+
+    Returns
+    -------
+    dict
+        Maps brick name to its composition
+    '''
+    try:
+        return session.info["unimod_brick_compositions"]
+    except KeyError:
+        pass
+    bricks = session.query(Brick).options(subqueryload(Brick.elements)).all()
+    table = {brick.brick: brick.composition for brick in bricks}
+    session.info["unimod_brick_compositions"] = table
+    return table
+
+
 def _formula_parser(formula, session):
     '''
     Parse a unimod formula composed of elements,
     isotopes, and other bricks.
 
     In order to look up a Brick's composition, this
-    function must have access to a session.
+    function must have access to a session. Brick compositions
+    are loaded once per session, and each distinct formula is only
+    parsed once per session.
 
     Parameters
     ----------
@@ -121,9 +170,15 @@ def _formula_parser(formula, session):
     -------
     CompositionType
     '''
+    formulas = session.info.setdefault("unimod_formula_compositions", {})
+    try:
+        return _copy_composition(formulas[formula])
+    except KeyError:
+        pass
+    bricks = _brick_compositions(session)
     composition = CompositionType()
     for token in formula.split(" "):
-        match = re.search(r"(?P<isotope>\d+)?(?P<elemet>[^\(]+)(?:\((?P<count>-?\d+)\))?", token)
+        match = _formula_token_pattern.search(token)
         if match:
             isotope, element, count = match.groups()
             if count is not None:
@@ -134,47 +189,60 @@ def _formula_parser(formula, session):
                 name = _make_isotope_string(element, int(isotope))
             else:
                 name = element
-            is_brick = session.query(Brick).filter(Brick.brick == name).first()
-            if is_brick is None:
+            brick = bricks.get(name)
+            if brick is None:
                 composition[str(name)] += count
             else:
-                composition += is_brick.composition * count
-    return composition
+                composition += brick * count
+    formulas[formula] = composition
+    return _copy_composition(composition)
 
 
-def _composition_listener(attr):
+class _DeferredComposition(object):
     '''
-    Attach event listeners to an InstrumentedAttribute
-    to trigger formula parsing on load and on change.
+    A non-data descriptor which parses the formula stored in ``attr_name``
+    the first time :attr:`composition` is read and stores the result on the
+    instance, so later reads are plain attribute lookups.
     '''
-    @event.listens_for(attr, "set")
-    def _update_composition_from_formula(target, value, oldvalue, initiator):
-        session = object_session(target)
+    def __init__(self, attr_name):
+        self.attr_name = attr_name
+
+    def __get__(self, target, owner):
+        if target is None:
+            return self
+        value = getattr(target, self.attr_name)
         if value == "" or value is None:
-            return
+            raise AttributeError("composition")
+        session = object_session(target)
         # If the object hasn't been associated with a session,
         # we can't look up bricks.
         if session is None:
-            return
-        target.composition = _formula_parser(value, session)
+            raise AttributeError("composition")
+        composition = target.__dict__["composition"] = _formula_parser(value, session)
+        return composition
 
-    @event.listens_for(attr.class_, "load")
-    def _update_composition_on_load(target, context):
-        value = getattr(target, attr.prop.key)
-        if value == "" or value is None:
-            return
-        session = object_session(target)
-        target.composition = _formula_parser(value, session)
+
+def _composition_listener(attr):
+    '''
+    Attach an event listener to an InstrumentedAttribute
+    to discard the parsed composition when the formula changes,
+    so that it is parsed again on next access.
+    '''
+    @event.listens_for(attr, "set")
+    def _update_composition_from_formula(target, value, oldvalue, initiator):
+        target.__dict__.pop("composition", None)
 
 
 def has_composition(attr_name):
     '''
     A decorator to simplify flagging a Model with a column
-    to be treated as a formula for parsing. Calls :func:`_composition_listener`
-    internally.
+    to be treated as a formula for parsing. The formula is parsed into
+    :attr:`composition` when that attribute is first accessed. Calls
+    :func:`_composition_listener` internally.
     '''
     def decorator(model):
         _composition_listener(getattr(model, attr_name))
+        model.composition = _DeferredComposition(attr_name)
         return model
     return decorator
 
@@ -358,7 +426,7 @@ class Fragment(Base):
     @property
     def composition(self):
         composition = CompositionType()
-        session = object_session(self)
+        bricks = _brick_compositions(object_session(self))
         for fragment_composition_relation in self._fragment_composition:
             symbol = fragment_composition_relation.brick_string
             isotope, element = re.search(r"(?P<isotope>\d+)?(?P<element>\S+)", symbol).groups()
@@ -371,11 +439,11 @@ class Fragment(Base):
                 name = _make_isotope_string(element, isotope)
             else:
                 name = element
-            is_brick = session.query(Brick).filter(Brick.brick == name).first()
-            if is_brick is None:
+            brick = bricks.get(name)
+            if brick is None:
                 composition[str(name)] += count
             else:
-                composition += is_brick.composition * count
+                composition += brick * count
         return composition
 
 
@@ -678,15 +746,208 @@ class History(Base):
     version = Column(Unicode(128))
 
 
-def create(doc_path, output_path="sqlite://"):
+def _strip_namespace(tag):
+    if tag.startswith("{"):
+        return tag.split("}", 1)[1]
+    return tag
+
+
+class _RowRecord(object):
+    '''
+    A plain attribute bag standing in for a model instance, which avoids
+    the cost of SQLAlchemy's attribute instrumentation.
+    '''
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class _RowFactory(object):
+    '''
+    Stands in for a model class when calling its :meth:`from_tag` so that
+    the row is built as a :class:`_RowRecord` instead of a mapped instance.
+    '''
+    def __init__(self, model):
+        self.model = model
+        mapper = sa_inspect(model)
+        self.columns = [(prop.key, prop.columns[0].key) for prop in mapper.column_attrs]
+        self.collections = [rel.key for rel in mapper.relationships if rel.uselist]
+
+    def __call__(self, **kwargs):
+        inst = _RowRecord(**kwargs)
+        for key in self.collections:
+            inst.__dict__.setdefault(key, [])
+        return inst
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def values(self, inst):
+        state = inst.__dict__
+        return {column: state.get(key) for key, column in self.columns}
+
+
+def _column_values(inst):
+    '''
+    Extract the column values of an unsaved model instance as a dict
+    keyed by column name, suitable for a Core insert.
+    '''
+    mapper = sa_inspect(type(inst))
+    state = inst.__dict__
+    return {prop.columns[0].key: state.get(prop.key) for prop in mapper.column_attrs}
+
+
+def _rows_from_tag(factory, tag):
+    '''
+    Convert a <tag>_row element into the rows it would have produced through
+    the ORM, including those of any related objects :meth:`from_tag` attached.
+
+    Yields
+    ------
+    table: Table
+    row: dict
+    '''
+    inst = factory.model.from_tag.__func__(factory, tag)
+    yield factory.model.__table__, factory.values(inst)
+    for key in factory.collections:
+        for child in inst.__dict__[key]:
+            yield child.__table__, _column_values(child)
+
+
+class _SharedMemoryDatabase(object):
+    '''
+    A named in-memory SQLite database which every connection opened through
+    :meth:`connect` shares, so that each thread can be handed a connection, and
+    so transactions, of its own. The database lasts as long as :attr:`keeper`,
+    a connection this object holds open.
+
+    Raises
+    ------
+    TypeError or :class:`sqlite3.NotSupportedError`
+        If :mod:`sqlite3` cannot open URI filenames
+    '''
+    _counter = itertools.count()
+
+    def __init__(self):
+        self.uri = "file:psims-unimod-%d-%d?mode=memory&cache=shared" % (
+            os.getpid(), next(self._counter))
+        self.keeper = self.connect()
+
+    def connect(self):
+        return sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+
+    def create_engine(self):
+        # the pool holds on to this object through ``creator``, so the database
+        # outlives any connection but not the engine
+        return create_engine(
+            "sqlite://", creator=self.connect, poolclass=QueuePool, max_overflow=-1)
+
+
+def _create_engine(path):
+    if path in ("sqlite://", "sqlite:///:memory:"):
+        try:
+            return _SharedMemoryDatabase().create_engine()
+        except (TypeError, sqlite3.NotSupportedError):
+            # Without URI filenames an in-memory database only exists within the
+            # connection that made it, so every thread must be handed that same connection
+            return create_engine(
+                path, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    return create_engine(path)
+
+
+def bulk_create(doc_path, output_path="sqlite://", batch_size=5000):
+    '''
+    Build the same database as :func:`create`, but stream the XML document with
+    :func:`lxml.etree.iterparse` and insert rows through SQLAlchemy Core ``executemany``
+    calls inside a single transaction instead of through the ORM's unit of work.
+
+    Parameters
+    ----------
+    doc_path: str or file-like
+        The Unimod tables XML document
+    output_path: str
+        The database URI to write to. By default the table will be held in memory.
+    batch_size: int
+        The number of rows to buffer per table before inserting them
+
+    Returns
+    -------
+    Session
+    '''
+    engine = _create_engine(output_path)
+    Base.metadata.create_all(engine)
+    models = {}
+    for model in Base._decl_class_registry.values():
+        if hasattr(model, "_tag_name") and hasattr(model, "from_tag"):
+            models[model._tag_name] = _RowFactory(model)
+    is_sqlite = engine.dialect.name == "sqlite"
+    version = None
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=sa_exc.SAWarning)
+        connection = engine.connect()
+        try:
+            if is_sqlite:
+                connection.execute("PRAGMA synchronous = OFF")
+                connection.execute("PRAGMA journal_mode = MEMORY")
+            buffers = {}
+
+            def flush(table):
+                rows = buffers.pop(table, None)
+                if rows:
+                    connection.execute(table.insert(), rows)
+
+            with connection.begin():
+                for event, elem in etree.iterparse(doc_path, events=("start", "end")):
+                    if event == "start":
+                        if version is None:
+                            # the first element opened is the document root
+                            version = "%s.%s" % (elem.attrib['majorVersion'], elem.attrib['minorVersion'])
+                        continue
+                    tag = _strip_namespace(elem.tag)
+                    model = models.get(tag)
+                    if model is None:
+                        continue
+                    for node in elem.iter():
+                        node.tag = _strip_namespace(node.tag)
+                    for table, row in _rows_from_tag(model, elem):
+                        buffer = buffers.setdefault(table, [])
+                        buffer.append(row)
+                        if len(buffer) >= batch_size:
+                            flush(table)
+                    # release the element and any already processed siblings
+                    elem.clear()
+                    parent = elem.getparent()
+                    while elem.getprevious() is not None:
+                        del parent[0]
+                for table in list(buffers):
+                    flush(table)
+                if not isinstance(doc_path, basestring):
+                    try:
+                        doc_path = doc_path.name
+                    except AttributeError:
+                        doc_path = str(doc_path)
+                connection.execute(History.__table__.insert(), [{"url": doc_path, "version": version}])
+            if is_sqlite:
+                connection.execute("PRAGMA synchronous = FULL")
+        finally:
+            connection.close()
+    session = sessionmaker(bind=engine, autoflush=False)()
+    return session
+
+
+def create(doc_path, output_path="sqlite://", bulk=True):
     '''
     Parse the relational table-like XML file provided by http://www.unimod.org/downloads.html
     and convert each <tag>_row into an equivalent database entry.
 
     By default the table will be held in memory.
+
+    When ``bulk`` is :const:`True`, the database is built by :func:`bulk_create`,
+    otherwise each row is added through the ORM.
     '''
+    if bulk:
+        return bulk_create(doc_path, output_path)
     tree = preprocess_xml(doc_path)
-    engine = create_engine(output_path)
+    engine = _create_engine(output_path)
     Base.metadata.create_all(engine)
     session = sessionmaker(bind=engine, autoflush=False)()
     with warnings.catch_warnings():
@@ -709,30 +970,436 @@ def create(doc_path, output_path="sqlite://"):
 
 
 def session(path="sqlite:///unimod.db"):
-    engine = create_engine(path)
+    engine = _create_engine(path)
     Base.metadata.create_all(engine)
     session = sessionmaker(bind=engine, autoflush=False)()
     return session
 
 
+_snapshot_table = "psims_snapshot"
+
+
+def _schema_digest():
+    digest = hashlib.md5()
+    for table in sorted(Base.metadata.tables.values(), key=lambda t: t.name):
+        digest.update(table.name.encode("utf8"))
+        for column in table.columns:
+            digest.update(("%s %s" % (column.name, column.type)).encode("utf8"))
+    return digest.hexdigest()
+
+
+def snapshot_key(doc_path):
+    '''
+    Compute the key a database snapshot built from ``doc_path`` is stored under,
+    combining a checksum of the XML document with a digest of the database schema,
+    so that a snapshot goes stale when either changes.
+
+    Parameters
+    ----------
+    doc_path: str or file-like
+        The Unimod tables XML document. File-like objects must be seekable, and
+        are rewound to where they were once read.
+
+    Returns
+    -------
+    str or None
+        :const:`None` if ``doc_path`` is neither a local file nor a seekable stream
+    '''
+    digest = hashlib.md5()
+    if isinstance(doc_path, basestring):
+        if not os.path.exists(doc_path):
+            return None
+        with open(doc_path, 'rb') as stream:
+            for chunk in iter(lambda: stream.read(2 ** 16), b''):
+                digest.update(chunk)
+    else:
+        try:
+            position = doc_path.tell()
+        except (AttributeError, IOError, ValueError):
+            return None
+        for chunk in iter(lambda: doc_path.read(2 ** 16), b''):
+            digest.update(chunk)
+        doc_path.seek(position)
+    return "%s:%s" % (digest.hexdigest(), _schema_digest())
+
+
+def write_snapshot(doc_path, snapshot_path):
+    '''
+    Build a compact SQLite database from the Unimod tables XML document which
+    :func:`load_snapshot` can open without parsing the XML again.
+
+    Parameters
+    ----------
+    doc_path: str or file-like
+        The Unimod tables XML document
+    snapshot_path: str
+        The file to write the database to. Any existing file is replaced.
+    '''
+    key = snapshot_key(doc_path)
+    if key is None:
+        raise ValueError("Cannot compute a snapshot key for %r" % (doc_path, ))
+    if isinstance(doc_path, basestring):
+        url = os.path.basename(doc_path)
+    else:
+        url = os.path.basename(getattr(doc_path, "name", str(doc_path)))
+    part_path = snapshot_path + ".part"
+    if os.path.exists(part_path):
+        os.remove(part_path)
+    built = bulk_create(doc_path, "sqlite:///%s" % (part_path, ))
+    built.close()
+    built.get_bind().dispose()
+    connection = sqlite3.connect(part_path)
+    try:
+        # don't record the path of the machine the snapshot was built on
+        connection.execute('UPDATE "History" SET url = ?', (url, ))
+        connection.execute("CREATE TABLE %s (key TEXT PRIMARY KEY, value TEXT)" % _snapshot_table)
+        connection.execute("INSERT INTO %s VALUES ('source', ?)" % _snapshot_table, (key, ))
+        connection.commit()
+        connection.execute("VACUUM")
+    finally:
+        connection.close()
+    if os.path.exists(snapshot_path):
+        os.remove(snapshot_path)
+    os.rename(part_path, snapshot_path)
+
+
+def load_snapshot(snapshot_path, doc_path=None):
+    '''
+    Copy a database written by :func:`write_snapshot` into memory.
+
+    Parameters
+    ----------
+    snapshot_path: str
+        The snapshot file
+    doc_path: str or file-like, optional
+        The XML document the snapshot is expected to have been built from. If
+        given, a snapshot built from anything else is treated as stale.
+
+    Returns
+    -------
+    Session or None
+        :const:`None` if the snapshot is missing, unreadable or stale
+    '''
+    if not os.path.exists(snapshot_path):
+        return None
+    try:
+        source = sqlite3.connect(snapshot_path)
+        try:
+            row = source.execute("SELECT value FROM %s WHERE key = 'source'" % _snapshot_table).fetchone()
+            if row is None or (doc_path is not None and row[0] != snapshot_key(doc_path)):
+                return None
+            memory = _SharedMemoryDatabase()
+            source.backup(memory.keeper)
+        finally:
+            source.close()
+    except (sqlite3.Error, AttributeError, TypeError):
+        # unreadable snapshots, and Python versions without sqlite3's backup API
+        # or URI filenames
+        return None
+    return sessionmaker(bind=memory.create_engine(), autoflush=False)()
+
+
+class UnimodNameIndex(object):
+    '''
+    An in-memory index over the names of every :class:`Modification` in a
+    database, which answers the same queries as :meth:`Unimod.get` without
+    issuing any SQL beyond loading the modification found, once.
+
+    Where several modifications match a query, the one with the lowest id is
+    returned, with modification names taking precedence over alternative names,
+    and among alternative names, the one with the lowest record id. Non-strict
+    queries honor the ``%`` and ``_`` wildcards of the SQL ``LIKE`` matching they
+    replace.
+
+    Attributes
+    ----------
+    ids: set
+        The id of every modification
+    by_id: dict
+        Maps modification id to :class:`Modification`, for those loaded so far
+    names: dict
+        Maps each full, code and extended code name to a modification id
+    alternative_names: dict
+        Maps each alternative name to a modification id
+    alternative_name_owner: dict
+        Maps each alternative name record id to its modification id
+    name_search: :class:`~.TermSearchIndex`
+        Case-insensitive substring index over modification names, built on first use
+    alternative_name_search: :class:`~.TermSearchIndex`
+        Case-insensitive substring index over alternative names, built on first use
+    '''
+    def __init__(self, session, lock=None):
+        if lock is None:
+            lock = threading.RLock()
+        self.session = session
+        self.lock = lock
+        rows = session.query(
+            Modification.id, Modification.full_name, Modification.code_name,
+            Modification.ex_code_name).order_by(Modification.id).all()
+        alt_names = session.query(
+            AlternativeName.id, AlternativeName.alt_name,
+            AlternativeName.modification_id).order_by(AlternativeName.id).all()
+        self.ids = set()
+        self.by_id = {}
+        self.names = {}
+        name_entries = []
+        for mod_id, full_name, code_name, ex_code_name in rows:
+            self.ids.add(mod_id)
+            for name in (full_name, code_name, ex_code_name):
+                if name:
+                    self.names.setdefault(name, mod_id)
+                    name_entries.append((name, mod_id))
+        self.alternative_names = {}
+        self.alternative_name_owner = {}
+        alt_entries = []
+        for alt_id, alt_name, modification_id in alt_names:
+            if alt_name:
+                self.alternative_names.setdefault(alt_name, modification_id)
+                self.alternative_name_owner[alt_id] = modification_id
+                alt_entries.append((alt_name, alt_id))
+        self._name_entries = name_entries
+        self._alternative_name_entries = alt_entries
+        self._name_search = None
+        self._alternative_name_search = None
+
+    @property
+    def name_search(self):
+        if self._name_search is None:
+            with self.lock:
+                if self._name_search is None:
+                    self._name_search = TermSearchIndex(self._name_entries)
+        return self._name_search
+
+    @property
+    def alternative_name_search(self):
+        if self._alternative_name_search is None:
+            with self.lock:
+                if self._alternative_name_search is None:
+                    self._alternative_name_search = TermSearchIndex(self._alternative_name_entries)
+        return self._alternative_name_search
+
+    def modification(self, mod_id):
+        '''
+        Get the :class:`Modification` with id ``mod_id``, loading it on first use.
+
+        Everything reachable from the modification is loaded with it, so that
+        reading the instances handed out by the index never issues a lazy query.
+
+        Parameters
+        ----------
+        mod_id: int
+
+        Returns
+        -------
+        Modification
+
+        Raises
+        ------
+        KeyError
+        '''
+        try:
+            return self.by_id[mod_id]
+        except KeyError:
+            if mod_id not in self.ids:
+                raise
+        with self.lock:
+            mod = self.by_id.get(mod_id)
+            if mod is None:
+                mod = self.session.query(Modification).options(
+                    selectinload(Modification.specificities).options(
+                        joinedload(Specificity.position),
+                        joinedload(Specificity.classification),
+                        selectinload(Specificity.neutral_losses)),
+                    selectinload(Modification._alt_names),
+                    selectinload(Modification.notes),
+                    selectinload(Modification.bricks),
+                    selectinload(Modification._fragments).selectinload(Fragment._fragment_composition),
+                ).filter(Modification.id == int(mod_id)).one()
+                self.by_id[mod_id] = mod
+        return mod
+
+    def _first_substring_match(self, index, query):
+        if "%" in query or "_" in query:
+            pattern = re.compile(
+                ".*".join(".".join(re.escape(p) for p in part.split("_")) for part in query.split("%")),
+                re.IGNORECASE | re.DOTALL)
+            ids = [key for text, key in zip(index.texts, index.keys) if pattern.search(text)]
+        else:
+            ids = [match.key for match in index.substring(query)]
+        if not ids:
+            return None
+        return min(ids)
+
+    def get(self, identifier, strict=True):
+        '''
+        Find a modification by name, as :meth:`Unimod.get` does for strings.
+
+        Parameters
+        ----------
+        identifier: str
+        strict: bool
+            If :const:`True`, require an exact match, otherwise accept any name
+            containing ``identifier``, ignoring case
+
+        Returns
+        -------
+        Modification
+
+        Raises
+        ------
+        KeyError
+        '''
+        if strict:
+            mod_id = self.names.get(identifier)
+            if mod_id is None:
+                mod_id = self.alternative_names.get(identifier)
+        else:
+            mod_id = self._first_substring_match(self.name_search, identifier)
+            if mod_id is None:
+                alt_id = self._first_substring_match(self.alternative_name_search, identifier)
+                if alt_id is not None:
+                    mod_id = self.alternative_name_owner[alt_id]
+        if mod_id is None:
+            raise KeyError(identifier)
+        return self.modification(mod_id)
+
+
+class UnimodMassIndex(object):
+    '''
+    An in-memory index over the monoisotopic masses of every :class:`Modification`
+    in a database, grouped by the residue each may be applied to, which answers
+    many mass shift queries at once with binary searches over sorted arrays.
+
+    Attributes
+    ----------
+    masses: :class:`numpy.ndarray`
+        The monoisotopic mass of each (modification, residue) pair, sorted
+    residues: :class:`numpy.ndarray`
+        The residue of each entry in :attr:`masses`
+    modification_ids: :class:`numpy.ndarray`
+        The modification id of each entry in :attr:`masses`
+    by_residue: dict
+        Maps each residue to a pair of sorted mass and modification id arrays
+    any_residue: tuple
+        A pair of sorted mass and modification id arrays with one entry
+        per modification, for queries which do not name a residue
+    '''
+    def __init__(self, session):
+        rows = session.query(
+            Modification.monoisotopic_mass, Specificity.amino_acid, Modification.id).join(
+            Modification.specificities).distinct().all()
+        rows = sorted(
+            (mass, residue, mod_id) for mass, residue, mod_id in rows if mass is not None)
+        self.masses = np.array([r[0] for r in rows], dtype=np.float64)
+        self.residues = np.array([r[1] for r in rows], dtype=object)
+        self.modification_ids = np.array([r[2] for r in rows], dtype=np.int64)
+        self.by_residue = {}
+        for residue in set(self.residues):
+            mask = self.residues == residue
+            self.by_residue[residue] = (self.masses[mask], self.modification_ids[mask])
+        mods = session.query(Modification.monoisotopic_mass, Modification.id).filter(
+            Modification.monoisotopic_mass != None).all()  # noqa: E711
+        mods.sort()
+        self.any_residue = (
+            np.array([m[0] for m in mods], dtype=np.float64),
+            np.array([m[1] for m in mods], dtype=np.int64))
+
+    def search(self, masses, residues=None, mass_error=1e-6, error_unit='Da'):
+        '''
+        Find the modifications whose monoisotopic mass lies within ``mass_error``
+        of each of ``masses``, and which may be applied to the matching residue.
+
+        Parameters
+        ----------
+        masses: array-like of float
+            The observed mass shifts
+        residues: str or iterable of str, optional
+            The residue of each query, or a single residue for all of them. A residue
+            of :const:`None` matches modifications regardless of their specificities.
+        mass_error: float
+            The tolerance, inclusive, either side of each mass
+        error_unit: str
+            Either ``"Da"`` for an absolute tolerance or ``"ppm"`` for one relative
+            to each query mass
+
+        Returns
+        -------
+        list of :class:`numpy.ndarray`
+            The modification ids matching each query, in order of increasing mass
+        '''
+        masses = np.asarray(masses, dtype=np.float64).reshape(-1)
+        if residues is None or isinstance(residues, basestring):
+            residues = [residues] * len(masses)
+        else:
+            residues = list(residues)
+            if len(residues) != len(masses):
+                raise ValueError(
+                    "Got %d residues for %d masses" % (len(residues), len(masses)))
+        if error_unit == 'Da':
+            errors = np.full_like(masses, mass_error)
+        elif error_unit == 'ppm':
+            errors = np.abs(masses) * mass_error * 1e-6
+        else:
+            raise ValueError("Unknown mass error unit %r, expected 'Da' or 'ppm'" % (error_unit, ))
+        lower = masses - errors
+        upper = masses + errors
+        results = [None] * len(masses)
+        groups = {}
+        for i, residue in enumerate(residues):
+            groups.setdefault(residue, []).append(i)
+        empty = np.array([], dtype=np.int64)
+        for residue, positions in groups.items():
+            if residue is None:
+                reference_masses, reference_ids = self.any_residue
+            else:
+                try:
+                    reference_masses, reference_ids = self.by_residue[residue]
+                except KeyError:
+                    for i in positions:
+                        results[i] = empty
+                    continue
+            positions = np.array(positions, dtype=np.intp)
+            starts = np.searchsorted(reference_masses, lower[positions], side='left')
+            ends = np.searchsorted(reference_masses, upper[positions], side='right')
+            for i, start, end in zip(positions, starts, ends):
+                results[i] = reference_ids[start:end]
+        return results
+
+
 class Unimod(object):
     name = "UNIMOD"
     default_version = '1.0'
 
-    def __init__(self, path=None, unimod_xml_uri=_unimod_xml_download_url):
+    def __init__(self, path=None, unimod_xml_uri=_unimod_xml_download_url, snapshot_path=None,
+                 snapshot_source=None):
+        self._index = None
+        self._mass_index = None
+        self._index_session = None
+        self._lock = threading.RLock()
         if path is None:
             self.path = None
-            self.session = create(unimod_xml_uri)
+            initial = None
+            if snapshot_path is not None:
+                # the snapshot is only used if it was built from ``snapshot_source``,
+                # otherwise ``unimod_xml_uri`` is parsed
+                if snapshot_source is None:
+                    snapshot_source = unimod_xml_uri
+                initial = load_snapshot(snapshot_path, snapshot_source)
+            if initial is None:
+                initial = create(unimod_xml_uri)
         else:
             self.path = path
             try:
-                self.session = session(path)
-                if self.session.query(Modification).first() is None:
+                initial = session(path)
+                if initial.query(Modification).first() is None:
                     raise Exception()
             except Exception:
                 # Database may not yet exist at that location
-                self.session = create(unimod_xml_uri, path)
-                self.session.query(Modification).first()
+                initial = create(unimod_xml_uri, path)
+                initial.query(Modification).first()
+        # Each thread queries through a session, and a connection, of its own
+        self.session = scoped_session(sessionmaker(bind=initial.get_bind(), autoflush=False))
+        initial.close()
 
     @property
     def version(self):
@@ -744,62 +1411,128 @@ class Unimod(object):
         except Exception:
             return self.default_version
 
+    @property
+    def mass_index(self):
+        '''
+        The :class:`UnimodMassIndex` over this database, built on first use.
+        '''
+        mass_index = self._mass_index
+        if mass_index is None:
+            with self._lock:
+                if self._mass_index is None:
+                    self._mass_index = UnimodMassIndex(self._get_index_session())
+                mass_index = self._mass_index
+        return mass_index
+
+    @property
+    def index(self):
+        '''
+        The :class:`UnimodNameIndex` over this database, built on first use.
+
+        The index is built once under a lock, after which lookups through it
+        are plain dictionary reads that any number of threads may share, apart
+        from loading each modification the first time it is found.
+        '''
+        index = self._index
+        if index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = UnimodNameIndex(self._get_index_session(), self._lock)
+                index = self._index
+        return index
+
+    def _get_index_session(self):
+        # The indices hold instances from a session of their own, which no
+        # thread issues queries through, so that sharing those instances across
+        # threads never shares a session that is in use
+        with self._lock:
+            if self._index_session is None:
+                self._index_session = self.session.session_factory()
+                # load every brick now so parsing compositions later issues no queries
+                _brick_compositions(self._index_session)
+            return self._index_session
+
+    def invalidate_index(self):
+        '''
+        Discard :attr:`index` and :attr:`mass_index` so that they are rebuilt to
+        reflect changes to the database.
+        '''
+        with self._lock:
+            self._index = None
+            self._mass_index = None
+            self._index_session = None
+
     def get(self, identifier, strict=True):
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore", category=sa_exc.SAWarning)
-            is_explicit_accession = isinstance(identifier, basestring) and identifier.startswith("UNIMOD")
-            try:
-                # At least one Modification has an empty string code_name or ex_code_name, causing
-                # this fuzzy finder function to happily respond to that record
-                if identifier == "":
-                    raise KeyError(identifier)
-            except (TypeError, ValueError):
-                pass
-            if isinstance(identifier, int) or is_explicit_accession:
-                if is_explicit_accession:
-                    identifier = int(identifier.replace("UNIMOD:", ''))
-                mod = self.session.query(Modification).get(identifier)
-                if mod is None:
-                    raise KeyError(identifier)
-                return mod
-            elif isinstance(identifier, basestring):
-                if strict:
-                    mod = self.session.query(Modification).filter(
-                        (Modification.full_name == identifier) |
-                        (Modification.code_name == identifier) |
-                        (Modification.ex_code_name == identifier)).first()
-                    if mod is None:
-                        alt_name = self.session.query(AlternativeName).filter(
-                            AlternativeName.alt_name == identifier).first()
-                        if alt_name is None:
-                            raise KeyError(identifier)
-                        mod = alt_name.modification
-                    return mod
-                else:
-                    qname = "%%%s%%" % identifier
-                    mod = self.session.query(Modification).filter(
-                        (Modification.full_name.like(qname)) |
-                        (Modification.code_name.like(qname)) |
-                        (Modification.ex_code_name.like(qname))).first()
-                    if mod is None:
-                        alt_name = self.session.query(AlternativeName).filter(
-                            AlternativeName.alt_name.like(qname)).first()
-                        if alt_name is None:
-                            raise KeyError(identifier)
-                        mod = alt_name.modification
-                    return mod
-            else:
+        is_explicit_accession = isinstance(identifier, basestring) and identifier.startswith("UNIMOD")
+        try:
+            # At least one Modification has an empty string code_name or ex_code_name, causing
+            # this fuzzy finder function to happily respond to that record
+            if identifier == "":
                 raise KeyError(identifier)
+        except (TypeError, ValueError):
+            pass
+        if isinstance(identifier, int) or is_explicit_accession:
+            if is_explicit_accession:
+                identifier = int(identifier.replace("UNIMOD:", ''))
+            return self.index.modification(identifier)
+        elif isinstance(identifier, basestring):
+            return self.index.get(identifier, strict)
+        else:
+            raise KeyError(identifier)
 
     by_title = by_name = get
 
     __getitem__ = get
 
-    def infer(self, mass, amino_acid, mass_error=1e-6):
-        candidates = self.session.query(Modification).filter(
-            Modification.monoisotopic_mass.between(mass - mass_error, mass + mass_error)
-        ).join(Modification.specificities).filter(Specificity.amino_acid == amino_acid).all()
-        return candidates
+    def infer(self, mass, amino_acid, mass_error=1e-6, error_unit='Da'):
+        '''
+        Find the modifications of ``amino_acid`` whose monoisotopic mass is
+        within ``mass_error`` of ``mass``.
+
+        Parameters
+        ----------
+        mass: float
+        amino_acid: str
+            The residue, or a terminal position like ``"N-term"``, the modification
+            must be specified for. If :const:`None`, any modification will match.
+        mass_error: float
+        error_unit: str
+            Either ``"Da"`` or ``"ppm"``
+
+        Returns
+        -------
+        list of :class:`Modification`
+
+        See Also
+        --------
+        :meth:`infer_batch`
+        '''
+        return self.infer_batch([mass], [amino_acid], mass_error, error_unit)[0]
+
+    def infer_batch(self, masses, amino_acids=None, mass_error=1e-6, error_unit='Da'):
+        '''
+        Find candidate modifications for many mass shifts at once, as
+        :meth:`infer` does for one.
+
+        Parameters
+        ----------
+        masses: array-like of float
+        amino_acids: str or iterable of str, optional
+            The residue of each mass shift, or a single residue shared by all of
+            them. If :const:`None`, any modification will match.
+        mass_error: float
+        error_unit: str
+            Either ``"Da"`` or ``"ppm"``
+
+        Returns
+        -------
+        list of list of :class:`Modification`
+            The candidates for each mass shift, in order of increasing mass
+        '''
+        modification = self.index.modification
+        return [
+            [modification(mod_id) for mod_id in hits]
+            for hits in self.mass_index.search(masses, amino_acids, mass_error, error_unit)]
 
     @property
     def mods(self):
@@ -830,4 +1563,8 @@ class UNIMODEntity(Entity):
         data['id'] = 'UNIMOD:%s' % modification.id
         data['name'] = modification.ex_code_name or modification.code_name or modification.full_name
         data['_object'] = modification
+        try:
+            data['composition'] = modification.composition
+        except AttributeError:
+            pass
         return cls(vocabulary, **data)
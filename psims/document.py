@@ -1,8 +1,12 @@
 import warnings
+from array import array
+from bisect import bisect_left
 from collections import defaultdict, OrderedDict
 from functools import partial, update_wrapper
 from contextlib import contextmanager
 
+import numpy as np
+
 from .controlled_vocabulary import obo_cache, ControlledVocabulary
 from .utils import add_metaclass, ensure_iterable, Mapping
 
@@ -37,7 +41,52 @@ class ReferentialIntegrityError(KeyError):
     pass
 
 
-class SpecializedContextCache(OrderedDict):
+TRACK_FULL = "full"
+TRACK_COUNT = "count"
+TRACK_COMPACT = "compact"
+
+
+class _ReferenceTrackerMixin(object):
+    # when a set, references to unregistered ids are recorded here to be
+    # reported at the end of the document instead of being checked inline
+    unresolved = None
+
+    def _format(self, key):
+        if isinstance(key, int):
+            return id_maker(self.type_name, key)
+        return str(key)
+
+    def _missing_reference(self, key):
+        if self.unresolved is not None:
+            self.unresolved.add(key)
+            # not stored, so a later registration of a forward reference is
+            # neither an overwrite nor reported
+            return self._format(key) if key is not None else None
+        if key is None:
+            if self.missing_reference_is_error:
+                raise ReferentialIntegrityError(
+                    "A reference key for %s should not be \"None\"" % (self.type_name, ))
+            else:
+                warnings.warn(
+                    "A reference key for %s should not be \"None\"" % (self.type_name, ),
+                    ReferentialIntegrityWarning,
+                    stacklevel=4)
+                return None
+        if self.missing_reference_is_error:
+            raise ReferentialIntegrityError(key)
+        else:
+            warnings.warn(
+                "No reference was found for %r in %s" % (key, self.type_name),
+                ReferentialIntegrityWarning,
+                stacklevel=4)
+        new_value = self._format(key)
+        self[key] = new_value
+        return new_value
+
+
+class SpecializedContextCache(OrderedDict, _ReferenceTrackerMixin):
+    policy = TRACK_FULL
+
     def __init__(self, type_name, missing_reference_is_error=False):
         super(SpecializedContextCache, self).__init__()
         self.type_name = type_name
@@ -50,37 +99,12 @@ class SpecializedContextCache(OrderedDict):
             item = dict.__getitem__(self, key)
             return item
         except KeyError:
-            if key is None:
-                if self.missing_reference_is_error:
-                    raise ReferentialIntegrityError(
-                        "A reference key for %s should not be \"None\"" % (self.type_name, ))
-                else:
-                    warnings.warn(
-                        "A reference key for %s should not be \"None\"" % (self.type_name, ),
-                        ReferentialIntegrityWarning,
-                        stacklevel=3)
-                    return None
-            if self.missing_reference_is_error:
-                raise ReferentialIntegrityError(key)
-            else:
-                warnings.warn(
-                    "No reference was found for %r in %s" % (key, self.type_name),
-                    ReferentialIntegrityWarning,
-                    stacklevel=3)
-            if isinstance(key, int):
-                new_value = id_maker(self.type_name, key)
-            else:
-                new_value = str(key)
-            self[key] = new_value
-            return new_value
+            return self._missing_reference(key)
 
     def register(self, id):
         if id is None:
             return None
-        if isinstance(id, int):
-            value = id_maker(self.type_name, id)
-        else:
-            value = str(id)
+        value = self._format(id)
         self[id] = value
         self.preregistered[id] = value
         return value
@@ -93,14 +117,336 @@ class SpecializedContextCache(OrderedDict):
         super(SpecializedContextCache, self).__setitem__(key, value)
         self.bijection[value] = key
 
+    @property
+    def first(self):
+        """The first key registered, if any"""
+        for key in self:
+            return key
+        return None
+
     def __repr__(self):
         return '%s\n%s' % (self.type_name, dict.__repr__(self))
 
 
+class CountingContextCache(_ReferenceTrackerMixin):
+    """A stand-in for :class:`SpecializedContextCache` for entity types which
+    are never referenced, or only by the ids they were registered with, which
+    counts registrations but stores nothing.
+
+    Every lookup succeeds, formatting the key the same way registration does,
+    so referential integrity is not checked for this type.
+
+    Attributes
+    ----------
+    type_name : str
+    count : int
+        The number of ids registered
+    first : object
+        The first key registered, if any
+    """
+    policy = TRACK_COUNT
+
+    def __init__(self, type_name, missing_reference_is_error=False):
+        self.type_name = type_name
+        self.missing_reference_is_error = missing_reference_is_error
+        self.count = 0
+        self.first = None
+
+    def register(self, id):
+        if id is None:
+            return None
+        self[id] = self._format(id)
+        return self._format(id)
+
+    def __setitem__(self, key, value):
+        if self.first is None:
+            self.first = key
+        self.count += 1
+
+    def __getitem__(self, key):
+        if key is None:
+            return self._missing_reference(key)
+        return self._format(key)
+
+    def get(self, key, default=None):
+        if key is None:
+            return default
+        return self._format(key)
+
+    def __contains__(self, key):
+        return key is not None
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return '%s\n<%d ids counted>' % (self.type_name, self.count)
+
+
+try:
+    array('q')
+    _int64_typecode = 'q'
+except ValueError:  # pragma: no cover
+    _int64_typecode = 'l'
+
+_int64_bound = 2 ** 63
+
+
+class _CompactIntSet(object):
+    """A set of 64-bit integers held in a sorted array, costing eight bytes
+    per member. Members added in increasing order are appended directly, and
+    the rest are buffered and merged in periodically.
+    """
+
+    def __init__(self):
+        self.members = array(_int64_typecode)
+        self.pending = set()
+
+    def __contains__(self, value):
+        if value in self.pending:
+            return True
+        members = self.members
+        i = bisect_left(members, value)
+        return i < len(members) and members[i] == value
+
+    def add(self, value):
+        members = self.members
+        if not members or value > members[-1]:
+            members.append(value)
+        else:
+            # duplicates of existing members are dropped when merging
+            pending = self.pending
+            pending.add(value)
+            if len(pending) > 1024 and len(pending) > len(members) >> 4:
+                self._merge()
+
+    def _merge(self):
+        merged = np.union1d(
+            np.frombuffer(self.members, dtype=np.int64),
+            np.fromiter(self.pending, dtype=np.int64, count=len(self.pending)))
+        self.members = array(_int64_typecode)
+        self.members.frombytes(merged.astype(np.int64).tobytes())
+        self.pending = set()
+
+    def __len__(self):
+        if self.pending:
+            self._merge()
+        return len(self.members)
+
+
+class CompactContextCache(_ReferenceTrackerMixin):
+    """A stand-in for :class:`SpecializedContextCache` which still checks
+    referential integrity, but stores each registered id as a single 64-bit
+    integer instead of as entries in several dictionaries.
+
+    Integer ids are stored as they are, and other ids by their hash, so a
+    lookup of an unregistered id could, with vanishingly small probability,
+    be mistaken for a registered one. Only ids registered with a value other
+    than the one :meth:`register` would give them are stored in full. The
+    ids cannot be enumerated, and overwriting an id is not warned about.
+
+    Attributes
+    ----------
+    type_name : str
+    integers : :class:`_CompactIntSet`
+        The integer ids registered
+    hashes : :class:`_CompactIntSet`
+        The hashes of the other ids registered
+    overrides : dict
+        Maps ids registered with an unusual value to that value
+    first : object
+        The first key registered, if any
+    """
+    policy = TRACK_COMPACT
+
+    def __init__(self, type_name, missing_reference_is_error=False):
+        self.type_name = type_name
+        self.missing_reference_is_error = missing_reference_is_error
+        self.integers = _CompactIntSet()
+        self.hashes = _CompactIntSet()
+        self.overrides = dict()
+        self.first = None
+
+    def _slot(self, key):
+        if isinstance(key, int) and -_int64_bound <= key < _int64_bound:
+            return self.integers, key
+        return self.hashes, hash(key)
+
+    def register(self, id):
+        if id is None:
+            return None
+        value = self._format(id)
+        self[id] = value
+        return value
+
+    def __setitem__(self, key, value):
+        if self.first is None:
+            self.first = key
+        members, slot = self._slot(key)
+        members.add(slot)
+        if value != self._format(key):
+            self.overrides[key] = value
+        else:
+            self.overrides.pop(key, None)
+
+    def __contains__(self, key):
+        if key is None:
+            return False
+        members, slot = self._slot(key)
+        return slot in members
+
+    def __getitem__(self, key):
+        if key in self:
+            try:
+                return self.overrides[key]
+            except KeyError:
+                return self._format(key)
+        return self._missing_reference(key)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def __len__(self):
+        return len(self.integers) + len(self.hashes)
+
+    def __repr__(self):
+        return '%s\n<%d ids tracked compactly>' % (self.type_name, len(self))
+
+
+tracking_policies = {
+    TRACK_FULL: SpecializedContextCache,
+    TRACK_COUNT: CountingContextCache,
+    TRACK_COMPACT: CompactContextCache,
+}
+
+
 class AmbiguousTermWarning(UserWarning):
     pass
 
 
+class UnifiedTermIndex(object):
+    """A single lookup table over several controlled vocabularies which maps
+    a query to every ``(cv, term)`` pair it resolves to, in vocabulary order.
+
+    Vocabularies backed by a :class:`~.ControlledVocabulary` are merged into
+    one exact-match and one case-folded table covering accessions, names,
+    normalized names and synonyms. Other vocabularies, like the database-backed
+    Unimod, are queried directly. Every query which resolves to a term is cached,
+    so repeated queries cost a single dictionary lookup, and the most recently
+    used misses, like free-text user param names, are cached up to :attr:`max_misses`.
+
+    Attributes
+    ----------
+    vocabularies : list
+        The vocabularies indexed, in resolution order
+    exact : dict
+        Maps an exact query to a list of ``(vocabulary position, term id)`` pairs
+    folded : dict
+        Maps a case-folded query to a list of ``(vocabulary position, term id)`` pairs
+    opaque : list
+        The positions of vocabularies which could not be merged into the tables
+    partial : list
+        The positions of vocabularies which were merged into the tables but were
+        restricted to a subset of their terms, and are queried directly on a miss
+    cache : dict
+        Maps each query which resolved to a term to the tuple of ``(cv, term)``
+        pairs it resolved to
+    misses : :class:`~collections.OrderedDict`
+        The queries which resolved to nothing, least recently used first
+    max_misses : int
+        The number of misses kept in :attr:`misses`
+    """
+
+    def __init__(self, vocabularies, max_misses=4096):
+        self.vocabularies = list(vocabularies)
+        self.exact = defaultdict(list)
+        self.folded = defaultdict(list)
+        self.opaque = []
+        self.partial = []
+        self.cache = dict()
+        self.misses = OrderedDict()
+        self.max_misses = max_misses
+        self._build()
+
+    def _build(self):
+        for i, cv in enumerate(self.vocabularies):
+            source = getattr(cv, 'vocabulary', cv)
+            try:
+                exact, folded = source.lookup_tables()
+            except AttributeError:
+                self.opaque.append(i)
+                continue
+            if source.is_restricted():
+                self.partial.append(i)
+            for key, term_id in exact.items():
+                self.exact[key].append((i, term_id))
+            for key, term_id in folded.items():
+                self.folded[key].append((i, term_id))
+        self.exact = dict(self.exact)
+        self.folded = dict(self.folded)
+
+    def _term_for(self, i, term_id):
+        cv = self.vocabularies[i]
+        return cv, cv[term_id]
+
+    def _resolve(self, query):
+        hits = {}
+        try:
+            for i, term_id in self.folded.get(query.lower(), ()):
+                hits[i] = term_id
+        except AttributeError:
+            pass
+        for i, term_id in self.exact.get(query, ()):
+            hits[i] = term_id
+        resolved = [(i, self._term_for(i, term_id)) for i, term_id in hits.items()]
+        for i in self.opaque + [i for i in self.partial if i not in hits]:
+            cv = self.vocabularies[i]
+            try:
+                resolved.append((i, (cv, cv[query])))
+            except KeyError:
+                continue
+        resolved.sort(key=lambda x: x[0])
+        return tuple(pair for i, pair in resolved)
+
+    def resolve(self, query):
+        """Find every ``(cv, term)`` pair ``query`` resolves to.
+
+        Parameters
+        ----------
+        query : str
+            An accession, name or synonym
+
+        Returns
+        -------
+        tuple
+            The ``(cv, term)`` pairs, in vocabulary order. Empty if nothing matched.
+        """
+        try:
+            return self.cache[query]
+        except KeyError:
+            pass
+        except TypeError:
+            return self._resolve(query)
+        misses = self.misses
+        if query in misses:
+            # mark as most recently used
+            misses[query] = misses.pop(query)
+            return ()
+        result = self._resolve(query)
+        if result:
+            self.cache[query] = result
+        else:
+            misses[query] = None
+            if len(misses) > self.max_misses:
+                misses.popitem(last=False)
+        return result
+
+    def is_ambiguous(self, query):
+        return len(self.resolve(query)) > 1
+
+
 class VocabularyResolver(object):
     warn_on_ambiguous_missing_units = True
     validate_units = True
@@ -111,8 +457,42 @@ class VocabularyResolver(object):
         if vocabulary_resolver is None:
             vocabulary_resolver = obo_cache
         self.vocabulary_resolver = vocabulary_resolver
+        self._term_index = None
         self.vocabularies = list(map(self._bind_vocabulary, vocabularies))
 
+    @property
+    def vocabularies(self):
+        return self._vocabularies
+
+    @vocabularies.setter
+    def vocabularies(self, value):
+        self._vocabularies = value
+        self.invalidate_term_index()
+
+    def invalidate_term_index(self):
+        """Discard the :class:`UnifiedTermIndex` so that it is rebuilt on the next lookup,
+        along with the unit resolution and validation caches. Call this after modifying
+        a vocabulary in place.
+        """
+        self._term_index = None
+        self._unit_cache = {}
+        self._unit_validation_cache = {}
+
+    @property
+    def term_index(self):
+        """The :class:`UnifiedTermIndex` over :attr:`vocabularies`, built on first use
+        and rebuilt if vocabularies are added or removed.
+
+        Returns
+        -------
+        :class:`UnifiedTermIndex`
+        """
+        index = self._term_index
+        if index is None or len(index.vocabularies) != len(self._vocabularies):
+            self.invalidate_term_index()
+            index = self._term_index = UnifiedTermIndex(self._vocabularies)
+        return index
+
     def _bind_vocabulary(self, cv):
         cv.resolver = self.vocabulary_resolver
         return cv
@@ -193,118 +573,130 @@ class VocabularyResolver(object):
             return CVParam(name=name, value=value, **kwargs)
 
     def _resolve_cv_ref(self, query, name, accession):
-        cv_ref = None
-        term = None
-        for cv in self.vocabularies:
-            try:
-                term = cv[query]
-                name = term["name"]
-                accession = term["id"]
-                if cv_ref is not None:
-                    raise ValueError(
-                        "Resolutions exist for the term denoted by %r, found in %s and %s" % (
-                            query, cv_ref, cv.id
-                        ))
-                cv_ref = cv.id
-            except KeyError:
-                continue
-        return cv_ref, name, accession, term
+        resolutions = self.term_index.resolve(query)
+        if not resolutions:
+            return None, name, accession, None
+        if len(resolutions) > 1:
+            raise ValueError(
+                "Resolutions exist for the term denoted by %r, found in %s and %s" % (
+                    query, resolutions[0][0].id, resolutions[1][0].id
+                ))
+        cv, term = resolutions[0]
+        return cv.id, term["name"], term["id"], term
 
     def _resolve_units(self, state):
         unit_name = state.get("unit_name")
         unit_accession = state.get("unit_accession")
         unit_ref = state.get('unit_cv_ref')
         if unit_name is not None or unit_accession is not None:
-            if unit_accession is not None:
-                unit_term, source = self.term(unit_accession, include_source=True)
-                unit_name = unit_term.name
-                unit_accession = unit_term.id
-                unit_ref = source.id
-            elif unit_name is not None:
-                unit_term, source = self.term(unit_name, include_source=True)
+            key = (unit_name, unit_accession, unit_ref)
+            try:
+                unit_name, unit_accession, unit_ref = self._unit_cache[key]
+            except KeyError:
+                if unit_accession is not None:
+                    unit_term, source = self.term(unit_accession, include_source=True)
+                else:
+                    unit_term, source = self.term(unit_name, include_source=True)
                 unit_name = unit_term.name
                 unit_accession = unit_term.id
                 unit_ref = source.id
+                self._unit_cache[key] = (unit_name, unit_accession, unit_ref)
             state['unit_name'] = unit_name
             state['unit_accession'] = unit_accession
             state['unit_cv_ref'] = unit_ref
 
-    def _validate_units(self, term, state, name):
+    def _unit_fill(self, accession):
+        try:
+            unit_term, unit_source = self.term(accession, include_source=True)
+        except KeyError:
+            return None
+        return {
+            "unit_accession": unit_term.id,
+            "unit_name": unit_term.name,
+            "unit_cv_ref": unit_source.id,
+        }
+
+    def _check_units(self, term, state, name):
+        """Work out how the unit information in ``state`` should be completed
+        and what, if anything, is wrong with it, without modifying ``state``.
+
+        Returns
+        -------
+        fill : dict or None
+            The unit fields to set on ``state``
+        problems : list
+            ``(message, category)`` pairs to warn about
+        """
         has_units = term.get("has_units", [])
-        if has_units:
-            if len(has_units) == 1:
-                provided_unit_accession = state.get("unit_accession")
-                if provided_unit_accession is None:
-                    try:
-                        unit_term, unit_source = self.term(has_units[0].accession, include_source=True)
-                        state['unit_accession'] = unit_term.id
-                        state['unit_name'] = unit_term.name
-                        state['unit_cv_ref'] = unit_source.id
-                    except KeyError:
-                        pass
-                elif self.validate_units:
-                    unit_term, unit_source = self.term(has_units[0].accession, include_source=True)
-                    if (state['unit_accession'] != unit_term.id or state['unit_name'] != unit_term.name or
-                            state['unit_cv_ref'] != unit_source.id):
-                        warnings.warn("Provided unit for %r does not match the permitted unit (%r, %r, %r)" % (
+        problems = []
+        fill = None
+        if not has_units:
+            return fill, problems
+        provided = (state.get('unit_accession'), state.get('unit_name'), state.get('unit_cv_ref'))
+        if len(has_units) == 1:
+            if provided[0] is None:
+                fill = self._unit_fill(has_units[0].accession)
+            elif self.validate_units:
+                unit_term, unit_source = self.term(has_units[0].accession, include_source=True)
+                if provided != (unit_term.id, unit_term.name, unit_source.id):
+                    problems.append((
+                        "Provided unit for %r does not match the permitted unit (%r, %r, %r)" % (
                             name,
-                            (state['unit_accession'], unit_term.id),
-                            (state['unit_name'], unit_term.name),
-                            (state['unit_cv_ref'], unit_source.id),
-                        ), stacklevel=4)
-            elif len(has_units) > 1:
-                provided_unit_accession = state.get("unit_accession")
-                if provided_unit_accession is None:
-                    if self.warn_on_ambiguous_missing_units:
-                        warnings.warn(
-                            "Multiple unit options are possible for parameter %r but none were specified" % (
-                                name),
-                            AmbiguousTermWarning,
-                            stacklevel=4
-                        )
-                    try:
-                        unit_term, unit_source = self.term(has_units[0].accession, include_source=True)
-                        state['unit_accession'] = unit_term.id
-                        state['unit_name'] = unit_term.name
-                        state['unit_cv_ref'] = unit_source.id
-                    except KeyError:
-                        pass
-                elif self.validate_units:
-                    for t in has_units:
-                        unit_term, unit_source = self.term(t.accession, include_source=True)
-                        if (state['unit_accession'] == unit_term.id and state['unit_name'] == unit_term.name and
-                                state['unit_cv_ref'] == unit_source.id):
-                            break
-                    else:
-                        warnings.warn(
-                            "Provided unit for %r does not match any of the permitted units %r" % (
-                                name,
-                                ((state['unit_accession'], state['unit_name'], state['unit_cv_ref']),
-                                 has_units)),
-                            stacklevel=4
-                        )
+                            (provided[0], unit_term.id),
+                            (provided[1], unit_term.name),
+                            (provided[2], unit_source.id),
+                        ), UserWarning))
+        else:
+            if provided[0] is None:
+                if self.warn_on_ambiguous_missing_units:
+                    problems.append((
+                        "Multiple unit options are possible for parameter %r but none were specified" % (
+                            name),
+                        AmbiguousTermWarning))
+                fill = self._unit_fill(has_units[0].accession)
+            elif self.validate_units:
+                for t in has_units:
+                    unit_term, unit_source = self.term(t.accession, include_source=True)
+                    if provided == (unit_term.id, unit_term.name, unit_source.id):
+                        break
+                else:
+                    problems.append((
+                        "Provided unit for %r does not match any of the permitted units %r" % (
+                            name, (provided, has_units)),
+                        UserWarning))
+        return fill, problems
+
+    def _validate_units(self, term, state, name):
+        key = (term.get("id"), name, state.get('unit_accession'), state.get('unit_name'),
+               state.get('unit_cv_ref'), self.validate_units, self.warn_on_ambiguous_missing_units)
+        try:
+            fill, problems = self._unit_validation_cache[key]
+        except KeyError:
+            fill, problems = self._check_units(term, state, name)
+            for message, category in problems:
+                warnings.warn(message, category, stacklevel=4)
+            # only remember the outcome once its warnings have been issued, so
+            # that warnings escalated to errors are raised every time
+            self._unit_validation_cache[key] = fill, problems
+        if fill is not None:
+            state.update(fill)
 
     def term(self, name, include_source=False):
         deferred = None
-        for cv in self.vocabularies:
-            try:
-                term = cv[name]
-                if term.get("is_obsolete", False):
-                    deferred = term, cv
-                    raise KeyError(name)
-                if include_source:
-                    return term, cv
-                else:
-                    return term
-            except KeyError:
-                pass
-        else:
-            if deferred:
-                if include_source:
-                    return deferred
-                else:
-                    return deferred[0]
-            raise KeyError(name)
+        for cv, term in self.term_index.resolve(name):
+            if term.get("is_obsolete", False):
+                deferred = term, cv
+                continue
+            if include_source:
+                return term, cv
+            else:
+                return term
+        if deferred:
+            if include_source:
+                return deferred
+            else:
+                return deferred[0]
+        raise KeyError(name)
 
     def load_vocabularies(self):
         for vocab in self.vocabularies:
@@ -318,11 +710,109 @@ class VocabularyResolver(object):
 
 
 class DocumentContext(dict, VocabularyResolver):
+    """Tracks the ids of every entity registered in a document, by entity type,
+    alongside the vocabularies used to resolve its params.
+
+    Attributes
+    ----------
+    missing_reference_is_error : bool
+        Whether a reference to an unregistered id raises an error rather than
+        a warning
+    tracking_policies : dict
+        Maps entity type name to how its ids are tracked, one of
+        ``"full"`` (:class:`SpecializedContextCache`), ``"count"``
+        (:class:`CountingContextCache`) or ``"compact"`` (:class:`CompactContextCache`).
+        Types not listed are tracked in full.
+    trusted : bool
+        Whether the content written through this context is trusted to be valid,
+        skipping unit validation and deferring reference checks to
+        :meth:`integrity_report`
+    """
+
+    trusted = False
 
-    def __init__(self, vocabularies=None, vocabulary_resolver=None, missing_reference_is_error=False):
+    def __init__(self, vocabularies=None, vocabulary_resolver=None, missing_reference_is_error=False,
+                 tracking_policies=None, trusted=False):
         dict.__init__(self)
         VocabularyResolver.__init__(self, vocabularies, vocabulary_resolver)
         self.missing_reference_is_error = missing_reference_is_error
+        self.tracking_policies = {}
+        for type_name, policy in (tracking_policies or {}).items():
+            self.set_tracking_policy(type_name, policy)
+        if trusted:
+            self.set_trusted(trusted)
+
+    def set_trusted(self, trusted=True):
+        """Switch trusted mode on or off.
+
+        In trusted mode, units are neither validated nor checked for ambiguity,
+        and references to unregistered ids are recorded silently rather than
+        warned about or raised, to be inspected once with :meth:`integrity_report`.
+
+        Parameters
+        ----------
+        trusted : bool
+        """
+        self.trusted = bool(trusted)
+        self.validate_units = not self.trusted
+        self.warn_on_ambiguous_missing_units = not self.trusted
+        for cache in self.values():
+            self._configure_cache(cache)
+
+    def _configure_cache(self, cache):
+        if not self.trusted:
+            cache.unresolved = None
+        elif cache.unresolved is None:
+            cache.unresolved = set()
+
+    def integrity_report(self):
+        """Collect the references made in trusted mode to ids which were never registered.
+
+        References to ids which were registered after being referenced are not included.
+
+        Returns
+        -------
+        dict
+            Maps entity type name to the list of unregistered ids referenced
+        """
+        report = {}
+        for type_name, cache in self.items():
+            if not cache.unresolved:
+                continue
+            missing = [key for key in cache.unresolved if key is None or key not in cache]
+            if missing:
+                report[type_name] = sorted(missing, key=str)
+        return report
+
+    def set_tracking_policy(self, type_name, policy):
+        """Choose how the ids of entity type ``type_name`` are tracked.
+
+        Parameters
+        ----------
+        type_name : str or type
+        policy : str
+            One of ``"full"``, ``"count"`` or ``"compact"``
+
+        Raises
+        ------
+        ValueError
+            If ``policy`` is not recognized, or ids of this type were already registered
+            under a different policy
+        """
+        if not isinstance(type_name, str):
+            if isinstance(type_name, (type, ReprBorrowingPartial)):
+                type_name = type_name.__name__
+        if policy not in tracking_policies:
+            raise ValueError("Unknown tracking policy %r, expected one of %r" % (
+                policy, sorted(tracking_policies)))
+        current = dict.get(self, type_name)
+        if current is not None and current.policy != policy:
+            if len(current):
+                raise ValueError(
+                    "Cannot change the tracking policy of %s after ids have been registered" % (
+                        type_name, ))
+            dict.__delitem__(self, type_name)
+        self.tracking_policies[type_name] = policy
 
     def param_group_reference(self, id):
         # This is a inelegant, as ReferenceableParamGroup is not part document type
@@ -346,9 +836,12 @@ class DocumentContext(dict, VocabularyResolver):
         if not isinstance(key, str):
             if isinstance(key, (type, ReprBorrowingPartial)):
                 key = key.__name__
-        self[key] = SpecializedContextCache(
+        cache_type = tracking_policies[self.tracking_policies.get(key, TRACK_FULL)]
+        cache = cache_type(
             key, missing_reference_is_error=self.missing_reference_is_error)
-        return self[key]
+        self._configure_cache(cache)
+        self[key] = cache
+        return cache
 
 
 NullMap = DocumentContext()
@@ -408,29 +901,75 @@ class ComponentDispatcherBase(object):
         The mapping responsible for managing the global
         state of all created components.
     """
-    _component_partial_type = CallbackBindingPartial
+    _component_partial_type = ReprBorrowingPartial
+
+    # An optional callable to pass every component constructed through this
+    # dispatcher to, at the cost of an extra call per component
+    _post_constructor = None
 
     def __init__(self, context=None, vocabularies=None, vocabulary_resolver=None, component_namespace=None,
-                 missing_reference_is_error=False):
+                 missing_reference_is_error=False, tracking_policies=None, trusted=False):
         if vocabularies is None:
             vocabularies = []
         if context is None:
             context = DocumentContext(
                 vocabularies=vocabularies, vocabulary_resolver=vocabulary_resolver,
-                missing_reference_is_error=missing_reference_is_error)
+                missing_reference_is_error=missing_reference_is_error,
+                tracking_policies=tracking_policies, trusted=trusted)
         else:
             if vocabularies is not None:
                 context.vocabularies.extend(vocabularies)
+            for type_name, policy in (tracking_policies or {}).items():
+                context.set_tracking_policy(type_name, policy)
+            if trusted:
+                context.set_trusted(trusted)
         self.type_cache = dict()
         self.component_namespace = component_namespace
         self.context = context
 
+    @property
+    def trusted(self):
+        return self.context.trusted
+
+    def integrity_report(self):
+        """Collect the references to ids which were never registered, deferred
+        while writing in trusted mode.
+
+        Returns
+        -------
+        dict
+            Maps entity type name to the list of unregistered ids referenced
+
+        See Also
+        --------
+        DocumentContext.integrity_report
+        """
+        return self.context.integrity_report()
+
+    def check_integrity(self):
+        """Report all references to ids which were never registered at once,
+        raising a :class:`ReferentialIntegrityError` if the context treats missing
+        references as errors, or issuing a single :class:`ReferentialIntegrityWarning`
+        otherwise.
+
+        Returns
+        -------
+        dict
+            The report from :meth:`integrity_report`
+        """
+        report = self.integrity_report()
+        if report:
+            message = "Unregistered ids were referenced: %s" % ("; ".join(
+                "%s: %s" % (type_name, ", ".join(map(repr, keys)))
+                for type_name, keys in sorted(report.items())), )
+            if self.context.missing_reference_is_error:
+                raise ReferentialIntegrityError(message)
+            warnings.warn(message, ReferentialIntegrityWarning, stacklevel=2)
+        return report
+
     def _prepare_bind_arguments(self):
         return {'context': self.context}
 
-    def _post_constructor(self, component):
-        pass
-
     def _update_component_namespace(self, tp=None):
         return {}
 
@@ -448,16 +987,15 @@ class ComponentDispatcherBase(object):
                 new_tp.__qualname__ = tp_template.__qualname__
             except AttributeError:
                 pass
-            tp = self._component_partial_type(new_tp, **self._prepare_bind_arguments())
+            if self._post_constructor is not None:
+                tp = CallbackBindingPartial(new_tp, **self._prepare_bind_arguments())
+                tp.callback = self._post_constructor
+            else:
+                tp = self._component_partial_type(new_tp, **self._prepare_bind_arguments())
+            tp.context = self.context
             self.type_cache[name] = tp
         return tp
 
-    def _dispatch_component(self, name):
-        tp = self._locate_component(name)
-        tp.context = self.context
-        tp.callback = self._post_constructor
-        return tp
-
     def __getattr__(self, name):
         """
         Provide access to an automatically parameterized
@@ -475,7 +1013,9 @@ class ComponentDispatcherBase(object):
             A partially parameterized instance constructor for
             the :class:`ComponentBase` type requested.
         """
-        tp = self._dispatch_component(name)
+        tp = self._locate_component(name)
+        # later accesses find the factory directly, without passing through here
+        self.__dict__[name] = tp
         return tp
 
     def ensure_component(self, data, tp):
@@ -526,16 +1066,73 @@ class ComponentDispatcherBase(object):
         return self.context.get_vocabulary(*args, **kwargs)
 
 
+class _DispatcherWriter(object):
+    """The default :attr:`ComponentBase.writer` of components built by an
+    :class:`XMLBindingDispatcherBase`, which is that dispatcher's writer once
+    it has begun writing. Calling :meth:`ComponentBase.bind` overrides it.
+    """
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            return self.dispatcher.writer
+        except (ValueError, AttributeError):
+            return None
+
+
 class XMLBindingDispatcherBase(ComponentDispatcherBase):
 
-    def _post_constructor(self, component):
-        component.writer = self.writer
+    def _update_component_namespace(self, tp=None):
+        ns = super(XMLBindingDispatcherBase, self)._update_component_namespace(tp)
+        ns['writer'] = _DispatcherWriter(self)
+        return ns
 
 
 # ------------------------------------------
 # Base Component Definitions
 
 
+class _ResolvedParams(object):
+    """The params of a component resolved through its context, partitioned
+    in the order they are written.
+
+    Attributes
+    ----------
+    source : list
+        The list of unresolved params these were resolved from
+    count : int
+        The number of entries of :attr:`source` resolved so far
+    references : list
+    cv_params : list
+    user_params : list
+    ordered : tuple
+        :attr:`references`, :attr:`cv_params` and :attr:`user_params`, concatenated
+    """
+    __slots__ = ("source", "count", "references", "cv_params", "user_params", "ordered")
+
+    def __init__(self, source):
+        self.source = source
+        self.count = 0
+        self.references = []
+        self.cv_params = []
+        self.user_params = []
+        self.ordered = ()
+
+    def extend(self, params):
+        for param in params:
+            if isinstance(param, ParamGroupReference):
+                self.references.append(param)
+            elif isinstance(param, UserParam):
+                self.user_params.append(param)
+            else:
+                self.cv_params.append(param)
+        self.ordered = tuple(self.references + self.cv_params + self.user_params)
+
+
 @add_metaclass(ChildTrackingMeta)
 class ComponentBase(object):
     """A base class for all parts of an XML document which
@@ -555,6 +1152,7 @@ class ComponentBase(object):
     _context_manager = None
     _is_open = False
     _after_queue = None
+    _resolved_params = None
     requires_id = True
     writer = None
 
@@ -648,9 +1246,43 @@ class ComponentBase(object):
         params.extend(kwargs.items())
         return params
 
+    def resolve_params(self):
+        """Resolve :attr:`params` through :attr:`context`, in the order they
+        are written: param group references, then cvParams, then userParams.
+
+        Each param is resolved only once. Params appended to :attr:`params` since
+        the last call are resolved and merged in, and if :attr:`params` is replaced,
+        the new params are resolved from scratch. Call :meth:`invalidate_params`
+        after modifying existing entries of :attr:`params` in place.
+
+        Returns
+        -------
+        tuple
+        """
+        params = self.params
+        if not isinstance(params, list):
+            resolved = _ResolvedParams(params)
+            resolved.extend(self.context.param(param) for param in self.prepare_params(params))
+            return resolved.ordered
+        resolved = self._resolved_params
+        if resolved is None or resolved.source is not params or resolved.count > len(params):
+            resolved = self._resolved_params = _ResolvedParams(params)
+        if resolved.count < len(params):
+            count = len(params)
+            pending = [self.context.param(param) for param in self.prepare_params(params[resolved.count:])]
+            resolved.count = count
+            resolved.extend(pending)
+        return resolved.ordered
+
+    def invalidate_params(self):
+        """Discard the params resolved by :meth:`resolve_params`, so that they are
+        resolved again on next use.
+        """
+        self._resolved_params = None
+
     def has_param(self, query, params=None):
         if params is None:
-            params = self.params
+            params = self.resolve_params()
         query_param = self.context.term(query)
         for param in params:
             try:
@@ -658,7 +1290,8 @@ class ComponentBase(object):
                 term = self.context.term(param.accession)
                 if term.id == query_param.id:
                     return True
-            except KeyError:
+            except (KeyError, AttributeError):
+                # param group references have no accession
                 continue
         return False
 
@@ -671,20 +1304,12 @@ class ComponentBase(object):
 
     def write_params(self, xml_file, params=None):
         if params is None:
-            params = self.params
-        params = self.prepare_params(params)
-        user_params = []
-        cv_params = []
-        references = []
+            params = self.resolve_params()
+        else:
+            resolved = _ResolvedParams(params)
+            resolved.extend(self.context.param(param) for param in self.prepare_params(params))
+            params = resolved.ordered
         for param in params:
-            param = self.context.param(param)
-            if isinstance(param, ParamGroupReference):
-                references.append(param)
-            elif isinstance(param, UserParam):
-                user_params.append(param)
-            else:
-                cv_params.append(param)
-        for param in (references + cv_params + user_params):
             param(xml_file)
 
     def element_attrs(self, **kwargs):
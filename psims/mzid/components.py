@@ -79,9 +79,6 @@ class ComponentDispatcher(XMLBindingDispatcherBase):
         ns['xmlns'] = self.xmlns
         return ns
 
-    def _post_constructor(self, component):
-        super(ComponentDispatcher, self)._post_constructor(component)
-
 
 _xmlns = 'http://psidev.info/psi/pi/mzIdentML/1.2'
 
@@ -754,8 +751,7 @@ class ProteinDetectionHypothesis(ComponentBase):
         candidates = []
         has_leading = False
         has_non_leading = False
-        for param in self.params:
-            param = self.context.param(param)
+        for param in self.resolve_params():
             if param.accession is None:
                 continue
             try:
@@ -171,15 +171,23 @@ class MzIdentMLWriter(ComponentDispatcher, XMLDocumentWriter):
         The top level incremental xml writer element which will be closed at the end
         of file generation. Kept to control context
     context : :class:`.DocumentContext`
+    trusted : bool
+        Whether the content written is trusted to be valid. In trusted mode,
+        unit validation is skipped, identification items which are not mappings
+        are assumed to already be bound to this writer, and references to
+        unregistered ids are reported once when the document ends instead of
+        as they are made.
     """
 
     def __init__(self, outfile, close=False, vocabularies=None, missing_reference_is_error=False,
-                 vocabulary_resolver=None, version='1.2.0', **kwargs):
+                 vocabulary_resolver=None, version='1.2.0', tracking_policies=None, trusted=False,
+                 **kwargs):
         if vocabularies is None:
             vocabularies = list(default_cv_list)
         ComponentDispatcher.__init__(
             self, vocabularies=vocabularies, missing_reference_is_error=missing_reference_is_error,
-            vocabulary_resolver=vocabulary_resolver)
+            vocabulary_resolver=vocabulary_resolver, tracking_policies=tracking_policies,
+            trusted=trusted)
         XMLDocumentWriter.__init__(self, outfile, close, **kwargs)
         self.version = version
         self.xmlns = MzIdentML.attr_version_map[version]['xmlns']
@@ -209,6 +217,11 @@ class MzIdentMLWriter(ComponentDispatcher, XMLDocumentWriter):
     def toplevel_tag(self):
         return MzIdentML(version=self.version)
 
+    def end(self, exc_type=None, exc_value=None, traceback=None):
+        super(MzIdentMLWriter, self).end(exc_type, exc_value, traceback)
+        if self.trusted and exc_type is None:
+            self.check_integrity()
+
     def controlled_vocabularies(self):
         """Write out the `<cvList>` element and all its children,
         including both this format's default controlled vocabularies
@@ -383,14 +396,19 @@ class MzIdentMLWriter(ComponentDispatcher, XMLDocumentWriter):
 
     def spectrum_identification_result(self, spectrum_id, id, spectra_data_id=1, identifications=None,
                                        params=None, **kwargs):
+        if self.trusted:
+            identifications = (self.spectrum_identification_item(**s) if isinstance(s, Mapping) else s
+                               for s in ensure_iterable(identifications))
+        else:
+            identifications = (self.spectrum_identification_item(**(s or {}))
+                               if isinstance(s, Mapping) else self.SpectrumIdentificationItem.ensure(s)
+                               for s in ensure_iterable(identifications))
         return self.SpectrumIdentificationResult(
             spectra_data_id=spectra_data_id,
             spectrum_id=spectrum_id,
             id=id,
             params=params,
-            identifications=(self.spectrum_identification_item(**(s or {}))
-                             if isinstance(s, Mapping) else self.SpectrumIdentificationItem.ensure(s)
-                             for s in ensure_iterable(identifications)), **kwargs)
+            identifications=identifications, **kwargs)
 
     def spectrum_identification_item(self, experimental_mass_to_charge,
                                      charge_state, peptide_id, peptide_evidence_id, score, id,
@@ -2,6 +2,7 @@ from .writer import (
     MzMLWriter, ARRAY_TYPES,
     MZ_ARRAY, INTENSITY_ARRAY, CHARGE_ARRAY,
     compression_map, default_cv_list)
+from .shard import MzMLShardWriter, MzMLShard
 
 __all__ = ["MzMLWriter", "ARRAY_TYPES", "compression_map", "default_cv_list",
-           "MZ_ARRAY", "INTENSITY_ARRAY", "CHARGE_ARRAY", ]
+           "MZ_ARRAY", "INTENSITY_ARRAY", "CHARGE_ARRAY", "MzMLShardWriter", "MzMLShard", ]
@@ -549,6 +549,8 @@ class SpectrumList(ComponentBase):
 
 class Spectrum(ComponentBase):
     requires_id = True
+    #: The MS level of the spectrum, once its params have been checked
+    ms_level = None
 
     def __init__(self, index, binary_data_list=None, scan_list=None, precursor_list=None, product_list=None,
                  default_array_length=None, source_file_reference=None, data_processing_reference=None, id=None,
@@ -581,13 +583,13 @@ class Spectrum(ComponentBase):
         self.context = context
         self.context['Spectrum'][id] = self.element.id
         self.params = self.prepare_params(params, **kwargs)
-        self._check_params()
+        if not context.trusted:
+            self._check_params()
 
-    def _check_params(self):
+    def _find_level_and_type(self):
         ms_level = None
         spectrum_type = None
-        for param in self.params:
-            param = self.context.param(param)
+        for param in self.resolve_params():
             try:
                 term = self.context.term(param.accession)
             except (AttributeError, KeyError):
@@ -596,11 +598,27 @@ class Spectrum(ComponentBase):
                 ms_level = int(param.value)
             elif ((term.id == 'MS:1000579') or (term.id == 'MS:1000580')):
                 spectrum_type = term.name
+        return ms_level, spectrum_type
+
+    def find_ms_level(self):
+        """Find the MS level of this spectrum from its params.
+
+        Returns
+        -------
+        int or None
+        """
+        if self.ms_level is None:
+            self.ms_level = self._find_level_and_type()[0]
+        return self.ms_level
+
+    def _check_params(self):
+        ms_level, spectrum_type = self._find_level_and_type()
         if ((ms_level is not None) and (spectrum_type is None)):
             spectrum_type = ('MS:1000579' if (ms_level == 1) else 'MS:1000580')
             self.params.append(self.context.param(spectrum_type))
         elif ((spectrum_type is not None) and (ms_level is None)):
             if (spectrum_type == 'MS:1000579'):
+                ms_level = 1
                 self.params.append(
                     self.context.param(
                         accession='MS:1000511',
@@ -608,6 +626,7 @@ class Spectrum(ComponentBase):
             else:
                 raise ValueError(
                     "A spectrum without MS:100511 'ms level' and cannot be determined from other parameters")
+        self.ms_level = ms_level
 
     def write_content(self, xml_file):
         self.write_params(xml_file)
@@ -690,8 +709,7 @@ class BinaryDataArray(ComponentBase):
         self._array_type = None
 
     def _find_array_type(self):
-        for param in self.params:
-            param = self.context.param(param)
+        for param in self.resolve_params():
             if param.accession is None:
                 continue
             try:
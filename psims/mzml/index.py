@@ -1,4 +1,5 @@
 import re
+import tempfile
 
 import io
 from io import BytesIO
@@ -149,21 +150,162 @@ class IndexList(Sequence):
     def add(self, indexer):
         self.indexers.append(indexer)
 
+    def get_indexer(self, name):
+        """Find the indexer for the elements named ``name``.
+
+        Parameters
+        ----------
+        name : str
+
+        Returns
+        -------
+        :class:`TagIndexerBase`
+
+        Raises
+        ------
+        ValueError
+            If there is no indexer by that name
+        """
+        for indexer in self.indexers:
+            if indexer.name == name:
+                return indexer
+        raise ValueError("No index for %r, expected one of %r" % (
+            name, [indexer.name for indexer in self.indexers]))
+
+
+_COPY_SIZE = 2 ** 20
+
+
+def _patch_in_place(stream, position, old, new):
+    """Replace the first occurrence of ``old`` written to a seekable, readable
+    stream since ``position`` with ``new``, and return to the end of the stream.
+    """
+    stream.flush()
+    end = stream.tell()
+    stream.seek(position)
+    i = stream.read(_COPY_SIZE).find(old)
+    if i == -1:
+        stream.seek(end)
+        raise ValueError("Could not find %r to patch" % (old, ))
+    stream.seek(position + i)
+    stream.write(new)
+    stream.seek(end)
+
+
+class _InPlaceHold(object):
+    """Holds back hashing the bytes written to a seekable, readable stream, so they
+    can be patched in place and read back to be hashed on release.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.position = stream.tell()
+
+    def write(self, b):
+        self.stream.write(b)
+
+    def patch(self, old, new):
+        _patch_in_place(self.stream, self.position, old, new)
+
+    def release(self, checksum):
+        stream = self.stream
+        stream.flush()
+        end = stream.tell()
+        stream.seek(self.position)
+        remaining = end - self.position
+        while remaining > 0:
+            chunk = stream.read(min(remaining, _COPY_SIZE))
+            checksum.update(chunk)
+            remaining -= len(chunk)
+        stream.seek(end)
+
+
+class _SpooledHold(object):
+    """Stages the bytes meant for a stream which cannot be patched in place in a
+    temporary file, which spills to disk when large, until they are released.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.spool = tempfile.SpooledTemporaryFile(max_size=64 * _COPY_SIZE)
+
+    def write(self, b):
+        self.spool.write(b)
+
+    def patch(self, old, new):
+        spool = self.spool
+        spool.seek(0)
+        i = spool.read(_COPY_SIZE).find(old)
+        spool.seek(0, 2)
+        if i == -1:
+            raise ValueError("Could not find %r to patch" % (old, ))
+        spool.seek(i)
+        spool.write(new)
+        spool.seek(0, 2)
+
+    def release(self, checksum):
+        spool = self.spool
+        spool.seek(0)
+        for chunk in iter(lambda: spool.read(_COPY_SIZE), b''):
+            self.stream.write(chunk)
+            checksum.update(chunk)
+        spool.close()
+
 
 class HashingStream(object):
     def __init__(self, stream):
         if isinstance(stream, basestring):
-            stream = open(stream, 'wb')
+            # readable, so that held bytes can be patched in place
+            stream = open(stream, 'w+b')
         self.stream = stream
         self._checksum = sha1()
         self.accumulator = 0
+        self._hold = None
 
     def write(self, b):
-        self.stream.write(b)
-        self._checksum.update(b)
+        if self._hold is not None:
+            self._hold.write(b)
+        else:
+            self.stream.write(b)
+            self._checksum.update(b)
         self.accumulator += len(b)
         return len(b)
 
+    def hold(self):
+        """Hold back hashing everything written from now on until :meth:`release`,
+        so that it can still be changed with :meth:`patch`.
+
+        Bytes are written in place when the stream can be read back, and staged in
+        a temporary file otherwise.
+        """
+        if self._hold is not None:
+            raise ValueError("This stream is already held")
+        try:
+            in_place = self.stream.seekable() and self.stream.readable()
+        except AttributeError:
+            in_place = False
+        self.stream.flush()
+        self._hold = _InPlaceHold(self.stream) if in_place else _SpooledHold(self.stream)
+
+    def patch(self, old, new):
+        """Replace the first occurrence of ``old`` in the held bytes with ``new``,
+        which must be the same length.
+
+        Parameters
+        ----------
+        old : bytes
+        new : bytes
+        """
+        if len(old) != len(new):
+            raise ValueError("A patch must not change the length of the stream")
+        self._hold.patch(old, new)
+
+    def release(self):
+        """Hash the held bytes, as patched, and resume writing normally."""
+        hold = self._hold
+        self._hold = None
+        hold.release(self._checksum)
+
     def flush(self):
         self.stream.flush()
 
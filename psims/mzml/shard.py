@@ -0,0 +1,219 @@
+"""Write the spectra or chromatograms of one mzML document from many processes.
+
+Each worker writes its slice of the spectra to a shard with :class:`MzMLShardWriter`,
+and a single coordinating :class:`~.IndexedMzMLWriter` then copies the shards into
+the document with :meth:`~.PlainMzMLWriter.merge_spectrum_shards`, renumbering the
+spectra and recording their offsets in the index as it goes, so that encoding the
+spectra, the expensive part, happens in parallel.
+"""
+import copy
+import re
+
+try:
+    from collections import Mapping
+except ImportError:
+    from collections.abc import Mapping
+
+from six import string_types as basestring
+
+from psims.xml import element
+
+from .index import IndexingStream
+from .writer import PlainMzMLWriter
+
+
+SHARD_KINDS = ("spectrum", "chromatogram")
+
+_INDEX_ATTR = re.compile(br' index="\d+"')
+_COPY_SIZE = 2 ** 20
+
+
+class MzMLShard(object):
+    """Describes a shard written by :class:`MzMLShardWriter`, to be merged into a document.
+
+    This object is small and picklable, to be returned from a worker process.
+
+    Attributes
+    ----------
+    path : str
+        The path to the shard file
+    kind : str
+        Either ``"spectrum"`` or ``"chromatogram"``
+    ids : list
+        The ids of the elements in the shard, in order
+    offsets : list
+        The byte offset of each element in the shard file
+    start : int
+        The byte offset the content to merge starts at
+    end : int
+        The byte offset the content to merge ends at
+    summary : :class:`~.SummaryChromatogramBuilder`
+        The summary of the spectra in the shard, if it was written with
+        ``summary_chromatograms=True``
+    """
+
+    def __init__(self, path, kind, ids, offsets, start, end, summary=None):
+        self.path = path
+        self.kind = kind
+        self.ids = ids
+        self.offsets = offsets
+        self.start = start
+        self.end = end
+        self.summary = summary
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        template = "{self.__class__.__name__}({self.path!r}, {self.kind!r}, {n} elements)"
+        return template.format(self=self, n=len(self))
+
+    def copy_to(self, write, index, record=None):
+        """Copy the content of this shard, renumbering its elements from ``index``.
+
+        Parameters
+        ----------
+        write : Callable
+            Writes bytes to the destination
+        index : int
+            The index of the first element of this shard in the destination
+        record : Callable, optional
+            Called with the start tag of each element just before it is written
+
+        Returns
+        -------
+        int
+            The index following the last element of this shard
+        """
+        with open(self.path, 'rb') as fh:
+            fh.seek(self.start)
+            position = self.start
+            for offset in self.offsets:
+                _copy(fh, write, offset - position)
+                tag = _read_start_tag(fh)
+                tag = _INDEX_ATTR.sub((' index="%d"' % index).encode('ascii'), tag, 1)
+                if record is not None:
+                    record(tag)
+                write(tag)
+                position = fh.tell()
+                index += 1
+            _copy(fh, write, self.end - position)
+        return index
+
+
+def _copy(fh, write, size):
+    while size > 0:
+        chunk = fh.read(min(size, _COPY_SIZE))
+        if not chunk:
+            raise ValueError("Shard %r ended early" % (fh.name, ))
+        write(chunk)
+        size -= len(chunk)
+
+
+def _read_start_tag(fh):
+    start = fh.tell()
+    buffer = b''
+    while True:
+        chunk = fh.read(1024)
+        if not chunk:
+            raise ValueError("Unterminated start tag in shard %r at %d" % (fh.name, start))
+        i = chunk.find(b'>')
+        if i != -1:
+            buffer += chunk[:i + 1]
+            fh.seek(start + len(buffer))
+            return buffer
+        buffer += chunk
+
+
+class MzMLShardWriter(PlainMzMLWriter):
+    """Writes a slice of the spectra, or of the chromatograms, of an mzML document
+    to a shard, to be merged into the document by its writer.
+
+    The elements are serialized exactly as they would be in the document, and
+    their offsets are recorded, so merging is a copy which only renumbers the
+    ``index`` attribute of each element. The shard writer only needs the ids the
+    elements refer to, as returned by :meth:`~.PlainMzMLWriter.shard_references`.
+
+    .. code-block:: python
+
+        def write_slice(path, references, scans):
+            with MzMLShardWriter(path, references=references) as shard:
+                for scan in scans:
+                    shard.write_spectrum(**scan)
+            return shard.shard
+
+        with MzMLWriter(open("out.mzML", 'wb'), close=True) as writer:
+            ...  # write everything up to the run
+            references = writer.shard_references()
+            shards = pool.starmap(write_slice, [(path, references, scans) for path, scans in slices])
+            with writer.run(id="run"):
+                with writer.spectrum_list(count=sum(map(len, shards))):
+                    writer.merge_spectrum_shards(shards)
+
+    Attributes
+    ----------
+    kind : str
+        Either ``"spectrum"`` or ``"chromatogram"``
+    path : str
+        The path the shard is written to
+    shard : :class:`MzMLShard`
+        The description of the finished shard, once writing has ended
+    """
+
+    def __init__(self, outfile, kind="spectrum", references=None, close=None, vocabularies=None,
+                 vocabulary_resolver=None, **kwargs):
+        if kind not in SHARD_KINDS:
+            raise ValueError("Unknown shard kind %r, expected one of %r" % (kind, SHARD_KINDS))
+        if isinstance(outfile, basestring):
+            path = outfile
+        else:
+            try:
+                path = outfile.name
+            except AttributeError:
+                raise ValueError("A shard must be written to a file which can be reopened by name")
+        outfile = IndexingStream(outfile)
+        super(MzMLShardWriter, self).__init__(
+            outfile, close, vocabularies=vocabularies, vocabulary_resolver=vocabulary_resolver, **kwargs)
+        self.index_builder = outfile
+        self.kind = kind
+        self.path = path
+        self.shard = None
+        self._start = None
+        for type_name, ids in (references or {}).items():
+            if isinstance(ids, Mapping):
+                cache = self.context[type_name]
+                for key, value in ids.items():
+                    cache[key] = value
+            else:
+                # a cache which cannot list its ids, tracked the same way here
+                self.context.set_tracking_policy(type_name, ids.policy)
+                cache = copy.deepcopy(ids)
+                cache.missing_reference_is_error = self.context.missing_reference_is_error
+                cache.unresolved = None
+                self.context._configure_cache(cache)
+                self.context[type_name] = cache
+        self.state_machine.current_state = "%s_list" % (kind, )
+
+    def toplevel_tag(self):
+        return element(self.writer, "%sList" % (self.kind, ))
+
+    def begin(self):
+        if self._has_begun():
+            return
+        self.writer = self.xmlfile.__enter__()
+        self.toplevel = self.toplevel_tag()
+        self.toplevel.__enter__()
+        # elements are indented as they are inside <indexedmzML><mzML><run><spectrumList>
+        self.writer.indent_level = 4
+        self.writer.flush()
+        self._start = self.index_builder.accumulator
+
+    def end(self, exc_type=None, exc_value=None, traceback=None):
+        self.writer.flush()
+        end = self.index_builder.accumulator
+        super(MzMLShardWriter, self).end(exc_type, exc_value, traceback)
+        indexer = self.index_builder.indices.get_indexer(self.kind)
+        ids = [key.decode('utf8') for key in indexer.index.keys()]
+        offsets = [int(offset) for offset in indexer.index.values()]
+        self.shard = MzMLShard(
+            self.path, self.kind, ids, offsets, self._start, end, self.summary_chromatograms)
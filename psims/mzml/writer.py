@@ -1,7 +1,7 @@
 import numbers
 import warnings
 
-from collections import defaultdict
+from collections import defaultdict, Counter, OrderedDict
 
 try:
     from collections import Mapping
@@ -10,8 +10,9 @@ except ImportError:
 
 import numpy as np
 
-from psims.xml import XMLWriterMixin, XMLDocumentWriter
+from psims.xml import XMLWriterMixin, XMLDocumentWriter, ParamGroupReference
 from psims.utils import TableStateMachine
+from psims.document import SpecializedContextCache
 
 from .components import (
     ComponentDispatcher, element,
@@ -23,7 +24,7 @@ from .binary_encoding import (
 
 from .utils import ensure_iterable
 
-from .index import IndexingStream
+from .index import IndexingStream, _patch_in_place
 
 
 MZ_ARRAY = 'm/z array'
@@ -72,55 +73,143 @@ class DocumentSection(ComponentDispatcher, XMLWriterMixin):
         self.writer.flush()
 
 
-class SpectrumListSection(DocumentSection):
-    def __init__(self, writer, parent_context, section_args=None, **kwargs):
-        super(SpectrumListSection, self).__init__(
-            "spectrumList", writer, parent_context, section_args=section_args,
+class DeferredCount(object):
+    """Writes a fixed-width placeholder for the ``count`` of a list section whose
+    length is not known in advance, and patches in the real count when the section
+    closes.
+
+    The count is written as is, followed by as many spaces as it is shorter than
+    the placeholder, which fall outside the attribute's quotes.
+
+    Streams which support :meth:`~.HashingStream.hold`, like the ones an
+    :class:`IndexedMzMLWriter` writes to, are held from the start of the section so
+    that the document checksum covers the patched count. Any other stream must be
+    seekable and readable, so that the placeholder can be found again.
+
+    Attributes
+    ----------
+    document : :class:`PlainMzMLWriter`
+        The writer the section belongs to
+    counter : Callable
+        Returns the number of elements written so far
+    width : int
+        The number of digits the placeholder holds room for
+    """
+
+    width = 10
+
+    def __init__(self, document, counter):
+        self.document = document
+        self.counter = counter
+        self.initial = None
+        self.position = None
+
+    @property
+    def placeholder(self):
+        return "0" * self.width
+
+    @property
+    def stream(self):
+        return self.document.outfile
+
+    def _is_held(self):
+        return hasattr(self.stream, 'hold')
+
+    def begin(self):
+        self.document.writer.flush()
+        if self._is_held():
+            self.stream.hold()
+        else:
+            stream = self.stream
+            try:
+                # some streams, like gzip.GzipFile, only seek forwards while writing,
+                # and others can't be read back
+                stream.flush()
+                position = stream.tell()
+                stream.seek(max(position - 1, 0))
+                stream.read(1)
+                stream.seek(position)
+            except (AttributeError, IOError, OSError, ValueError):
+                raise ValueError(
+                    "The count of a list can only be deferred when writing to a seekable,"
+                    " readable stream")
+            self.position = position
+        self.initial = self.counter()
+
+    def finish(self):
+        count = self.counter() - self.initial
+        old = ('count="%s"' % self.placeholder).encode('ascii')
+        new = ('count="%d"' % count).encode('ascii')
+        if len(new) > len(old):
+            raise ValueError("A count of %d does not fit in its placeholder" % (count, ))
+        new = new.ljust(len(old))
+        if self._is_held():
+            self.stream.patch(old, new)
+            self.stream.release()
+        else:
+            _patch_in_place(self.stream, self.position, old, new)
+
+
+class _ListSection(DocumentSection):
+    def __init__(self, section, writer, parent_context, section_args=None, deferred_count=None,
+                 on_enter=None, **kwargs):
+        super(_ListSection, self).__init__(
+            section, writer, parent_context, section_args=section_args,
             **kwargs)
+        self.deferred_count = deferred_count
+        self.on_enter = on_enter
         self.section_args.setdefault("count", 0)
         data_processing_method = self.section_args.pop(
             "data_processing_method", None)
+        data_processing = self.context["DataProcessing"]
         try:
-            self.section_args["defaultDataProcessingRef"] = self.context[
-                "DataProcessing"][data_processing_method]
+            self.section_args["defaultDataProcessingRef"] = data_processing[data_processing_method]
         except KeyError:
-            try:
-                self.section_args["defaultDataProcessingRef"] = list(
-                    self.context["DataProcessing"].values())[0]
-            except IndexError:
+            if data_processing.first is not None:
+                self.section_args["defaultDataProcessingRef"] = data_processing[data_processing.first]
+            else:
                 warnings.warn(
                     "No Data Processing method found. mzML file may not be fully standard-compliant",
-                    stacklevel=2)
+                    stacklevel=3)
+        if deferred_count is not None:
+            self.section_args["count"] = deferred_count.placeholder
+
+    def __enter__(self):
+        if self.deferred_count is not None:
+            self.deferred_count.begin()
+        super(_ListSection, self).__enter__()
+        if self.on_enter is not None:
+            self.on_enter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super(_ListSection, self).__exit__(exc_type, exc_value, traceback)
+        if self.deferred_count is not None:
+            self.deferred_count.finish()
+
+
+class SpectrumListSection(_ListSection):
+    def __init__(self, writer, parent_context, section_args=None, **kwargs):
+        super(SpectrumListSection, self).__init__(
+            "spectrumList", writer, parent_context, section_args=section_args,
+            **kwargs)
 
 
-class ChromatogramListSection(DocumentSection):
+class ChromatogramListSection(_ListSection):
     def __init__(self, writer, parent_context, section_args=None, **kwargs):
         super(ChromatogramListSection, self).__init__(
             "chromatogramList", writer, parent_context,
             section_args=section_args, **kwargs)
-        self.section_args.setdefault("count", 0)
-        data_processing_method = self.section_args.pop(
-            "data_processing_method", None)
-        try:
-            self.section_args["defaultDataProcessingRef"] = self.context[
-                "DataProcessing"][data_processing_method]
-        except KeyError:
-            try:
-                self.section_args["defaultDataProcessingRef"] = list(
-                    self.context["DataProcessing"].values())[0]
-            except IndexError:
-                warnings.warn(
-                    "No Data Processing method found. mzML file may not be fully standard-compliant",
-                    stacklevel=2)
 
 
 class RunSection(DocumentSection):
     """Describes a `<run>` tag. Implemented as a section to provide a more
     expressive API
     """
-    def __init__(self, writer, parent_context, section_args=None, **kwargs):
+    def __init__(self, writer, parent_context, section_args=None, on_exit=None, **kwargs):
         super(RunSection, self).__init__(
             "run", writer, parent_context, section_args=section_args, **kwargs)
+        self.on_exit = on_exit
         instrument_configuration_name = self.section_args.pop(
             "instrument_configuration", None)
         if instrument_configuration_name is not None:
@@ -134,6 +223,11 @@ class RunSection(DocumentSection):
         if sample_id is not None:
             self.section_args["sampleRef"] = self.context['Sample'][sample_id]
 
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.on_exit is not None and exc_type is None:
+            self.on_exit()
+        super(RunSection, self).__exit__(exc_type, exc_value, traceback)
+
 
 class IndexedmzMLSection(DocumentSection):
     def __init__(self, writer, parent_context, indexer, section_args=None, **kwargs):
@@ -160,6 +254,419 @@ class IndexedmzMLSection(DocumentSection):
         self.indexer.to_xml(self)
 
 
+def _param_key(param):
+    # Two resolved params are interchangeable if they would write the same tag
+    return (param.tag_name, tuple(sorted((k, str(v)) for k, v in param.attrs.items())))
+
+
+class ParamGroupDeduplicator(object):
+    """Replaces the params of a component which make up a whole
+    ``<referenceableParamGroup>`` with a reference to that group.
+
+    Groups are tried largest first, and each param is only ever replaced
+    by one group.
+
+    Attributes
+    ----------
+    context : :class:`~.DocumentContext`
+        The document context params are resolved through
+    groups : list
+        Pairs of a :class:`~.ParamGroupReference` and the set of keys of
+        the params it stands for
+    """
+
+    def __init__(self, context, groups):
+        self.context = context
+        self.groups = []
+        for group in groups:
+            keys = frozenset(_param_key(param) for param in group.resolve_params())
+            if keys:
+                self.groups.append((context.param_group_reference(group.id), keys))
+        self.groups.sort(key=lambda pair: len(pair[1]), reverse=True)
+
+    def __call__(self, component):
+        """Rewrite the params of ``component`` in place.
+
+        Parameters
+        ----------
+        component : :class:`~.ComponentBase`
+
+        Returns
+        -------
+        bool
+            Whether any params were replaced
+        """
+        params = component.resolve_params()
+        present = set(_param_key(param) for param in params if not isinstance(param, ParamGroupReference))
+        references = []
+        replaced = set()
+        for reference, keys in self.groups:
+            if keys <= present and replaced.isdisjoint(keys):
+                references.append(reference)
+                replaced.update(keys)
+        if not references:
+            return False
+        component.params = references + [
+            param for param in params
+            if isinstance(param, ParamGroupReference) or _param_key(param) not in replaced]
+        return True
+
+    @staticmethod
+    def infer_groups(context, param_sets, min_fraction=0.9, min_size=2, prefix="CommonParams"):
+        """Find the params that are repeated across a sample of spectra.
+
+        Spectra are divided by their MS level, and each division yields one
+        group of the params which occur, with the same value, in at least
+        ``min_fraction`` of its spectra.
+
+        Parameters
+        ----------
+        context : :class:`~.DocumentContext`
+        param_sets : iterable of list
+            The params of each sampled spectrum
+        min_fraction : float
+            The fraction of the spectra of an MS level a param must occur in
+        min_size : int
+            The fewest params worth making a group of
+        prefix : str
+            The prefix of each group's id, followed by its MS level
+
+        Returns
+        -------
+        list of dict
+            Groups suitable for :meth:`PlainMzMLWriter.reference_param_group_list`
+        """
+        ms_level = context.term("ms level").id
+        divisions = OrderedDict()
+        for params in param_sets:
+            params = [context.param(param) for param in ensure_iterable(params)]
+            level = None
+            for param in params:
+                if getattr(param, 'accession', None) == ms_level:
+                    level = str(param.value)
+            divisions.setdefault(level, []).append(params)
+        groups = []
+        for level, spectra in divisions.items():
+            counts = Counter()
+            examples = OrderedDict()
+            for params in spectra:
+                keys = OrderedDict()
+                for param in params:
+                    if isinstance(param, ParamGroupReference):
+                        continue
+                    key = _param_key(param)
+                    keys[key] = param
+                    examples.setdefault(key, param)
+                counts.update(list(keys))
+            threshold = min_fraction * len(spectra)
+            members = [param for key, param in examples.items() if counts[key] >= threshold]
+            if len(members) >= min_size:
+                name = prefix if level is None else "%s_MS%s" % (prefix, level)
+                groups.append({"id": name, "params": members})
+        return groups
+
+
+def _scan_time_in_minutes(scan_start_time):
+    if isinstance(scan_start_time, numbers.Number):
+        return float(scan_start_time)
+    if isinstance(scan_start_time, Mapping):
+        unit = scan_start_time.get(
+            "unitName", scan_start_time.get("unit_name", DEFAULT_TIME_UNIT))
+        scale = {"minute": 1.0, "second": 1.0 / 60.0}.get(unit)
+        if scale is not None and scan_start_time.get("value") is not None:
+            return float(scan_start_time["value"]) * scale
+    return None
+
+
+class SummaryChromatogramBuilder(object):
+    """Accumulates the total ion current and base peak intensity of each spectrum
+    as it is written, by MS level, so that the TIC and BPC chromatograms can be
+    written without another pass over the spectra.
+
+    Spectra without an MS level or a scan start time in minutes or seconds are not
+    included.
+
+    Attributes
+    ----------
+    levels : :class:`~collections.OrderedDict`
+        Maps MS level to a tuple of lists of scan times, total ion currents and
+        base peak intensities
+    """
+
+    def __init__(self):
+        self.levels = OrderedDict()
+
+    def __len__(self):
+        return len(self.levels)
+
+    def add(self, ms_level, scan_start_time, intensity_array):
+        """Record the summary of one spectrum.
+
+        Parameters
+        ----------
+        ms_level : int
+        scan_start_time : float or dict
+            The scan start time, in minutes if a number
+        intensity_array : Iterable
+        """
+        time = _scan_time_in_minutes(scan_start_time)
+        if ms_level is None or time is None:
+            return
+        intensity_array = np.asarray(intensity_array)
+        if intensity_array.size:
+            total = float(intensity_array.sum())
+            base_peak = float(intensity_array.max())
+        else:
+            total = base_peak = 0.0
+        try:
+            times, totals, base_peaks = self.levels[ms_level]
+        except KeyError:
+            times, totals, base_peaks = self.levels[ms_level] = ([], [], [])
+        times.append(time)
+        totals.append(total)
+        base_peaks.append(base_peak)
+
+    def update(self, other):
+        """Add the spectra recorded by another builder, as when merging shards.
+
+        Parameters
+        ----------
+        other : :class:`SummaryChromatogramBuilder`
+        """
+        for ms_level, series in other.levels.items():
+            try:
+                mine = self.levels[ms_level]
+            except KeyError:
+                mine = self.levels[ms_level] = ([], [], [])
+            for acc, values in zip(mine, series):
+                acc.extend(values)
+
+    def clear(self):
+        self.levels.clear()
+
+    def chromatograms(self):
+        """Build the arguments to :meth:`PlainMzMLWriter.write_chromatogram` for
+        the TIC and BPC of each MS level, in ascending order of MS level.
+
+        The chromatograms of MS1 spectra are identified as ``TIC`` and ``BPC``,
+        and those of other MS levels are suffixed with their level, e.g. ``TIC MS2``.
+
+        Returns
+        -------
+        list of dict
+        """
+        result = []
+        for ms_level in sorted(self.levels):
+            times, totals, base_peaks = map(np.array, self.levels[ms_level])
+            order = np.argsort(times, kind='mergesort')
+            suffix = "" if ms_level == 1 else " MS%d" % (ms_level, )
+            result.append(dict(
+                time_array=times[order], intensity_array=totals[order], id="TIC" + suffix,
+                chromatogram_type="total ion current chromatogram"))
+            result.append(dict(
+                time_array=times[order], intensity_array=base_peaks[order], id="BPC" + suffix,
+                chromatogram_type="basepeak chromatogram"))
+        return result
+
+
+def _polarity_param(polarity):
+    if polarity is None:
+        return None
+    if isinstance(polarity, int):
+        if polarity > 0:
+            return 'positive scan'
+        elif polarity < 0:
+            return 'negative scan'
+        return None
+    elif 'positive' in polarity:
+        return 'positive scan'
+    elif 'negative' in polarity:
+        return 'negative scan'
+    return None
+
+
+class SpectrumTemplate(object):
+    """Captures the parts of a spectrum which are shared by many spectra in a run,
+    so that they are only prepared once.
+
+    The polarity, peak mode, invariant spectrum and scan params are resolved when the
+    template is created, as are the params describing each kind of binary data array,
+    leaving only the arrays, scan time, precursor and any per-spectrum params to be
+    prepared for each spectrum.
+
+    Created with :meth:`PlainMzMLWriter.spectrum_template`.
+
+    Attributes
+    ----------
+    writer : :class:`PlainMzMLWriter`
+        The writer the spectra are written with
+    params : list
+        The resolved params shared by every spectrum
+    scan_params : list
+        The resolved params shared by every spectrum's scan
+    scan_window_list : :class:`~.ScanWindowList`
+        The scan windows shared by every spectrum's scan
+    """
+
+    def __init__(self, writer, polarity='positive scan', centroided=True, params=None,
+                 compression=COMPRESSION_ZLIB, encoding=None, scan_params=None, scan_window_list=None,
+                 instrument_configuration_id=None, intensity_unit=DEFAULT_INTENSITY_UNIT):
+        if params is None:
+            params = []
+        else:
+            params = list(params)
+        if scan_params is None:
+            scan_params = []
+        if scan_window_list is None:
+            scan_window_list = []
+        if isinstance(encoding, Mapping):
+            encoding = defaultdict(lambda: np.float32, encoding)
+        else:
+            # create new variable to capture in closure
+            _encoding = encoding
+            encoding = defaultdict(lambda: _encoding)
+
+        polarity = _polarity_param(polarity)
+        if polarity not in params and polarity is not None:
+            params.append(polarity)
+        if centroided:
+            peak_mode = "centroid spectrum"
+        else:
+            peak_mode = 'profile spectrum'
+        params.append(peak_mode)
+
+        self.writer = writer
+        self.compression = compression
+        self.encoding = encoding
+        self.intensity_unit = intensity_unit
+        self.instrument_configuration_id = instrument_configuration_id
+        self.params = self._prepare_params(params)
+        self.scan_params = self._prepare_params(scan_params)
+        self.scan_window_list = writer.ScanWindowList(list(scan_window_list))
+        self.scan_list_params = self._prepare_params(["no combination"])
+        self._array_params = {}
+
+    def _prepare_params(self, params):
+        prepared = []
+        for param in ensure_iterable(params):
+            resolved = self.writer.param(param)
+            # params built here are never seen by the caller, so they can be
+            # serialized once, unlike those the caller passed in already built
+            if resolved is not param and not isinstance(resolved, ParamGroupReference):
+                resolved.freeze()
+            prepared.append(resolved)
+        return prepared
+
+    def _prepare_array(self, array, array_type, encoding_key, default_array_length=None):
+        try:
+            encoding, params = self._array_params[encoding_key]
+        except KeyError:
+            writer = self.writer
+            encoding = self.encoding[encoding_key]
+            params = self._prepare_params(writer._array_params(
+                array_type, self.compression, writer._encoding_dtype(encoding)))
+            self._array_params[encoding_key] = encoding, params
+        return self.writer._prepare_array(
+            array, encoding=encoding, compression=self.compression, array_type=array_type,
+            default_array_length=default_array_length, params=params)
+
+    def spectrum(self, mz_array=None, intensity_array=None, charge_array=None, id=None,
+                 scan_start_time=None, precursor_information=None, params=None, scan_params=None,
+                 other_arrays=None):
+        """Build a spectrum from this template.
+
+        Parameters
+        ----------
+        mz_array : Iterable, optional
+        intensity_array : Iterable, optional
+        charge_array : Iterable, optional
+        id : str, optional
+        scan_start_time : float or dict, optional
+            The scan start time, in :attr:`PlainMzMLWriter.DEFAULT_TIME_UNIT` if a number
+        precursor_information : dict or list, optional
+        params : list, optional
+            Params specific to this spectrum, written after the template's params
+        scan_params : list, optional
+            Params specific to this spectrum's scan, written after the template's scan params
+        other_arrays : list, optional
+            ``(array_type, array)`` pairs of additional arrays
+
+        Returns
+        -------
+        :class:`~.Spectrum`
+        """
+        writer = self.writer
+        if not writer.trusted:
+            writer.state_machine.expects_state("spectrum_list")
+        array_list = []
+        default_array_length = len(mz_array) if mz_array is not None else 0
+        if mz_array is not None:
+            array_list.append(self._prepare_array(mz_array, MZ_ARRAY, MZ_ARRAY))
+        if intensity_array is not None:
+            array_list.append(self._prepare_array(
+                intensity_array, {"name": INTENSITY_ARRAY, "unit_name": self.intensity_unit},
+                INTENSITY_ARRAY))
+        if charge_array is not None:
+            array_list.append(self._prepare_array(charge_array, CHARGE_ARRAY, CHARGE_ARRAY))
+        for array_type, array in (other_arrays or ()):
+            if array_type is None:
+                raise ValueError("array type can't be None")
+            array_list.append(writer._prepare_array(
+                array, encoding=self.encoding[array_type], compression=self.compression,
+                array_type=array_type, default_array_length=default_array_length))
+        array_list_tag = writer.BinaryDataArrayList(array_list)
+
+        if precursor_information is not None:
+            precursor_list = writer._prepare_precursor_list(
+                precursor_information, intensity_unit=self.intensity_unit)
+        else:
+            precursor_list = None
+
+        scan_params_ = list(self.scan_params)
+        if scan_params:
+            scan_params_.extend(scan_params)
+        if scan_start_time is not None:
+            if isinstance(scan_start_time, numbers.Number):
+                scan_params_.append({"name": "scan start time",
+                                     "value": scan_start_time,
+                                     "unitName": DEFAULT_TIME_UNIT})
+            else:
+                scan_params_.append(scan_start_time)
+        scan = writer.Scan(scan_window_list=self.scan_window_list, params=scan_params_,
+                           instrument_configuration_ref=self.instrument_configuration_id)
+        scan_list = writer.ScanList([scan], params=list(self.scan_list_params))
+
+        spectrum_params = list(self.params)
+        if params:
+            spectrum_params.extend(params)
+        index = writer.spectrum_count
+        writer.spectrum_count += 1
+        spectrum = writer.Spectrum(
+            index, array_list_tag, scan_list=scan_list, params=spectrum_params, id=id,
+            default_array_length=default_array_length,
+            precursor_list=precursor_list)
+        if writer.param_group_deduplicator is not None:
+            writer.param_group_deduplicator(spectrum)
+            writer.param_group_deduplicator(scan)
+        if writer.summary_chromatograms is not None and intensity_array is not None:
+            writer.summary_chromatograms.add(
+                spectrum.find_ms_level(), scan_start_time, intensity_array)
+        return spectrum
+
+    def write(self, mz_array=None, intensity_array=None, charge_array=None, id=None,
+              scan_start_time=None, precursor_information=None, params=None, scan_params=None,
+              other_arrays=None):
+        """Build a spectrum from this template, and write it out.
+
+        Takes the same arguments as :meth:`spectrum`.
+        """
+        spectrum = self.spectrum(
+            mz_array=mz_array, intensity_array=intensity_array, charge_array=charge_array,
+            id=id, scan_start_time=scan_start_time, precursor_information=precursor_information,
+            params=params, scan_params=scan_params, other_arrays=other_arrays)
+        spectrum.write(self.writer.writer)
+
+
 class PlainMzMLWriter(ComponentDispatcher, XMLDocumentWriter):
     """A high level API for generating mzML XML files from simple Python objects.
 
@@ -179,13 +686,27 @@ class PlainMzMLWriter(ComponentDispatcher, XMLDocumentWriter):
         A count of the number of chromatograms written
     spectrum_count : int
         A count of the number of spectra written
+    trusted : bool
+        Whether the content written is trusted to be valid. In trusted mode,
+        spectra and chromatograms skip state and unit validation, spectra must
+        carry both their ms level and spectrum type params as they are not
+        filled in, and references to unregistered ids are reported once when
+        the document ends instead of as they are made. Components are still
+        constructed and written as usual, so this makes building spectra
+        cheaper rather than writing them.
+    summary_chromatograms : :class:`SummaryChromatogramBuilder`
+        When enabled, accumulates the TIC and BPC of each MS level from the
+        spectra as they are written. They are written first thing when the
+        chromatogram list is opened, or in a chromatogram list of their own
+        when the run closes if none was opened. :const:`None` otherwise.
     """
 
     DEFAULT_TIME_UNIT = DEFAULT_TIME_UNIT
     DEFAULT_INTENSITY_UNIT = DEFAULT_INTENSITY_UNIT
 
     def __init__(self, outfile, close=False, vocabularies=None, missing_reference_is_error=False,
-                 vocabulary_resolver=None, id=None, accession=None, **kwargs):
+                 vocabulary_resolver=None, id=None, accession=None, tracking_policies=None,
+                 trusted=False, summary_chromatograms=False, **kwargs):
         if vocabularies is None:
             vocabularies = []
         vocabularies = list(default_cv_list) + list(vocabularies)
@@ -193,13 +714,17 @@ class PlainMzMLWriter(ComponentDispatcher, XMLDocumentWriter):
             self,
             vocabularies=vocabularies,
             vocabulary_resolver=vocabulary_resolver,
-            missing_reference_is_error=missing_reference_is_error)
+            missing_reference_is_error=missing_reference_is_error,
+            tracking_policies=tracking_policies,
+            trusted=trusted)
         XMLDocumentWriter.__init__(self, outfile, close, **kwargs)
         self.id = id
         self.accession = accession
         self.spectrum_count = 0
         self.chromatogram_count = 0
         self.default_instrument_configuration = None
+        self.param_group_deduplicator = None
+        self.summary_chromatograms = SummaryChromatogramBuilder() if summary_chromatograms else None
         self.state_machine = TableStateMachine([
             ("start", ['controlled_vocabularies', ]),
             ("controlled_vocabularies", ['file_description', ]),
@@ -218,6 +743,11 @@ class PlainMzMLWriter(ComponentDispatcher, XMLDocumentWriter):
     def toplevel_tag(self):
         return MzML(id=self.id, accession=self.accession)
 
+    def end(self, exc_type=None, exc_value=None, traceback=None):
+        super(PlainMzMLWriter, self).end(exc_type, exc_value, traceback)
+        if self.trusted and exc_type is None:
+            self.check_integrity()
+
     def controlled_vocabularies(self):
         """Write out the `<cvList>` element and all its children,
         including both this format's default controlled vocabularies
@@ -308,7 +838,7 @@ class PlainMzMLWriter(ComponentDispatcher, XMLDocumentWriter):
             self.DataProcessing.ensure(dp) for dp in ensure_iterable(data_processing)]
         self.DataProcessingList(methods).write(self)
 
-    def reference_param_group_list(self, groups):
+    def reference_param_group_list(self, groups, deduplicate=False):
         """Writes the ``<referenceableParamGroupList>`` section of the document.
 
         Parameters
@@ -316,12 +846,39 @@ class PlainMzMLWriter(ComponentDispatcher, XMLDocumentWriter):
         groups : list
             A list or other iterable of :class:`dict` or :class:`~.ReferenceableParamGroup`-like
             objects
+        deduplicate : bool
+            If :const:`True`, wherever a spectrum or its scan has every param of one of
+            these groups, those params are replaced by a reference to the group.
+            See :class:`ParamGroupDeduplicator`.
 
         """
         self.state_machine.transition("reference_param_group_list")
         groups = [
             self.ReferenceableParamGroup.ensure(g) for g in ensure_iterable(groups)]
         self.ReferenceableParamGroupList(groups).write(self)
+        if deduplicate:
+            self.param_group_deduplicator = ParamGroupDeduplicator(self.context, groups)
+
+    def infer_param_groups(self, param_sets, min_fraction=0.9, min_size=2):
+        """Find groups of params repeated across a sample of spectra, for
+        :meth:`reference_param_group_list` to write and deduplicate.
+
+        Parameters
+        ----------
+        param_sets : iterable of list
+            The params of each sampled spectrum, including any which :meth:`spectrum`
+            would add itself, like polarity and peak representation
+        min_fraction : float
+            The fraction of the spectra of an MS level a param must occur in to be grouped
+        min_size : int
+            The fewest params worth making a group of
+
+        Returns
+        -------
+        list of dict
+        """
+        return ParamGroupDeduplicator.infer_groups(
+            self.context, param_sets, min_fraction=min_fraction, min_size=min_size)
 
     def sample_list(self, samples):
         """Writes the ``<sampleList>`` section of the document
@@ -385,54 +942,167 @@ class PlainMzMLWriter(ComponentDispatcher, XMLDocumentWriter):
         if start_time is not None:
             kwargs['startTimeStamp'] = start_time
         if instrument_configuration is None:
-            keys = list(self.context['InstrumentConfiguration'].keys())
-            if keys:
-                instrument_configuration = keys[0]
-            else:
-                instrument_configuration = None
+            instrument_configuration = self.context['InstrumentConfiguration'].first
         self.default_instrument_configuration = instrument_configuration
         return RunSection(
             self.writer, self.context, id=id,
             instrument_configuration=instrument_configuration,
             source_file=source_file,
-            sample=sample, **kwargs)
+            sample=sample, on_exit=self._close_run, **kwargs)
 
-    def spectrum_list(self, count, data_processing_method=None):
+    def _close_run(self):
+        if self.summary_chromatograms:
+            with self.chromatogram_list(count=0):
+                pass
+
+    def _write_summary_chromatograms(self):
+        if self.summary_chromatograms is None:
+            return
+        for chromatogram in self.summary_chromatograms.chromatograms():
+            self.write_chromatogram(**chromatogram)
+        self.summary_chromatograms.clear()
+
+    def spectrum_list(self, count=None, data_processing_method=None):
+        """Start the spectrum list.
+
+        Parameters
+        ----------
+        count : int, optional
+            The number of spectrums the list will contain. If :const:`None`, a
+            placeholder is written and replaced by the number of spectrums
+            actually written when the list is closed, see :class:`DeferredCount`.
+        data_processing_method : str, optional
+            The id of the default data processing method of the list
+
+        Returns
+        -------
+        :class:`SpectrumListSection`
+        """
         self.state_machine.transition('spectrum_list')
         if data_processing_method is None:
-            dp_map = self.context['DataProcessing']
-            try:
-                data_processing_method = list(dp_map.keys())[0]
-            except IndexError:
+            data_processing_method = self.context['DataProcessing'].first
+            if data_processing_method is None:
                 warnings.warn(
                     "No Data Processing method found. mzML file may not be fully standard-compliant",
                     stacklevel=2)
+        deferred_count = None
+        if count is None:
+            deferred_count = DeferredCount(self, lambda: self.spectrum_count)
         return SpectrumListSection(
             self.writer, self.context, count=count,
-            data_processing_method=data_processing_method)
+            data_processing_method=data_processing_method,
+            deferred_count=deferred_count)
+
+    def chromatogram_list(self, count=None, data_processing_method=None):
+        """Start the chromatogram list.
 
-    def chromatogram_list(self, count, data_processing_method=None):
+        Parameters
+        ----------
+        count : int, optional
+            The number of chromatograms the list will contain, not counting the
+            summary chromatograms, which are added to it. If :const:`None`, a
+            placeholder is written and replaced by the number of chromatograms
+            actually written when the list is closed, see :class:`DeferredCount`.
+        data_processing_method : str, optional
+            The id of the default data processing method of the list
+
+        Returns
+        -------
+        :class:`ChromatogramListSection`
+        """
         self.state_machine.transition('chromatogram_list')
         if data_processing_method is None:
-            dp_map = self.context['DataProcessing']
-            try:
-                data_processing_method = list(dp_map.keys())[0]
-            except IndexError:
+            data_processing_method = self.context['DataProcessing'].first
+            if data_processing_method is None:
                 warnings.warn(
                     "No Data Processing method found. mzML file may not be fully standard-compliant",
                     stacklevel=2)
+        deferred_count = None
+        if count is None:
+            deferred_count = DeferredCount(self, lambda: self.chromatogram_count)
+        elif self.summary_chromatograms:
+            count += 2 * len(self.summary_chromatograms)
         return ChromatogramListSection(
             self.writer, self.context, count=count,
-            data_processing_method=data_processing_method)
+            data_processing_method=data_processing_method,
+            deferred_count=deferred_count,
+            on_enter=self._write_summary_chromatograms)
+
+    def shard_references(self):
+        """Collect the ids registered so far, to pass to each :class:`~.MzMLShardWriter`
+        so that the elements they write can refer to them.
+
+        Types tracked under the ``"count"`` or ``"compact"`` policies cannot list
+        their ids, so their caches are passed on whole, and the shards track them
+        under the same policy.
+
+        Returns
+        -------
+        dict
+            Maps entity type name to a mapping of key to id, or to the
+            :class:`~.CountingContextCache` or :class:`~.CompactContextCache`
+            of the type
+        """
+        references = {}
+        for type_name, cache in self.context.items():
+            if not len(cache):
+                continue
+            if isinstance(cache, SpecializedContextCache):
+                references[type_name] = dict(cache)
+            else:
+                references[type_name] = cache
+        return references
+
+    def merge_spectrum_shards(self, shards):
+        """Copy the spectra of shards written by :class:`~.MzMLShardWriter` into
+        the spectrum list, in order, numbering them after any spectra written already.
+
+        Parameters
+        ----------
+        shards : Iterable of :class:`~.MzMLShard`
+        """
+        if not self.trusted:
+            self.state_machine.expects_state("spectrum_list")
+        self.spectrum_count = self._merge_shards(shards, "spectrum", self.spectrum_count)
+
+    def merge_chromatogram_shards(self, shards):
+        """Copy the chromatograms of shards written by :class:`~.MzMLShardWriter` into
+        the chromatogram list, in order, numbering them after any chromatograms written already.
+
+        Parameters
+        ----------
+        shards : Iterable of :class:`~.MzMLShard`
+        """
+        if not self.trusted:
+            self.state_machine.expects_state("chromatogram_list")
+        self.chromatogram_count = self._merge_shards(shards, "chromatogram", self.chromatogram_count)
+
+    def _shard_output(self, kind):
+        try:
+            write = self.outfile.write
+        except AttributeError:
+            raise ValueError("Shards can only be merged into a writable stream, not %r" % (self.outfile, ))
+        return write, None
+
+    def _merge_shards(self, shards, kind, index):
+        write, record = self._shard_output(kind)
+        # everything lxml has been handed must reach the stream before copying behind its back
+        self.writer.flush()
+        for shard in shards:
+            if shard.kind != kind:
+                raise ValueError("Cannot merge a %s shard into a %s list" % (shard.kind, kind))
+            index = shard.copy_to(write, index, record)
+            if self.summary_chromatograms is not None and shard.summary is not None:
+                self.summary_chromatograms.update(shard.summary)
+        return index
 
     def spectrum(self, mz_array=None, intensity_array=None, charge_array=None, id=None,
                  polarity='positive scan', centroided=True, precursor_information=None,
                  scan_start_time=None, params=None, compression=COMPRESSION_ZLIB,
                  encoding=None, other_arrays=None, scan_params=None, scan_window_list=None,
                  instrument_configuration_id=None, intensity_unit=DEFAULT_INTENSITY_UNIT):
-        self.state_machine.expects_state("spectrum_list")
-        if encoding is None:
-            {MZ_ARRAY: np.float64}
+        if not self.trusted:
+            self.state_machine.expects_state("spectrum_list")
         if params is None:
             params = []
         else:
@@ -454,23 +1124,9 @@ class PlainMzMLWriter(ComponentDispatcher, XMLDocumentWriter):
             # create new variable to capture in closure
             _encoding = encoding
             encoding = defaultdict(lambda: _encoding)
-        if polarity is not None:
-            if isinstance(polarity, int):
-                if polarity > 0:
-                    polarity = 'positive scan'
-                elif polarity < 0:
-                    polarity = 'negative scan'
-                else:
-                    polarity = None
-            elif 'positive' in polarity:
-                polarity = 'positive scan'
-            elif 'negative' in polarity:
-                polarity = 'negative scan'
-            else:
-                polarity = None
-
-            if polarity not in params and polarity is not None:
-                params.append(polarity)
+        polarity = _polarity_param(polarity)
+        if polarity not in params and polarity is not None:
+            params.append(polarity)
 
         if centroided:
             peak_mode = "centroid spectrum"
@@ -531,8 +1187,33 @@ class PlainMzMLWriter(ComponentDispatcher, XMLDocumentWriter):
             index, array_list_tag, scan_list=scan_list, params=params, id=id,
             default_array_length=default_array_length,
             precursor_list=precursor_list)
+        if self.param_group_deduplicator is not None:
+            self.param_group_deduplicator(spectrum)
+            self.param_group_deduplicator(scan)
+        if self.summary_chromatograms is not None and intensity_array is not None:
+            self.summary_chromatograms.add(
+                spectrum.find_ms_level(), scan_start_time, intensity_array)
         return spectrum
 
+    def spectrum_template(self, polarity='positive scan', centroided=True, params=None,
+                          compression=COMPRESSION_ZLIB, encoding=None, scan_params=None,
+                          scan_window_list=None, instrument_configuration_id=None,
+                          intensity_unit=DEFAULT_INTENSITY_UNIT):
+        """Prepare the parts shared by many spectra once, to write each of those
+        spectra with :meth:`SpectrumTemplate.write` faster than with :meth:`write_spectrum`.
+
+        Takes the same arguments as :meth:`spectrum`, except for those which differ
+        between spectra.
+
+        Returns
+        -------
+        :class:`SpectrumTemplate`
+        """
+        return SpectrumTemplate(
+            self, polarity=polarity, centroided=centroided, params=params, compression=compression,
+            encoding=encoding, scan_params=scan_params, scan_window_list=scan_window_list,
+            instrument_configuration_id=instrument_configuration_id, intensity_unit=intensity_unit)
+
     def write_spectrum(self, mz_array=None, intensity_array=None, charge_array=None, id=None,
                        polarity='positive scan', centroided=True, precursor_information=None,
                        scan_start_time=None, params=None, compression=COMPRESSION_ZLIB,
@@ -553,7 +1234,8 @@ class PlainMzMLWriter(ComponentDispatcher, XMLDocumentWriter):
                      precursor_information=None, params=None,
                      compression=COMPRESSION_ZLIB, encoding=32, other_arrays=None,
                      intensity_unit=DEFAULT_INTENSITY_UNIT, time_unit=DEFAULT_TIME_UNIT):
-        self.state_machine.expects_state("chromatogram_list")
+        if not self.trusted:
+            self.state_machine.expects_state("chromatogram_list")
         if params is None:
             params = []
         else:
@@ -617,21 +1299,13 @@ class PlainMzMLWriter(ComponentDispatcher, XMLDocumentWriter):
             other_arrays=other_arrays, intensity_unit=intensity_unit, time_unit=time_unit)
         chromatogram.write(self.writer)
 
-    def _prepare_array(self, array, encoding=32, compression=COMPRESSION_ZLIB,
-                       array_type=None, default_array_length=None):
+    @staticmethod
+    def _encoding_dtype(encoding):
         if isinstance(encoding, numbers.Number):
-            _encoding = int(encoding)
-        else:
-            _encoding = encoding
-        dtype = encoding_map[_encoding]
-        array = np.array(array, dtype=dtype)
-        encoded_binary = encode_array(
-            array, compression=compression, dtype=dtype)
-        binary = self.Binary(encoded_binary)
-        if default_array_length is not None and len(array) != default_array_length:
-            override_length = True
-        else:
-            override_length = False
+            encoding = int(encoding)
+        return encoding_map[encoding]
+
+    def _array_params(self, array_type, compression, dtype):
         params = []
         if array_type is not None:
             params.append(array_type)
@@ -643,6 +1317,21 @@ class PlainMzMLWriter(ComponentDispatcher, XMLDocumentWriter):
                 params.append(NON_STANDARD_ARRAY)
         params.append(compression_map[compression])
         params.append(dtype_to_encoding[dtype])
+        return params
+
+    def _prepare_array(self, array, encoding=32, compression=COMPRESSION_ZLIB,
+                       array_type=None, default_array_length=None, params=None):
+        dtype = self._encoding_dtype(encoding)
+        array = np.array(array, dtype=dtype)
+        encoded_binary = encode_array(
+            array, compression=compression, dtype=dtype)
+        binary = self.Binary(encoded_binary)
+        if default_array_length is not None and len(array) != default_array_length:
+            override_length = True
+        else:
+            override_length = False
+        if params is None:
+            params = self._array_params(array_type, compression, dtype)
         encoded_length = len(encoded_binary)
         return self.BinaryDataArray(
             binary, encoded_length,
@@ -700,6 +1389,16 @@ class IndexedMzMLWriter(PlainMzMLWriter):
             self.writer, self.context, id=self.id, accession=self.accession,
             indexer=self.index_builder)
 
+    def _shard_output(self, kind):
+        stream = self.index_builder
+        indexer = stream.indices.get_indexer(kind)
+
+        def record(tag):
+            indexer(tag, stream.accumulator)
+
+        # written past the stream's tokenizer, as the elements are indexed as they are copied
+        return stream._raw_write, record
+
     def format(self, *args, **kwargs):
         return
 
@@ -0,0 +1,8 @@
+import sys
+
+
+collect_ignore = []
+
+if sys.version_info < (3, 7):
+    # psims.aio uses syntax and asyncio APIs which require Python 3.7
+    collect_ignore.append("test_aio.py")
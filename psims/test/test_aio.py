@@ -0,0 +1,44 @@
+import asyncio
+
+from io import BytesIO
+
+import numpy as np
+
+from psims.mzml import MzMLWriter
+from psims.aio import AsyncMzMLWriter
+from psims.test.utils import mzml_header, write_mzml_header
+
+
+spectra = [
+    dict(mz_array=np.linspace(100, 1000, 50), intensity_array=np.arange(50.0) * (i + 1),
+         id='scanId=%d' % i, scan_start_time=i * 0.1, params=[{"name": "ms level", "value": 1}])
+    for i in range(10)
+]
+
+
+def test_async_mzml_writer():
+    buffer = BytesIO()
+    with MzMLWriter(buffer) as f:
+        write_mzml_header(f)
+        with f.run(id='test'):
+            with f.spectrum_list(count=len(spectra)):
+                for spectrum in spectra:
+                    f.write_spectrum(**spectrum)
+    expected = buffer.getvalue()
+
+    async def write():
+        buffer = BytesIO()
+        async with AsyncMzMLWriter(buffer, max_pending=2) as f:
+            for method, args, kwargs in mzml_header(f):
+                await method(*args, **kwargs)
+            async with f.run(id='test'):
+                async with f.spectrum_list(count=len(spectra)):
+                    await f.write_spectrum(**spectra[0])
+                    template = await f.spectrum_template(params=[{"name": "ms level", "value": 1}])
+                    for spectrum in spectra[1:]:
+                        await template.write(
+                            spectrum['mz_array'], spectrum['intensity_array'], id=spectrum['id'],
+                            scan_start_time=spectrum['scan_start_time'])
+        return buffer.getvalue()
+
+    assert asyncio.run(write()) == expected
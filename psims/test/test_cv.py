@@ -1,6 +1,17 @@
+import pytest
 import os
+import threading
+
+from io import BytesIO
+
+from six.moves import BaseHTTPServer
+
 from psims import load_psims
-from psims.controlled_vocabulary import OBOCache, ControlledVocabulary
+from psims.controlled_vocabulary import OBOCache, ControlledVocabulary, controlled_vocabulary, unimod
+from psims.controlled_vocabulary.controlled_vocabulary import (
+    _use_vendored_psims_obo, _use_vendored_unit_obo, _use_vendored_unimod_xml)
+from psims.controlled_vocabulary.search import TermSearchIndex, edit_distance
+from psims.xml import ProvidedCV
 
 import shutil
 import tempfile
@@ -49,3 +60,355 @@ def test_cache_resolve():
     new_cv = ControlledVocabulary.from_obo(new_cv_file)
     assert new_cv.version is not None
     assert new_cv['m/z array'] == cv['m/z array']
+
+
+def test_lazy_parse():
+    lazy_cv = ControlledVocabulary.from_obo(_use_vendored_psims_obo(), lazy=True)
+    eager_cv = ControlledVocabulary.from_obo(_use_vendored_psims_obo(), lazy=False)
+    assert lazy_cv.is_lazy()
+    assert not lazy_cv.terms.is_materialized("MS:1000514")
+    term = lazy_cv['m/z array']
+    assert lazy_cv.terms.is_materialized("MS:1000514")
+    assert term.vocabulary is lazy_cv
+    assert dict(term) == dict(eager_cv['m/z array'])
+    assert ([c.id for c in lazy_cv['MS:1000513'].children] ==
+            [c.id for c in eager_cv['MS:1000513'].children])
+    assert len(lazy_cv.terms.entities) < len(lazy_cv.terms)
+    default_cv = ControlledVocabulary.from_obo(_use_vendored_psims_obo())
+    assert not default_cv.is_lazy()
+    assert isinstance(default_cv['MS:1000513'].children, list)
+    assert cv.is_lazy()
+
+
+def test_parse_handles():
+    handle = _use_vendored_psims_obo()
+    stream_cv = ControlledVocabulary.from_obo(handle)
+    assert not handle.closed
+    handle.close()
+    lines_cv = ControlledVocabulary.from_obo(iter(_use_vendored_psims_obo().readlines()))
+    assert len(lines_cv.terms) == len(stream_cv.terms)
+    assert dict(lines_cv['m/z array']) == dict(stream_cv['m/z array'])
+
+
+def test_is_a_closure():
+    term = cv['m/z array']
+    assert term.is_of_type('MS:1000513')
+    assert term.is_of_type('binary data array')
+    assert term.is_of_type(term.id)
+    assert not term.is_of_type('MS:1000499')
+    assert not term.is_of_type('not a real term')
+    assert term.is_of_type(cv['binary data array'])
+    assert term.is_of_type(term)
+    assert not term.is_of_type(cv['MS:1000499'])
+    assert cv.is_of_type(term, cv['binary data array'])
+    assert cv.is_of_type('MS:1000528', 'spectrum attribute')
+    descendants = {t.id for t in cv.descendants('binary data array')}
+    assert 'MS:1000514' in descendants and 'MS:1000515' in descendants
+    assert 'MS:1000513' in [t.id for t in cv.ancestors('MS:1000514')]
+
+
+def test_search():
+    assert 'MS:1000514' in [t.id for t in cv.search('m/z ar')]
+    assert 'MS:1000514' in [t.id for t in cv.search('Z ARRAY', mode='substring')]
+    assert cv.search('m/z arary', mode='approximate', limit=1)[0].id == 'MS:1000514'
+    assert cv.search('no such term at all', mode='approximate', max_distance=1) == []
+
+
+def test_search_short_queries():
+    index = TermSearchIndex([
+        ("m/z array", 1), ("intensity array", 2), ("charge array", 3), ("ms level", 4),
+        ("MS1", 5), ("MSn", 6), ("ion", 7), ("aa", 8)])
+    texts = index.texts
+    for query in ("", "a", "Y", "ar", "s1", "zz", "ms", "arr", "rray"):
+        expected = [text for text in texts if query.lower() in text]
+        assert [m.text.lower() for m in index.substring(query)] == expected
+        assert [m.text.lower() for m in index.substring(query, limit=2)] == expected[:2]
+    for query in ("ms", "msx", "io", "a", "aaa", "lvl", "charge"):
+        expected = sorted((edit_distance(query, text, 2), text) for text in texts
+                          if edit_distance(query, text, 2) <= 2)
+        assert sorted((m.distance, m.text.lower()) for m in index.approximate(query)) == expected
+
+
+def test_compact_store():
+    compact_cv = ControlledVocabulary.from_obo(_use_vendored_psims_obo(), compact=True)
+    term = compact_cv['m/z array']
+    assert dict(term) == dict(cv['m/z array'])
+    assert term.is_a.accession == 'MS:1000513'
+    assert 'MS:1000514' in [c.id for c in compact_cv['MS:1000513'].children]
+    assert term.is_of_type('binary data array')
+    term.value_type = 'spam'
+    del term
+    assert compact_cv['m/z array'].value_type == 'spam'
+
+
+def test_prefetch():
+    body = _use_vendored_unit_obo().read()
+    requests = []
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(self.path)
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", '"v1"')
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    local_cache = OBOCache(tempfile.mkdtemp(), timeout=5)
+    try:
+        base = "http://127.0.0.1:%d/" % server.server_address[1]
+        uris = [base + "a.obo", base + "b.obo"]
+        paths = local_cache.prefetch(uris)
+        assert sorted(paths) == uris
+        manifest = local_cache.read_manifest()
+        assert manifest[uris[0]]['etag'] == '"v1"'
+        with open(paths[uris[1]], 'rb') as fh:
+            assert fh.read() == body
+        assert local_cache.prefetch(uris) == paths
+        assert len(requests) == 4
+        with local_cache.resolve(uris[0]) as fh:
+            assert ControlledVocabulary.from_obo(fh)['UO:0000010']
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(local_cache.cache_path)
+
+
+def test_subtree_restricted_load():
+    subset = ControlledVocabulary.from_obo(
+        _use_vendored_psims_obo(), roots=['binary data array', 'MS:1000572'])
+    assert subset.is_restricted()
+    assert 'MS:1000514' in subset.terms
+    assert 'MS:1000513' in subset.terms
+    assert 'MS:1000031' not in subset.terms
+    assert len(subset.terms) < len(cv.terms)
+    assert subset['m/z array'].is_of_type('binary data array')
+    assert subset.is_restricted()
+    assert subset['MS:1000031'].name == 'instrument model'
+    assert not subset.is_restricted()
+    assert len(subset.terms) == len(cv.terms)
+
+
+def test_subtree_restricted_reload_handles():
+    content = _use_vendored_psims_obo().read()
+    roots = ['binary data array']
+
+    # the caller's handle may be closed once the vocabulary is built
+    handle = BytesIO(content)
+    subset = ControlledVocabulary.from_obo(handle, roots=roots)
+    handle.close()
+    assert subset['MS:1000031'].name == 'instrument model'
+
+    # handles returned by the loader are closed once read
+    opened = []
+
+    def loader():
+        opened.append(BytesIO(content))
+        return opened[-1]
+    subset = ControlledVocabulary.from_obo(BytesIO(content), roots=roots, loader=loader)
+    assert subset['MS:1000031'].name == 'instrument model'
+    assert opened[0].closed
+
+    # a loader which fails leaves the original KeyError
+    def broken_loader():
+        raise IOError("gone")
+    subset = ControlledVocabulary.from_obo(BytesIO(content), roots=roots, loader=broken_loader)
+    with pytest.raises(KeyError):
+        subset['MS:1000031']
+    assert subset['m/z array'].id == 'MS:1000514'
+
+
+def test_unimod_bulk_create():
+    db = unimod.Unimod(None, _use_vendored_unimod_xml())
+    mod = db.get("Carbamidomethyl")
+    assert mod.id == 4
+    assert "Carboxyamidomethylation" in mod.alternative_names
+    assert db.version == '1.0'
+    assert db.session.query(unimod.MiscNotesModifications).count() > 0
+
+
+def test_unimod_deferred_composition():
+    db = unimod.Unimod(None, _use_vendored_unimod_xml())
+    mod = db.get("Carbamidomethyl")
+    assert 'composition' not in mod.__dict__
+    assert dict(mod.composition) == {'H': 3, 'C': 2, 'N': 1, 'O': 1}
+    assert 'composition' in mod.__dict__
+    assert "unimod_brick_compositions" in unimod.object_session(mod).info
+    entity = unimod.UNIMODEntity.converter(mod, None)
+    assert entity['composition'] == mod.composition
+
+
+def test_unimod_name_index():
+    db = unimod.Unimod(None, _use_vendored_unimod_xml())
+    assert db.get("Oxidation").id == 35
+    assert db.get("UNIMOD:35") is db.get("Oxidation")
+    assert db.get("Carboxyamidomethylation").id == 4
+    assert db.get("carbamidomethyl", strict=False).id == 4
+    assert db.get("Carbamido_ethyl", strict=False).id == 4
+    with pytest.raises(KeyError):
+        db.get("not a modification")
+    with pytest.raises(KeyError):
+        db.get(999999)
+
+
+def test_unimod_infer_batch():
+    db = unimod.Unimod(None, _use_vendored_unimod_xml())
+    phospho, oxidation = db.infer_batch([79.9663, 15.9949], ["S", "M"], 0.001)
+    assert [mod.id for mod in phospho] == [21]
+    assert [mod.id for mod in oxidation] == [35]
+    assert db.infer_batch([79.9663], "S", 10, error_unit="ppm")[0] == phospho
+    assert db.infer(79.9663, "S", 0.001) == phospho
+    assert db.infer_batch([79.9663], "not a residue", 0.001) == [[]]
+    assert len(db.infer_batch([15.9949], None, 0.001)[0]) > 1
+    with pytest.raises(ValueError):
+        db.infer_batch([79.9663], "S", 0.001, error_unit="mmu")
+
+
+def test_unimod_snapshot(tmpdir):
+    snapshot_path = str(tmpdir.join("unimod.sqlite"))
+    unimod.write_snapshot(_use_vendored_unimod_xml(), snapshot_path)
+    db = unimod.Unimod(None, _use_vendored_unimod_xml(), snapshot_path=snapshot_path)
+    assert db.get("Phospho").id == 21
+    assert unimod.load_snapshot(snapshot_path, _use_vendored_unimod_xml()) is not None
+    stale = tmpdir.join("unimod_tables.xml")
+    stale.write_binary(_use_vendored_unimod_xml().read().replace(b"Phospho", b"Phosph0"))
+    assert unimod.load_snapshot(snapshot_path, str(stale)) is None
+    assert unimod.load_snapshot(str(tmpdir.join("missing.sqlite"))) is None
+
+
+def test_unimod_concurrent_readers():
+    db = unimod.Unimod(None, _use_vendored_unimod_xml())
+    names = ["Phospho", "Oxidation", "Carbamidomethyl", "Acetyl", "Deamidated"]
+    expected = {name: db.get(name).id for name in names}
+    errors = []
+    sessions = []
+
+    def read():
+        try:
+            sessions.append(db.session())
+            for _ in range(50):
+                for name in names:
+                    mod = db.get(name)
+                    assert mod.id == expected[name]
+                    assert mod.composition
+                    assert mod in db.infer(mod.monoisotopic_mass, mod.specificities[0].amino_acid, 1e-4)
+            assert db.session.query(unimod.Modification).count() == len(db.index.ids)
+        except Exception as err:
+            errors.append(err)
+
+    threads = [threading.Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(set(map(id, sessions))) == 4
+
+
+def test_resolve_unimod_prefers_snapshot(tmpdir, monkeypatch):
+    create = unimod.create
+    parsed = []
+
+    def offline_create(doc_path, *args, **kwargs):
+        parsed.append(doc_path)
+        if doc_path == unimod._unimod_xml_download_url:
+            raise IOError(doc_path)
+        return create(doc_path, *args, **kwargs)
+
+    monkeypatch.setattr(unimod, "create", offline_create)
+    cache = OBOCache(enabled=False)
+    assert controlled_vocabulary.resolve_unimod(cache).get("Phospho").id == 21
+    assert parsed == []
+    monkeypatch.setattr(
+        controlled_vocabulary, "_vendored_unimod_snapshot_path",
+        lambda: str(tmpdir.join("missing.sqlite")))
+    assert controlled_vocabulary.resolve_unimod(cache).get("Phospho").id == 21
+    assert len(parsed) == 2
+    assert parsed[0] == unimod._unimod_xml_download_url
+
+
+@pytest.mark.parametrize("from_snapshot", [False, True])
+def test_unimod_isolated_sessions(tmpdir, from_snapshot):
+    snapshot_path = None
+    if from_snapshot:
+        snapshot_path = str(tmpdir.join("unimod.sqlite"))
+        unimod.write_snapshot(_use_vendored_unimod_xml(), snapshot_path)
+    db = unimod.Unimod(None, _use_vendored_unimod_xml(), snapshot_path=snapshot_path)
+    history = db.session.query(unimod.History).count()
+    db.session.remove()
+    inserted = threading.Event()
+    readers_done = threading.Event()
+    errors = []
+    connections = []
+
+    def connection_of(session):
+        return session.connection().connection.connection
+
+    def write():
+        try:
+            session = db.session()
+            session.add(unimod.History(url="uncommitted", version="0.0"))
+            session.flush()
+            connections.append(connection_of(session))
+            inserted.set()
+            readers_done.wait(30)
+            # the readers rolling back their own sessions must not discard this transaction
+            assert session.query(unimod.History).filter_by(url="uncommitted").count() == 1
+            session.rollback()
+        except Exception as err:
+            errors.append(err)
+        finally:
+            inserted.set()
+            db.session.remove()
+
+    def read():
+        try:
+            inserted.wait(30)
+            for _ in range(20):
+                session = db.session()
+                connections.append(connection_of(session))
+                assert session.query(unimod.Modification).filter_by(id=21).one().full_name
+                session.rollback()
+        except Exception as err:
+            errors.append(err)
+        finally:
+            db.session.remove()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    for thread in readers:
+        thread.join()
+    readers_done.set()
+    writer.join()
+    assert not errors
+    assert connections.count(connections[0]) == 1
+    assert db.session.query(unimod.History).count() == history
+
+
+def test_provided_cv_memoizes_conversion():
+    cv = ProvidedCV(id='UNIMOD', uri='http://www.unimod.org/obo/unimod.obo', full_name='UNIMOD',
+                    converter=unimod.UNIMODEntity.converter)
+    cv._vocabulary = unimod.Unimod(None, _use_vendored_unimod_xml())
+    entity = cv['Phospho']
+    assert entity.id == 'UNIMOD:21'
+    assert cv['UNIMOD:21'] is entity
+    assert cv[21] is entity
+    assert cv['Phospho'] is entity
+    assert len(cv.converted) == 1
+    assert len(cv.aliases) == 3
+    cv.clear_cache()
+    assert cv['Phospho'] is not entity
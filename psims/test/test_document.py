@@ -1,3 +1,5 @@
+import warnings
+
 import pytest
 
 from io import BytesIO
@@ -47,3 +49,154 @@ def test_xmlwriter(output_path):
     f.close()
     with open(output_path, 'rb') as fh:
         print(fh.readline())
+
+
+def test_unified_term_index():
+    buffer = BytesIO()
+    f = writer.MzMLWriter(buffer)
+    with f:
+        f.controlled_vocabularies()
+        ctx = f.context
+        ms = [cv for cv in ctx.vocabularies if cv.id == 'PSI-MS'][0]
+        for query in ("MS:1000511", "ms level", "MS LEVEL", "m/z", "UO:0000031"):
+            resolved = ctx.term_index.resolve(query)
+            assert resolved
+            cv, term = resolved[0]
+            assert term == cv[query]
+        assert ctx.term("ms level") == ms["MS:1000511"]
+        assert ctx.term_index.resolve("not a real term") == ()
+        assert "not a real term" in ctx.term_index.misses
+        assert "not a real term" not in ctx.term_index.cache
+        ctx.term_index.max_misses = 2
+        for query in ("not a real term", "unknown 1", "unknown 2"):
+            assert ctx.term_index.resolve(query) == ()
+        assert list(ctx.term_index.misses) == ["unknown 1", "unknown 2"]
+        with pytest.raises(KeyError):
+            ctx.term("not a real term")
+    f.close()
+
+
+def test_unit_cache():
+    buffer = BytesIO()
+    f = writer.MzMLWriter(buffer)
+    with f:
+        f.controlled_vocabularies()
+        ctx = f.context
+        param = ctx.param({"name": "scan start time", "value": 5.0, "unit_name": "minute"})
+        assert param.unit_accession == "UO:0000031"
+        assert ctx._unit_cache
+        again = ctx.param({"name": "scan start time", "value": 6.0, "unit_name": "minute"})
+        assert again.unit_accession == "UO:0000031"
+        assert again.unitCvRef == "UO"
+        with pytest.warns(UserWarning):
+            ctx.param({"name": "scan start time", "value": 5.0, "unit_name": "meter"})
+        filled = ctx.param("base peak m/z", 200.0)
+        assert filled.unit_accession == "MS:1000040"
+    f.close()
+
+
+def test_resolve_params_once():
+    buffer = BytesIO()
+    f = writer.MzMLWriter(buffer)
+    with f:
+        f.controlled_vocabularies()
+        ctx = f.context
+        calls = []
+        resolve = ctx.param
+
+        def counting_param(param, *args, **kwargs):
+            # already resolved params are passed through unchanged
+            if not isinstance(param, (document.CVParam, document.ParamGroupReference)):
+                calls.append(param)
+            return resolve(param, *args, **kwargs)
+
+        ctx.param = counting_param
+        container = document.ParameterContainer(
+            "cvParamHolder", [{"name": "my user param", "value": 1}, "ms level", {"ref": "group"}],
+            context=ctx)
+        ctx['ReferenceableParamGroup']['group'] = 'group'
+        resolved = container.resolve_params()
+        assert [type(p).__name__ for p in resolved] == ['ParamGroupReference', 'CVParam', 'UserParam']
+        assert len(calls) == 3
+        assert container.resolve_params() is resolved
+        assert container.has_param("ms level")
+        container.add_param("MS1 spectrum")
+        assert len(container.resolve_params()) == 4
+        container.write_params(f)
+        assert len(calls) == 4
+        del ctx.param
+    f.close()
+
+
+def test_tracking_policies():
+    context = document.DocumentContext(
+        tracking_policies={"Peptide": "compact", "SpectrumIdentificationItem": "count"})
+    peptides = context["Peptide"]
+    assert isinstance(peptides, document.CompactContextCache)
+    assert peptides.register(5) == "PEPTIDE_5"
+    assert peptides.register("PEP_1") == "PEP_1"
+    peptides["custom"] = "CUSTOM_ID"
+    for i in range(5000, 0, -1):
+        peptides.register(i)
+    assert peptides[5] == "PEPTIDE_5"
+    assert peptides["PEP_1"] == "PEP_1"
+    assert peptides["custom"] == "CUSTOM_ID"
+    assert len(peptides) == 5002
+    with pytest.warns(document.ReferentialIntegrityWarning):
+        assert peptides["PEP_2"] == "PEP_2"
+    assert "PEP_2" in peptides
+
+    items = context["SpectrumIdentificationItem"]
+    items.register("SII_1")
+    items["SII_2"] = "SII_2"
+    assert len(items) == 2
+    assert items["never registered"] == "never registered"
+
+    assert isinstance(context["Spectrum"], document.SpecializedContextCache)
+    context["Spectrum"].register(1)
+    with pytest.raises(ValueError):
+        context.set_tracking_policy("Spectrum", "count")
+    with pytest.raises(ValueError):
+        context.set_tracking_policy("Chromatogram", "sparse")
+
+
+def test_trusted_integrity_report():
+    context = document.DocumentContext(trusted=True)
+    assert not context.validate_units
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert context["DataProcessing"]["DP_1"] == "DP_1"
+        assert context["SourceFile"][3] == "SOURCEFILE_3"
+        assert context["Sample"]["SAMPLE_1"] == "SAMPLE_1"
+        # registered after being referenced, so not reported
+        context["DataProcessing"].register("DP_1")
+    assert context.integrity_report() == {"SourceFile": [3], "Sample": ["SAMPLE_1"]}
+
+    dispatcher = components.ComponentDispatcher(context=context)
+    with pytest.warns(document.ReferentialIntegrityWarning):
+        dispatcher.check_integrity()
+    context.missing_reference_is_error = True
+    with pytest.raises(document.ReferentialIntegrityError):
+        dispatcher.check_integrity()
+    context.missing_reference_is_error = False
+
+    context.set_trusted(False)
+    assert context.validate_units
+    with pytest.warns(document.ReferentialIntegrityWarning):
+        context["Sample"]["SAMPLE_2"]
+
+
+def test_dispatcher_binds_components():
+    f = writer.MzMLWriter(BytesIO())
+    early = f.ScanList([])
+    assert early.writer is None
+    assert f.ScanList is f.ScanList
+    assert "ScanList" in f.__dict__
+    with f:
+        scan_list = f.ScanList([])
+        assert scan_list.context is f.context
+        assert scan_list.writer is f.writer
+        assert early.writer is f.writer
+        other = BytesIO()
+        scan_list.bind(other)
+        assert scan_list.writer is other
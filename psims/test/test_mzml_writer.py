@@ -1,9 +1,14 @@
 import itertools
 import gzip
+import hashlib
 import os
+import re
 import tempfile
 
-from psims.mzml import MzMLWriter, binary_encoding
+from io import BytesIO
+
+from psims.mzml import MzMLWriter, MzMLShardWriter, binary_encoding
+from psims.mzml.writer import PlainMzMLWriter
 from pyteomics import mzml
 import numpy as np
 from lxml import etree
@@ -11,7 +16,7 @@ from lxml import etree
 import pytest
 
 from psims import compression as compression_registry
-from psims.test.utils import output_path, compressor
+from psims.test.utils import output_path, compressor, write_mzml_header
 
 
 mz_array = [
@@ -205,3 +210,269 @@ def test_write(output_path, compressor):
     line = reader.readline()
     assert line.startswith(b"""<?xml version='1.0' encoding='utf-8'?>""")
     return f
+
+
+def test_param_group_deduplication(output_path):
+    spectrum_params = [
+        [{"name": "ms level", "value": 1}, "MS1 spectrum", "negative scan", "centroid spectrum",
+         {"name": "total ion current", "value": 5e6}],
+        [{"name": "ms level", "value": 2}, "MSn spectrum", "negative scan", "centroid spectrum",
+         {"name": "total ion current", "value": 4e4}],
+    ]
+    with MzMLWriter(open(output_path, 'wb'), close=True) as f:
+        sample = [params[:4] + [{"name": "total ion current", "value": i * 1e3}]
+                  for i, params in enumerate(spectrum_params * 3)]
+        groups = f.infer_param_groups(sample)
+        assert [group['id'] for group in groups] == ['CommonParams_MS1', 'CommonParams_MS2']
+        assert len(groups[0]['params']) == 4
+        write_mzml_header(
+            f, file_contents=["MS1 spectrum", "MSn spectrum"],
+            source_files=[dict(id="RAW1", name="raw.raw", location="file:///", params=["Thermo RAW format"])],
+            param_groups=groups,
+            instrument_configurations=[
+                f.InstrumentConfiguration(id=1, component_list=f.ComponentList([
+                    f.Source(params=['electrospray ionization'], order=1),
+                    f.Analyzer(params=['quadrupole'], order=2),
+                    f.Detector(params=['inductive detector'], order=3)
+                ]))
+            ])
+        with f.run(id='test'):
+            with f.spectrum_list(count=2):
+                for i, params in enumerate(spectrum_params):
+                    f.write_spectrum(
+                        mz_array, intensity_array, id='scanId=%d' % (i + 1), polarity='negative scan',
+                        params=params[:2] + params[4:])
+    is_valid, schema = f.validate()
+    assert is_valid, schema.error_log
+    tree = etree.parse(output_path)
+    ns = {"mz": "http://psi.hupo.org/ms/mzml"}
+    spectra = tree.findall(".//mz:spectrum", ns)
+    for spectrum, group in zip(spectra, groups):
+        assert spectrum.find("mz:referenceableParamGroupRef", ns).attrib['ref'] == group['id']
+        names = [param.attrib['name'] for param in spectrum.findall("mz:cvParam", ns)]
+        assert names == ['total ion current']
+
+
+def test_spectrum_template():
+    def write(use_template):
+        buffer = BytesIO()
+        with MzMLWriter(buffer) as f:
+            write_mzml_header(f)
+            with f.run(id='test'):
+                with f.spectrum_list(count=3):
+                    params = [{"name": "ms level", "value": 1}, "MS1 spectrum"]
+                    template = f.spectrum_template(
+                        polarity=-1, params=params, scan_window_list=[(100, 2000)])
+                    for i in range(3):
+                        if use_template:
+                            template.write(
+                                mz_array, intensity_array, id='scanId=%d' % (i + 1),
+                                scan_start_time=i * 0.5)
+                        else:
+                            f.write_spectrum(
+                                mz_array, intensity_array, id='scanId=%d' % (i + 1),
+                                scan_start_time=i * 0.5, polarity=-1, params=params,
+                                scan_window_list=[(100, 2000)])
+        return buffer.getvalue()
+
+    assert write(True) == write(False)
+
+
+def test_spectrum_template_shared_params():
+    buffer = BytesIO()
+    with MzMLWriter(buffer) as f:
+        write_mzml_header(f, param_groups=[
+            {"id": "CommonParams", "params": ["MS1 spectrum", "negative scan"]}
+        ])
+        with f.run(id='test'):
+            with f.spectrum_list(count=3):
+                template = f.spectrum_template(
+                    polarity=-1, params=[{"name": "ms level", "value": 1}, "MS1 spectrum"])
+                shared = list(template.params)
+                spectra = [
+                    template.spectrum(
+                        mz_array, intensity_array, id='scanId=%d' % (i + 1),
+                        params=[{"name": "total ion current", "value": i + 1}])
+                    for i in range(3)]
+                for spectrum in spectra:
+                    spectrum.write(f.writer)
+    assert all(param._frozen_element is not None for param in shared)
+    # deduplication replaces each spectrum's list of params, never the shared params
+    assert all(a is b for a, b in zip(template.params, shared))
+    ms_level = shared[0]
+    for spectrum in spectra:
+        assert any(param is ms_level for param in spectrum.params)
+    tree = etree.parse(BytesIO(buffer.getvalue()))
+    ns = {"mz": "http://psi.hupo.org/ms/mzml"}
+    for i, spectrum in enumerate(tree.findall(".//mz:spectrum", ns)):
+        assert spectrum.find("mz:referenceableParamGroupRef", ns).attrib['ref'] == "CommonParams"
+        values = {param.attrib['name']: param.attrib.get('value')
+                  for param in spectrum.findall("mz:cvParam", ns)}
+        assert values == {"ms level": "1", "centroid spectrum": "", "total ion current": str(i + 1)}
+
+
+def test_merge_spectrum_shards(tmpdir):
+    spectra = [
+        dict(mz_array=mz_array, intensity_array=np.array(intensity_array) * (i + 1), id='scanId=%d' % i,
+             scan_start_time=i * 0.1, params=[{"name": "ms level", "value": 1}],
+             instrument_configuration_id=1)
+        for i in range(6)
+    ]
+
+    def write(path, slices=None):
+        with MzMLWriter(open(path, 'wb'), close=True) as f:
+            write_mzml_header(f)
+            shards = []
+            for i, spectrum_slice in enumerate(slices or []):
+                shard_path = str(tmpdir.join("shard_%d" % i))
+                with MzMLShardWriter(shard_path, references=f.shard_references()) as shard:
+                    for spectrum in spectrum_slice:
+                        shard.write_spectrum(**spectrum)
+                shards.append(shard.shard)
+            with f.run(id='test'):
+                with f.spectrum_list(count=len(spectra)):
+                    if slices is None:
+                        for spectrum in spectra:
+                            f.write_spectrum(**spectrum)
+                    else:
+                        f.write_spectrum(**spectra[0])
+                        f.merge_spectrum_shards(shards)
+        with open(path, 'rb') as fh:
+            return fh.read()
+
+    expected = write(str(tmpdir.join("single.mzML")))
+    merged = write(str(tmpdir.join("merged.mzML")), [spectra[1:4], spectra[4:]])
+    assert merged == expected
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_deferred_list_count(compressed):
+    buffer = BytesIO()
+    # gzip streams cannot be patched in place, so the list is staged until it closes
+    f = MzMLWriter(gzip.GzipFile(fileobj=buffer, mode='wb') if compressed else buffer)
+    with f:
+        write_mzml_header(f)
+        with f.run(id='test'):
+            with f.spectrum_list(count=None):
+                for i in range(3):
+                    f.write_spectrum(mz_array, intensity_array, id='scanId=%d' % i,
+                                     params=[{"name": "ms level", "value": 1}])
+            with f.chromatogram_list(count=None):
+                f.write_chromatogram([0.0, 1.0], [10.0, 20.0], id='TIC')
+    data = buffer.getvalue()
+    if compressed:
+        f.outfile.close()
+        data = gzip.GzipFile(fileobj=BytesIO(buffer.getvalue())).read()
+    # the count is padded with spaces outside of its quotes
+    assert re.search(br'<spectrumList [^>]*count="3" {9}[ >]', data)
+    assert re.search(br'<chromatogramList [^>]*count="1" {9}[ >]', data)
+    reader = mzml.MzML(BytesIO(data))
+    assert [s['id'] for s in reader] == ['scanId=%d' % i for i in range(3)]
+    # offsets recorded while the list was held still point at the elements
+    offsets = [int(o) for o in re.findall(br'<offset [^>]*>(\d+)</offset>', data)]
+    assert len(offsets) == 4
+    for offset in offsets:
+        assert data[offset:offset + 12] in (b'<spectrum in', b'<chromatogra')
+    # the checksum covers the patched counts
+    start = data.index(b'<fileChecksum>') + len(b'<fileChecksum>')
+    assert hashlib.sha1(data[:start]).hexdigest().encode('ascii') == data[start:start + 40]
+
+
+def test_deferred_list_count_plain_stream():
+    buffer = BytesIO()
+    f = PlainMzMLWriter(buffer)
+    with f:
+        write_mzml_header(f)
+        with f.run(id='test'):
+            with f.spectrum_list(count=None):
+                for i in range(12):
+                    f.write_spectrum(mz_array, intensity_array, id='scanId=%d' % i,
+                                     params=[{"name": "ms level", "value": 1}])
+    data = buffer.getvalue()
+    # the placeholder is found wherever the count falls among the attributes
+    assert re.search(br'<spectrumList count="12" {8} defaultDataProcessingRef=', data)
+    assert etree.fromstring(data) is not None
+    assert len(list(mzml.MzML(BytesIO(data), use_index=False))) == 12
+
+
+def test_deferred_list_count_requires_seekable_stream(tmpdir):
+    for stream in (gzip.GzipFile(fileobj=BytesIO(), mode='wb'),
+                   open(str(tmpdir.join("write_only.mzML")), 'wb')):
+        f = PlainMzMLWriter(stream)
+        with pytest.raises(ValueError):
+            with f:
+                f.controlled_vocabularies()
+                with f.run(id='test'):
+                    with f.spectrum_list(count=None):
+                        pass
+        stream.close()
+
+
+@pytest.mark.parametrize("open_chromatogram_list", [False, True])
+def test_summary_chromatograms(open_chromatogram_list):
+    buffer = BytesIO()
+    f = MzMLWriter(buffer, summary_chromatograms=True)
+    with f:
+        write_mzml_header(f, file_contents=["MS1 spectrum", "MSn spectrum"])
+        with f.run(id='test'):
+            with f.spectrum_list(count=4):
+                for i in range(4):
+                    f.write_spectrum(
+                        mz_array, np.array(intensity_array) * (i + 1), id='scanId=%d' % i,
+                        scan_start_time=i * 0.5,
+                        params=[{"name": "ms level", "value": 1 + i % 2}])
+            if open_chromatogram_list:
+                with f.chromatogram_list(count=1):
+                    f.write_chromatogram([0.0, 1.0], [10.0, 20.0], id='SIC')
+    reader = mzml.MzML(BytesIO(buffer.getvalue()))
+    chromatograms = {c['id']: c for c in reader.iterfind("chromatogram")}
+    expected = ["TIC", "BPC", "TIC MS2", "BPC MS2"] + (["SIC"] if open_chromatogram_list else [])
+    assert list(chromatograms) == expected
+    assert re.search(br'<chromatogramList count="%d"' % len(expected), buffer.getvalue())
+    intensity = np.array(intensity_array)
+    tic = chromatograms["TIC"]
+    assert np.allclose(tic['time array'], [0.0, 1.0])
+    assert np.allclose(tic['intensity array'], [intensity.sum(), intensity.sum() * 3], rtol=1e-5)
+    assert 'total ion current chromatogram' in tic
+    bpc = chromatograms["BPC MS2"]
+    assert np.allclose(bpc['time array'], [0.5, 1.5])
+    assert np.allclose(bpc['intensity array'], [intensity.max() * 2, intensity.max() * 4], rtol=1e-5)
+    assert 'basepeak chromatogram' in bpc
+
+
+def test_shard_references_with_tracking_policies(tmpdir):
+    from psims.mzml.index import IndexList
+    policies = {"InstrumentConfiguration": "compact", "DataProcessing": "count"}
+    f = MzMLWriter(BytesIO(), tracking_policies=policies, missing_reference_is_error=True)
+    with f:
+        f.controlled_vocabularies()
+        f.instrument_configuration_list([f.InstrumentConfiguration(id=1, component_list=[])])
+        f.data_processing_list([f.DataProcessing(processing_methods=[], id=1)])
+        references = f.shard_references()
+        shard_path = str(tmpdir.join("shard"))
+        with MzMLShardWriter(shard_path, references=references, missing_reference_is_error=True) as shard:
+            shard.write_spectrum(mz_array, intensity_array, id='scanId=0', instrument_configuration_id=1,
+                                 params=[{"name": "ms level", "value": 1}])
+        assert shard.context.tracking_policies == policies
+        with open(shard_path, 'rb') as fh:
+            assert b'instrumentConfigurationRef="INSTRUMENTCONFIGURATION_1"' in fh.read()
+        with f.run(id='test', instrument_configuration=1):
+            with f.spectrum_list(count=1, data_processing_method=1):
+                f.merge_spectrum_shards([shard.shard])
+    with pytest.raises(ValueError):
+        IndexList().get_indexer("spectrum")
+
+
+@pytest.mark.parametrize("policy", ["count", "compact"])
+def test_default_references_with_tracking_policies(policy):
+    buffer = BytesIO()
+    policies = {"InstrumentConfiguration": policy, "DataProcessing": policy}
+    with MzMLWriter(buffer, tracking_policies=policies) as f:
+        write_mzml_header(f)
+        with f.run(id='test'):
+            with f.spectrum_list(count=1):
+                f.write_spectrum(mz_array, intensity_array, id='scanId=0',
+                                 params=[{"name": "ms level", "value": 1}])
+    data = buffer.getvalue()
+    assert b'defaultInstrumentConfigurationRef="INSTRUMENTCONFIGURATION_1"' in data
+    assert b'defaultDataProcessingRef="DATAPROCESSING_1"' in data
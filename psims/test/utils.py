@@ -45,3 +45,30 @@ def remove_all_temp_files(request):
             except Exception as e:
                 print(e)
     request.addfinalizer(clean_files)
+
+
+def mzml_header(writer, file_contents=("MS1 spectrum", ), source_files=None, param_groups=None,
+                instrument_configurations=None):
+    """List the calls which write the header of a small mzML document through ``writer``
+    as ``(method, args, kwargs)`` triples, so asynchronous writers can await each one.
+    """
+    if instrument_configurations is None:
+        instrument_configurations = [writer.InstrumentConfiguration(id=1, component_list=[])]
+    calls = [
+        (writer.controlled_vocabularies, (), {}),
+        (writer.file_description, (list(file_contents), source_files), {}),
+    ]
+    if param_groups is not None:
+        calls.append((writer.reference_param_group_list, (param_groups, ), {"deduplicate": True}))
+    calls.extend([
+        (writer.software_list, ([writer.Software(version="0.0.0", id='psims', params=['python-psims'])], ), {}),
+        (writer.instrument_configuration_list, (instrument_configurations, ), {}),
+        (writer.data_processing_list, ([writer.DataProcessing(processing_methods=[
+            dict(order=0, software_reference='psims', params=['Conversion to mzML'])], id=1)], ), {}),
+    ])
+    return calls
+
+
+def write_mzml_header(writer, **kwargs):
+    for method, args, method_kwargs in mzml_header(writer, **kwargs):
+        method(*args, **method_kwargs)
@@ -309,6 +309,21 @@ class MzMLTransformer(TransformerBase):
         else:
             return self.reader.iterfind("spectrum")
 
+    def spectrum_count(self):
+        '''The number of spectra in the input, if the reader has indexed them.
+
+        Returns
+        -------
+        int or None
+        '''
+        index = getattr(self.reader, '_offset_index', None)
+        if index is None:
+            return None
+        try:
+            return len(index['spectrum'])
+        except (KeyError, TypeError):
+            return None
+
     def write(self):
         '''Write out the the transformed mzML file
         '''
@@ -317,7 +332,8 @@ class MzMLTransformer(TransformerBase):
             writer.controlled_vocabularies()
             self.copy_metadata()
             with writer.run(id="transformation_run"):
-                with writer.spectrum_list(len(self.reader._offset_index)):
+                # the count is only deferred when the input was not indexed
+                with writer.spectrum_list(count=self.spectrum_count()):
                     self.reader.reset()
                     for i, spectrum in enumerate(self.iterspectrum()):
                         spectrum = self.transform(spectrum)
@@ -1,7 +1,7 @@
 import os
 import shutil
 import re
-from contextlib import contextmanager
+from contextlib import contextmanager, closing
 from collections import deque
 
 import tempfile
@@ -158,6 +158,7 @@ class TagBase(object):
     """
 
     type_attrs = {}
+    _frozen_element = None
 
     def __init__(self, tag_name=None, text="", **attrs):
         self.tag_name = tag_name or self.tag_name
@@ -266,9 +267,25 @@ class TagBase(object):
         --------
         :meth:`element`
         """
-        el = self.element(with_id=with_id)
+        el = self._frozen_element
+        if el is None or with_id:
+            el = self.element(with_id=with_id)
         xml_file.write(el)
 
+    def freeze(self):
+        """Materialize this element once, and write that same element every time this
+        tag is written afterwards.
+
+        This tag must not be modified after it is frozen.
+
+        Returns
+        -------
+        TagBase
+            This tag
+        """
+        self._frozen_element = self.element()
+        return self
+
     def bind(self, xml_file):
         self._xml_file = xml_file
 
@@ -515,6 +532,9 @@ class CV(object):
         A short unique identifier for the controlled vocabulary
     options : :class:`dict`
         Additional information that may be used during resolution
+    roots : list
+        If not :const:`None`, the ids or names of the terms to restrict the
+        loaded vocabulary to. See :meth:`~.ControlledVocabulary.from_obo`.
     resolver : :class:`~.VocabularyResolver`
         The resolver which will handle all requests for this controlled vocabulary
     uri : str
@@ -525,11 +545,12 @@ class CV(object):
         The parsed term graph defining this vocabulary
     """
 
-    def __init__(self, full_name, id, uri, version=None, resolver=None, **kwargs):
+    def __init__(self, full_name, id, uri, version=None, resolver=None, roots=None, **kwargs):
         self.full_name = full_name
         self.id = id
         self.uri = uri
         self._version = version
+        self.roots = roots
         self.options = kwargs
         self._vocabulary = None
         self.resolver = None
@@ -552,7 +573,8 @@ class CV(object):
     def load(self, handle=None):
         """Load the vocabulary definition from source
 
-        Assumes that the definition is in OBO format
+        Assumes that the definition is in OBO format, whose terms are built
+        lazily as they are first accessed.
 
         Parameters
         ----------
@@ -572,16 +594,21 @@ class CV(object):
         resolver = self.resolver or controlled_vocabulary.obo_cache
         if handle is None:
             try:
-                fp = resolver.resolve(self.uri)
-                cv = controlled_vocabulary.ControlledVocabulary.from_obo(fp)
+                with closing(resolver.resolve(self.uri)) as fp:
+                    cv = controlled_vocabulary.ControlledVocabulary.from_obo(
+                        fp, lazy=True, roots=self.roots, loader=lambda: resolver.resolve(self.uri))
             except ValueError:
                 fp = resolver.fallback(self.uri)
                 if fp is not None:
-                    cv = controlled_vocabulary.ControlledVocabulary.from_obo(fp)
+                    with closing(fp):
+                        cv = controlled_vocabulary.ControlledVocabulary.from_obo(
+                            fp, lazy=True, roots=self.roots,
+                            loader=lambda: resolver.fallback(self.uri))
                 else:
                     raise KeyError(self.uri)
         else:
-            cv = controlled_vocabulary.ControlledVocabulary.from_obo(handle)
+            cv = controlled_vocabulary.ControlledVocabulary.from_obo(
+                handle, lazy=True, roots=self.roots)
         try:
             cv.id = self.id
         except Exception:
@@ -602,15 +629,26 @@ class ProvidedCV(CV):
     as :class:`CV` from that object, provided through the :attr:`converter`
     function
 
+    Converted terms are memoized by the :attr:`id` of the element they were
+    converted from, so every key which resolves to the same element shares
+    one converted instance.
+
     Attributes
     ----------
     converter : Callable
         A function that converts elements of the provided vocabulary into
         something matching the :class:`~.controlled_vocabulary.Entity` interface.
+    converted : dict
+        Maps the id of each element of the provided vocabulary looked up so far
+        to its converted form
+    aliases : dict
+        Maps each key looked up so far to the converted form it resolved to
     """
 
     def __init__(self, id, uri, converter=identity, **kwargs):
         self.converter = converter
+        self.converted = {}
+        self.aliases = {}
         super(ProvidedCV, self).__init__(id=id, uri=uri, **kwargs)
 
     def load(self, handle=None):
@@ -628,7 +666,30 @@ class ProvidedCV(CV):
         return cv
 
     def __getitem__(self, key):
-        return self.converter(super(ProvidedCV, self).__getitem__(key), self)
+        try:
+            return self.aliases[key]
+        except (KeyError, TypeError):
+            pass
+        term = super(ProvidedCV, self).__getitem__(key)
+        term_id = getattr(term, 'id', None)
+        if term_id is None:
+            return self.converter(term, self)
+        try:
+            entity = self.converted[term_id]
+        except KeyError:
+            entity = self.converted[term_id] = self.converter(term, self)
+        try:
+            self.aliases[key] = entity
+        except TypeError:
+            pass
+        return entity
+
+    def clear_cache(self):
+        """Discard all memoized conversions, so that they reflect any change
+        to the provided vocabulary or the :attr:`converter`.
+        """
+        self.converted.clear()
+        self.aliases.clear()
 
 
 class XMLWriterMixin(object):
@@ -1,4 +1,23 @@
+import sys
+
 from setuptools import find_packages, setup
+from setuptools.command.build_py import build_py
+
+
+# modules which can only be compiled on newer versions of Python
+PYTHON_3_7_MODULES = [
+    ("psims", "aio"),
+]
+
+
+class BuildPyCommand(build_py):
+    def find_package_modules(self, package, package_dir):
+        modules = build_py.find_package_modules(self, package, package_dir)
+        if sys.version_info < (3, 7):
+            modules = [
+                (pkg, module, path) for pkg, module, path in modules
+                if (pkg, module) not in PYTHON_3_7_MODULES]
+        return modules
 
 
 with open("psims/version.py") as version_file:
@@ -41,6 +60,14 @@ setup(
         "sqlalchemy",
         "numpy"
     ],
+    cmdclass={
+        "build_py": BuildPyCommand,
+    },
+    classifiers=[
+        "Framework :: AsyncIO",
+    ],
+    # the asyncio front-ends in psims.aio require Python 3.7 or newer, and are
+    # left out of builds for older versions
     project_urls={
         'Source Code': 'https://github.com/mobiusklein/psims',
         'Issue Tracker': 'https://github.com/mobiusklein/psims/issues'